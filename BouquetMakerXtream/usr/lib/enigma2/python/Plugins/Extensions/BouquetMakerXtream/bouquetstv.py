@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .bouquetwriter import writeIfChanged
+from .plugin import debugs
+
+import re
+
+BOUQUETS_TV = "/etc/enigma2/bouquets.tv"
+
+
+def providerPattern(names):
+    """One regex for the bouquets.tv lines of all the providers in names."""
+    alternatives = "|".join(re.escape(str(name)) for name in set(names))
+    return re.compile("bouquetmakerxtream_(?:(?:live|vod|series)_(?:" + alternatives + ")_|(?:" + alternatives + ")\\.tv)")
+
+
+class BouquetsTv(object):
+    """
+    /etc/enigma2/bouquets.tv, held in memory for a run.
+
+    Loaded once, the lines of rebuilt or deleted providers are removed and the new ones
+    appended in memory, and save() writes the file once, atomically and only if it changed.
+    checkpoint() and rollback() let a cancelled run keep only what its finished providers did.
+    """
+
+    def __init__(self, path=BOUQUETS_TV):
+        self.path = path
+        self.saved = None
+
+        try:
+            with open(path, "r") as f:
+                self.lines = f.readlines()
+        except (IOError, OSError) as e:
+            print(e)
+            self.lines = []
+
+    def removeProviders(self, names):
+        """Drop the lines that reference bouquets of the providers in names."""
+        if not names:
+            return
+        search = providerPattern(names).search
+        self.lines = [line for line in self.lines if not search(line)]
+
+    def hasProvider(self, name):
+        search = providerPattern([name]).search
+        return any(search(line) for line in self.lines)
+
+    def contains(self, text):
+        return any(text in line for line in self.lines)
+
+    def append(self, text):
+        self.lines.extend(str(text).splitlines(True))
+
+    def checkpoint(self):
+        self.saved = list(self.lines)
+
+    def rollback(self):
+        """Undo the changes since checkpoint(). False if there was none, the model is then to be dropped."""
+        if self.saved is None:
+            return False
+        self.lines = list(self.saved)
+        return True
+
+    def save(self):
+        try:
+            if writeIfChanged(self.path, "".join(self.lines)) and debugs:
+                print("*** BouquetsTv saved ***", self.path)
+        except Exception as e:
+            print(e)
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .plugin import debugs
+
+import os
+import tempfile
+
+
+def writeIfChanged(path, text):
+    """
+    Write text to path unless the file already holds exactly that content.
+    Changed files are replaced atomically. Returns True if the file was written.
+    """
+    data = text if isinstance(text, bytes) else text.encode("utf-8")
+
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    return False
+    except (IOError, OSError):
+        pass
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".bmx_", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except:
+        try:
+            os.remove(tmp_path)
+        except:
+            pass
+        raise
+
+    return True
+
+
+class BouquetWriter(object):
+    """
+    Collects the bouquet files of one provider during a build.
+
+    Category bouquets are only written when their content differs from the file on disk,
+    the provider's group bouquet is assembled in memory and written once, and finish()
+    removes the provider's bouquet files that were not produced by this build. Lines for
+    bouquets.tv go to the bouquets_tv model when one is given.
+    """
+
+    def __init__(self, name, directory="/etc/enigma2", bouquets_tv=None):
+        self.name = str(name)
+        self.directory = directory
+        self.bouquets_tv = bouquets_tv
+        self.produced = set()
+        self.buffers = {}
+        self.written = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    def owns(self, filename):
+        for kind in ("live", "vod", "series"):
+            for bouquet in ("userbouquet", "subbouquet"):
+                if filename.startswith(bouquet + ".bouquetmakerxtream_" + kind + "_" + self.name + "_"):
+                    return True
+        return filename == "userbouquet.bouquetmakerxtream_" + self.name + ".tv"
+
+    def write(self, path, text):
+        self.produced.add(os.path.basename(path))
+        if writeIfChanged(path, text):
+            self.written += 1
+        else:
+            self.unchanged += 1
+
+    def append(self, path, text):
+        # bouquets.tv is shared with other providers, its model is saved by the build
+        if not self.owns(os.path.basename(path)):
+            if self.bouquets_tv is not None and path == self.bouquets_tv.path:
+                self.bouquets_tv.append(text)
+                return
+            with open(path, "a+") as f:
+                f.write(text)
+            return
+        self.buffers.setdefault(path, []).append(text)
+
+    def finish(self):
+        for path, chunks in self.buffers.items():
+            self.write(path, "".join(chunks))
+        self.buffers = {}
+
+        try:
+            for filename in os.listdir(self.directory):
+                if self.owns(filename) and filename not in self.produced:
+                    os.remove(os.path.join(self.directory, filename))
+                    self.removed += 1
+        except Exception as e:
+            print(e)
+
+        if debugs:
+            print("*** BouquetWriter ***", self.name, "written", self.written, "unchanged", self.unchanged, "removed", self.removed)
@@ -4,9 +4,23 @@
 from . import _
 from . import parsem3u
 from . import seriesparsem3u
+from . import seriesspool
+from . import servicerefs
+from . import sortkeys
+from . import streamrecords
+from . import streamstore
+from . import xmltvchannels
 from . import bouquet_globals as glob
+from . import bouquetstv
+from . import catalogcache
+from . import epgmatch
+from . import epgsources
 from . import globalfunctions as bmx
-from .plugin import epgimporter, cfg, playlists_json, skin_directory, debugs, dir_etc
+from . import responsecache
+from . import worker
+from . import xmltvguide
+from .bouquetwriter import BouquetWriter
+from .plugin import epgimporter, cfg, playlists_json, skin_directory, debugs, dir_tmp
 
 from Components.ActionMap import ActionMap
 from Components.Label import Label
@@ -17,6 +31,7 @@ from Screens.Screen import Screen
 
 import json
 import os
+import re
 
 
 try:
@@ -24,11 +39,6 @@ try:
 except:
     from urllib.parse import quote
 
-try:
-    from xml.dom import minidom
-except:
-    pass
-
 
 class BmxBuildBouquets(Screen):
     def __init__(self, session):
@@ -47,8 +57,8 @@ class BmxBuildBouquets(Screen):
         self.categories = []
 
         self["actions"] = ActionMap(["BMXActions"], {
-            "red": self.void,
-            "cancel": self.void,
+            "red": self.cancel,
+            "cancel": self.cancel,
         }, -2)
 
         self["action"] = Label(_("Building Bouquets..."))
@@ -62,6 +72,13 @@ class BmxBuildBouquets(Screen):
         self.unique_ref = 0
         self.progress_value = 0
         self.progress_range = 0
+        self.prefetched = {}
+        self.series_spool = None
+        self.channels_writer = None
+        self.channels_committed = False
+        self.guide_streams = None
+        self.epg_sources = None
+        self.bouquets_tv = None
 
         self.playlists_all = bmx.getPlaylistJson()
         self.playlist_info = glob.current_playlist["playlist_info"]
@@ -124,95 +141,103 @@ class BmxBuildBouquets(Screen):
             value = ord(j)
             self.unique_ref += value
 
-        self.starttimer = eTimer()
+        # stages run on a worker thread, the GUI is updated from the poll timer
+        self.runner = worker.StageRunner(on_stop=self.stopped)
+
+        self.polltimer = eTimer()
         try:
-            self.starttimer_conn = self.starttimer.timeout.connect(self.start)
+            self.polltimer_conn = self.polltimer.timeout.connect(self.runner.poll)
         except:
-            self.starttimer.callback.append(self.start)
-        self.starttimer.start(100, True)
+            self.polltimer.callback.append(self.runner.poll)
+        self.polltimer.start(100, False)
+
+        self.onClose.append(self.__onClose)
+
+        self.runner.start(self.start)
+
+    def __onClose(self):
+        self.polltimer.stop()
+        self.runner.shutdown()
 
     def void(self):
         if debugs:
             print("*** void ***")
         pass
 
+    def cancel(self):
+        if debugs:
+            print("*** cancel ***")
+        self["action"].setText(_("Cancelling..."))
+        self.runner.cancel()
+
+    def stopped(self):
+        if debugs:
+            print("*** stopped ***")
+        self.abortXmltvChannels()
+        # cancelled or failed part way, bouquets.tv and the sources file are left as they were
+        self.bouquets_tv = None
+        self.epg_sources = None
+        self.closeSeriesSpool()
+        responsecache.prune()
+        # category bouquets may already have been rewritten
+        bmx.refreshBouquets()
+        self.close(False)
+
     def nextJob(self, actiontext, function):
         if debugs:
             print("*** nextJob ***", actiontext)
-        self["action"].setText(actiontext)
-        self.timer = eTimer()
-        try:
-            self.timer_conn = self.timer.timeout.connect(function)
-        except:
-            self.timer.callback.append(function)
-        self.timer.start(50, True)
+        self.runner.post(self["action"].setText, actiontext)
+        self.runner.submit(function)
 
     def start(self):
         if debugs:
             print("*** start ***")
 
         glob.get_series_failed = False
-        self["progress"].setRange((0, self.progress_range))
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setRange, (0, self.progress_range))
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.deleteExistingRefs()
 
-        self.timer = eTimer()
-
-        try:
-            self.timer_conn = self.timer.timeout.connect(self.makeUrlList)
-        except:
-            try:
-                self.timer.callback.append(self.makeUrlList)
-            except:
-                self.makeUrlList()
-        self.timer.start(10, True)
+        self.runner.submit(self.makeUrlList)
 
     def deleteExistingRefs(self):
         if debugs:
             print("*** deleteExistingRefs ***")
-        with open("/etc/enigma2/bouquets.tv", "r+") as f:
-            lines = f.readlines()
-            f.seek(0)
-            f.truncate()
+        # bouquets.tv is changed in memory and written by saveBouquetsTv()
+        self.bouquets_tv = bouquetstv.BouquetsTv()
+        self.bouquets_tv.removeProviders([self.name, self.original_name])
 
-            for line in lines:
-                if "bouquetmakerxtream_live_" + str(self.name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_vod_" + str(self.name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_series_" + str(self.name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_" + str(self.name) + ".tv" in line:
-                    continue
-                if "bouquetmakerxtream_live_" + str(self.original_name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_vod_" + str(self.original_name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_series_" + str(self.original_name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_" + str(self.original_name) + ".tv" in line:
-                    continue
-                f.write(line)
+        # the provider's bouquet files are left in place, BouquetWriter only rewrites
+        # the ones that change and removes the ones not produced again in finished()
+        self.writer = BouquetWriter(self.name, bouquets_tv=self.bouquets_tv)
+
+    def purgeOldFiles(self):
+        # only once the new files are written, a cancelled build leaves the old ones to the
+        # bouquets.tv and sources it did not save
+        if debugs:
+            print("*** purgeOldFiles ***")
 
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_live_" + str(self.name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_vod_" + str(self.name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_series_" + str(self.name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_" + str(self.name))
+        # renamed playlist, nothing of the old name is kept. The patterns are anchored, the
+        # new name's files are already written and may start with the old name
+        if str(self.original_name) != str(self.name):
+            original_name = re.escape(str(self.original_name))
+            bmx.purge("/etc/enigma2", "^(?:user|sub)bouquet\\.bouquetmakerxtream_(?:live|vod|series)_" + original_name + "_")
+            bmx.purge("/etc/enigma2", "^userbouquet\\.bouquetmakerxtream_" + original_name + "\\.tv$")
 
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_live_" + str(self.original_name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_vod_" + str(self.original_name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_series_" + str(self.original_name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_" + str(self.original_name))
+            if epgimporter:
+                bmx.purge("/etc/epgimport", "^bouquetmakerxtream\\." + original_name + "\\.")
 
-        if epgimporter:
-            bmx.purge("/etc/epgimport", "bouquetmakerxtream." + str(self.name))
-            bmx.purge("/etc/epgimport", "bouquetmakerxtream." + str(self.original_name))
+        # a channels file written by this run replaced the old one, any other is stale
+        if epgimporter and not self.channels_committed:
+            bmx.purge("/etc/epgimport", "^bouquetmakerxtream\\." + re.escape(str(self.name)) + "\\.")
 
     def makeUrlList(self):
         if debugs:
             print("*** makeUrlList ***")
 
         if self.playlist_info["playlist_type"] == "xtream":
+            self.prefetchXtream()
+
             if self.settings["show_live"]:
                 self.nextJob(_("Downloading live data..."), self.downloadXtreamLive)
                 # self.downloadXtreamLive()
@@ -233,6 +258,23 @@ class BmxBuildBouquets(Screen):
             self.nextJob(_("Loading local playlist..."), self.parseLocal)
             # self.parseLocal()
 
+    def prefetchXtream(self):
+        # every enabled endpoint downloads at once, each stage then only waits for its own
+        url_list = []
+        if self.settings["show_live"]:
+            url_list += [[self.live_categories_api, 0], [self.live_streams_api, 3]]
+        if self.settings["show_vod"]:
+            url_list += [[self.vod_categories_api, 1], [self.vod_streams_api, 4]]
+        if self.settings["show_series"]:
+            url_list += [[self.series_categories_api, 2], [self.series_streams_api, 5]]
+        self.prefetched = bmx.prefetchXtreamApiCategories(url_list)
+
+    def downloadXtreamApiCategory(self, url):
+        future = self.prefetched.pop(url[0], None)
+        if future:
+            return self.runner.waitFor(future)
+        return bmx.downloadXtreamApiCategory(url)
+
     def downloadXtreamLive(self):
         if debugs:
             print("*** downloadXtreamLive ***")
@@ -244,7 +286,7 @@ class BmxBuildBouquets(Screen):
         self.url_list = [[self.live_categories_api, 0], [self.live_streams_api, 3]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.downloadXtreamApiCategory(url)
 
             category = result[0]
             response = result[1]
@@ -254,27 +296,11 @@ class BmxBuildBouquets(Screen):
                     self.live_categories = response
 
                 elif category == 3:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "stream_id": item.get("stream_id"),
-                            "stream_icon": item.get("stream_icon"),
-                            "epg_channel_id": item.get("epg_channel_id"),
-                            "added": item.get("added"),
-                            "category_id": item.get("category_id"),
-                            "custom_sid": item.get("custom_sid"),
-                            "tv_archive": item.get("tv_archive"),
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "stream_id", "stream_icon", "epg_channel_id",
-                            "added", "category_id", "custom_sid", "tv_archive"
-                        ])
-                    )
-                    self.live_streams = list(response)
+                    self.live_streams = response
                 response = None
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.nextJob(_("Processing live data..."), self.loadLive)
 
     def downloadXtreamVod(self):
@@ -288,7 +314,7 @@ class BmxBuildBouquets(Screen):
         self.url_list = [[self.vod_categories_api, 1], [self.vod_streams_api, 4]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.downloadXtreamApiCategory(url)
 
             category = result[0]
             response = result[1]
@@ -297,24 +323,12 @@ class BmxBuildBouquets(Screen):
                 if category == 1:
                     self.vod_categories = response
                 elif category == 4:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "stream_id": item.get("stream_id"),
-                            "added": item.get("added"),
-                            "category_id": item.get("category_id"),
-                            "container_extension": item.get("container_extension")
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "stream_id", "added", "category_id", "container_extension"
-                        ])
-                    )
-                    self.vod_streams = list(response)
+                    self.vod_streams = response
 
                 response = None
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.nextJob(_("Processing VOD data..."), self.loadVod)
 
     def downloadXtreamSeries(self):
@@ -327,7 +341,7 @@ class BmxBuildBouquets(Screen):
         self.url_list = [[self.series_categories_api, 2], [self.series_streams_api, 5]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.downloadXtreamApiCategory(url)
 
             category = result[0]
             response = result[1]
@@ -337,36 +351,25 @@ class BmxBuildBouquets(Screen):
                     self.series_categories = response
 
                 elif category == 5:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "series_id": item.get("series_id"),
-                            "last_modified": item.get("last_modified"),
-                            "category_id": item.get("category_id")
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "series_id", "last_modified", "category_id"
-                        ])
-                    )
-                    self.series_streams = list(response)
+                    self.series_streams = response
                 response = None
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.nextJob(_("Download series get.php file..."), self.loadSeries)
 
     def downloadExternal(self):
         if debugs:
             print("*** downloadExternal ***")
 
-        response = bmx.downloadM3U8File(self.external_url)
+        path = bmx.spoolFile(self.external_url, dir_tmp(), timeout=(20, 300))[0]
 
-        if response:
-            self.parseFullM3u8Data(response)
-            response = None
+        if path:
+            self.parseFullM3u8Data(path)
+            bmx.releaseSpoolFile(path)
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.nextJob(_("Processing external data..."), self.loadLive)
 
     def parseLocal(self):
@@ -374,16 +377,13 @@ class BmxBuildBouquets(Screen):
             print("*** parseLocal (load local file) ***")
 
         # Build the full local file path
-        local_path = os.path.join(dir_etc, self.local_file)
+        local_path = os.path.join(cfg.local_location.value, self.local_file)
 
         # Check if the file exists before reading
         if os.path.exists(local_path):
             try:
-                with open(local_path, "r") as f:
-                    response = f.read()
-                if response:
-                    self.parseFullM3u8Data(response)
-                    response = None
+                # parsed line by line, the file is never read into one string
+                self.parseFullM3u8Data(local_path)
             except Exception as e:
                 if debugs:
                     print("Error reading local file:", e)
@@ -393,12 +393,12 @@ class BmxBuildBouquets(Screen):
 
         self.nextJob(_("Processing local data..."), self.loadLive)
 
-    def parseFullM3u8Data(self, response=None):
+    def parseFullM3u8Data(self, path):
         if debugs:
             print("*** parseFullM3u8Data ***")
 
         # --- Step 1: Parse the playlist streams ---
-        self.live_streams, self.vod_streams, self.series_streams = parsem3u.parseM3u8Playlist(response)
+        self.live_streams, self.vod_streams, self.series_streams = parsem3u.parseM3u8File(path)
 
         # --- Step 2: Build categories ---
         if debugs:
@@ -434,42 +434,9 @@ class BmxBuildBouquets(Screen):
         if debugs:
             print("*** Building M3U8 stream JSON data ***")
 
-        self.live_streams = [
-            {
-                "epg_channel_id": str(x[0]),
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "stream_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.live_streams
-        ]
-
-        self.vod_streams = [
-            {
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "stream_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.vod_streams
-        ]
-
-        self.series_streams = [
-            {
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "series_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.series_streams
-        ]
+        self.live_streams = streamrecords.fromM3u(self.live_streams, streamrecords.LiveStream)
+        self.vod_streams = streamrecords.fromM3u(self.vod_streams, streamrecords.VodStream)
+        self.series_streams = streamrecords.fromM3u(self.series_streams, streamrecords.SeriesStream)
 
         if debugs:
             print("*** M3U8 parsing complete ***")
@@ -484,20 +451,28 @@ class BmxBuildBouquets(Screen):
             self.live_stream_data = []
             stream_type = self.settings["live_type"]
 
-            if self.settings["live_category_order"] == "alphabetical":
-                self.live_categories.sort(key=lambda k: k["category_name"].lower())
+            # catchup streams and their epg channel, for the local xmltv guide
+            if self.playlist_info["playlist_type"] == "xtream" and cfg.catchup_on.value and cfg.xmltv_guide.value:
+                self.guide_streams = {}
 
-            if self.settings["live_stream_order"] == "alphabetical":
-                self.live_streams.sort(key=lambda x: x["name"].lower())
+            if self.settings["live_category_order"] == "alphabetical":
+                self.live_categories.sort(key=lambda k: sortkeys.sortKey(k["category_name"]))
 
-            elif self.settings["live_stream_order"] == "added":
-                self.live_streams.sort(key=lambda x: x["added"], reverse=True)
+            store = streamstore.StreamStore(self.live_streams)
+            stream_order = self.settings["live_stream_order"]
+            rendered = [None] * len(store)
 
             # Convert to sets for faster membership testing
             live_categories_hidden = set(self.data["live_categories_hidden"])
             live_streams_hidden = set(self.data["live_streams_hidden"])
 
-            for channel in self.live_streams:
+            rows = []
+            stream_ids = []
+            names = []
+            custom_sids = []
+
+            for row in store.sortedRows(stream_order):
+                channel = store.streams[row]
                 category_id = channel.get("category_id")
                 name = channel.get("name") or ""
                 name = name.replace(":", "").replace('"', "").replace('•', "-").strip("- ").strip()
@@ -516,44 +491,46 @@ class BmxBuildBouquets(Screen):
                 if cfg.catchup.value and catchup == 1:
                     name = str(cfg.catchup_prefix.value) + str(name)
 
-                try:
-                    bouquet_id1 = int(stream_id) // 65535
-                    bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
-                except:
-                    continue
+                if self.guide_streams is not None and catchup == 1 and channel.get("epg_channel_id"):
+                    self.guide_streams[str(stream_id)] = [str(channel.get("epg_channel_id")), channel.get("tv_archive_duration") or 0]
 
-                service_ref = "1:0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:http%3a//example.m3u8"
-                custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:"
+                rows.append(row)
+                stream_ids.append(stream_id)
+                names.append(str(name))
+                custom_sids.append(servicerefs.customSid(channel.get("custom_sid")))
 
-                if "custom_sid" in channel and channel["custom_sid"] and str(channel["custom_sid"]) not in ("null", "None", "0", ":0:0:0:0:0:0:0:0:0:") and len(channel["custom_sid"]) > 16:
-                    custom_sid = str(channel["custom_sid"])
-                    if custom_sid[0].isdigit():
-                        custom_sid = custom_sid[1:]
+            # #SERVICE lines and epg service refs of the shown channels, rendered as one batch
+            encoder = self.serviceRefEncoder(stream_type, "live")
 
-                    service_ref = str(":".join(custom_sid.split(":")[:7])) + ":0:0:0:http%3a//example.m3u8"
+            if self.playlist_info["playlist_type"] == "xtream":
+                bouquet_strings = encoder.render(stream_ids, names, extensions=self.output, custom_sids=custom_sids)
+            else:
+                bouquet_strings = encoder.render(stream_ids, names, sources=[store.streams[row].get("source", "") for row in rows], custom_sids=custom_sids)
 
-                xml_str = ""
-                channel_id = channel.get("epg_channel_id")
+            # xtream epg channels go straight to the channels file, which buildXmltvChannels commits
+            self.abortXmltvChannels()
+            if self.playlist_info["playlist_type"] == "xtream" and epgimporter:
+                self.channels_writer = xmltvchannels.ChannelsWriter(xmltvchannels.channelsPath(self.name))
+                service_refs = encoder.serviceRefs(stream_ids, custom_sids)
+            else:
+                service_refs = [None] * len(rows)
 
-                if channel_id:
-                    channel_id = channel_id.replace("&", "&amp;")
-                    xml_str = '\t<channel id="' + str(channel_id) + '">' + str(service_ref) + "</channel><!-- " + str(name) + " -->\n"
+            matched = self.matchEpgChannels(store, rows) if self.channels_writer and cfg.epg_match.value else {}
 
-                bouquet_string = ""
+            for row, name, bouquet_string, service_ref in zip(rows, names, bouquet_strings, service_refs):
+                channel = store.streams[row]
+                channel_id = channel.get("epg_channel_id") or matched.get(row)
 
-                if self.playlist_info["playlist_type"] == "xtream":
-                    bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(self.host_encoded) + "/live/" + str(self.username) + "/" + str(self.password) + "/" + str(stream_id) + "." + str(self.output) + ":" + str(name) + "\n"
-                else:
-                    source = quote(channel.get("source", ""))
-                    bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(source) + ":" + str(name) + "\n"
+                if channel_id and self.channels_writer:
+                    self.channels_writer.add(channel_id, service_ref, name)
 
-                self.live_stream_data.append({
-                    "category_id": str(category_id),
-                    "xml_str": str(xml_str),
-                    "bouquet_string": bouquet_string,
-                    "name": str(name),
-                    "added": str(channel.get("added", "0"))
-                })
+                rendered[row] = streamrecords.BouquetLine(
+                    category_id=str(channel.get("category_id")),
+                    bouquet_string=bouquet_string,
+                    name=name,
+                    added=str(channel.get("added", "0"))
+                )
+                self.live_stream_data.append(rendered[row])
 
             if self.live_stream_data:
 
@@ -567,13 +544,12 @@ class BmxBuildBouquets(Screen):
 
                 bouquet_filename = ""
 
-                # Create dictionary for faster category lookups (reduces repeated scans)
+                # category slices come from the store's index, already in stream order
                 cat_map = {}
-                for stream in self.live_stream_data:
-                    cat_id = stream["category_id"]
-                    if cat_id not in cat_map:
-                        cat_map[cat_id] = []
-                    cat_map[cat_id].append(stream)
+                for category_id in store.categories:
+                    lines = [rendered[row] for row in store.categoryRows(category_id, stream_order) if rendered[row]]
+                    if lines:
+                        cat_map[category_id] = lines
 
                 for category in self.live_categories:
                     category_id = category.get("category_id")
@@ -592,8 +568,7 @@ class BmxBuildBouquets(Screen):
                     bouquet_tv_string += '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + bouquet + ".bouquetmakerxtream_live_" + str(self.name) + "_" + bmx.safeName(category["category_name"]) + '.tv" ORDER BY bouquet\n'
 
                 if bouquet_filename:
-                    with open(bouquet_filename, "a+") as f:
-                        f.write(str(bouquet_tv_string))
+                    self.writer.append(bouquet_filename, str(bouquet_tv_string))
 
                     for category in self.live_categories:
                         category_id = category.get("category_id")
@@ -618,19 +593,21 @@ class BmxBuildBouquets(Screen):
                         else:
                             bouquet_filename = "/etc/enigma2/userbouquet.bouquetmakerxtream_live_" + str(bouquet_title) + ".tv"
 
-                        with open(bouquet_filename, "w+") as f:
-                            f.write(output_string)
+                        self.writer.write(bouquet_filename, output_string)
 
                 # Free up memory once finished
                 cat_map.clear()
 
             self.progress_value += 1
-            self["progress"].setValue(self.progress_value)
+            self.runner.post(self["progress"].setValue, self.progress_value)
 
             # Continue to next section
             if self.playlist_info["playlist_type"] == "xtream":
                 if self.live_categories and epgimporter:
                     self.buildXmltvSource()
+                if self.guide_streams:
+                    self.buildXmltvGuide()
+                self.guide_streams = None
                 self.live_categories = []
                 self.live_streams = []
                 self.live_stream_data = []
@@ -653,6 +630,13 @@ class BmxBuildBouquets(Screen):
                     self.finished()
                     return
 
+    def serviceRefEncoder(self, stream_type, path):
+        # xtream streams play from <host>/<path>/<username>/<password>/<stream_id>.<extension>
+        url_prefix = None
+        if self.playlist_info["playlist_type"] == "xtream":
+            url_prefix = str(self.host_encoded) + "/" + path + "/" + str(self.username) + "/" + str(self.password) + "/"
+        return servicerefs.ServiceRefEncoder(stream_type, self.unique_ref, url_prefix)
+
     def loadVod(self):
         if debugs:
             print("*** loadVod ***")
@@ -664,20 +648,23 @@ class BmxBuildBouquets(Screen):
             stream_type = self.settings["vod_type"]
 
             if self.settings["vod_category_order"] == "alphabetical":
-                self.vod_categories.sort(key=lambda k: k["category_name"].lower())
+                self.vod_categories.sort(key=lambda k: sortkeys.sortKey(k["category_name"]))
 
-            if self.settings["vod_stream_order"] == "alphabetical":
-                self.vod_streams.sort(key=lambda x: x["name"].lower())
-
-            elif self.settings["vod_stream_order"] == "added":
-                self.vod_streams.sort(key=lambda x: x["added"], reverse=True)
+            store = streamstore.StreamStore(self.vod_streams)
+            stream_order = self.settings["vod_stream_order"]
+            rendered = [None] * len(store)
 
             # Convert to sets for faster membership testing
 
             vod_categories_hidden = set(self.data["vod_categories_hidden"])
             vod_streams_hidden = set(self.data["vod_streams_hidden"])
 
-            for channel in self.vod_streams:
+            rows = []
+            stream_ids = []
+            names = []
+
+            for row in store.sortedRows(stream_order):
+                channel = store.streams[row]
                 category_id = channel.get("category_id")
                 name = channel.get("name") or ""
                 name = name.replace(":", "").replace('"', "").replace('•', "-").strip("- ").strip()
@@ -691,28 +678,27 @@ class BmxBuildBouquets(Screen):
                 except:
                     continue
 
-                try:
-                    bouquet_id1 = int(stream_id) // 65535
-                    bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
-                except:
-                    continue
-
-                custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:"
-                bouquet_string = ""
+                rows.append(row)
+                stream_ids.append(stream_id)
+                names.append(str(name))
 
-                if self.playlist_info["playlist_type"] == "xtream":
-                    extension = channel["container_extension"]
-                    bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(self.host_encoded) + "/movie/" + str(self.username) + "/" + str(self.password) + "/" + str(stream_id) + "." + str(extension) + ":" + str(name) + "\n"
-                else:
-                    source = quote(channel.get("source", ""))
-                    bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(source) + ":" + str(name) + "\n"
+            # #SERVICE lines of the shown movies, rendered as one batch
+            encoder = self.serviceRefEncoder(stream_type, "movie")
 
-                self.vod_stream_data.append({
-                    "category_id": str(category_id),
-                    "bouquet_string": bouquet_string,
-                    "name": str(name),
-                    "added": str(channel.get("added", "0"))
-                })
+            if self.playlist_info["playlist_type"] == "xtream":
+                bouquet_strings = encoder.render(stream_ids, names, extensions=[store.streams[row]["container_extension"] for row in rows])
+            else:
+                bouquet_strings = encoder.render(stream_ids, names, sources=[store.streams[row].get("source", "") for row in rows])
+
+            for row, name, bouquet_string in zip(rows, names, bouquet_strings):
+                channel = store.streams[row]
+                rendered[row] = streamrecords.BouquetLine(
+                    category_id=str(channel.get("category_id")),
+                    bouquet_string=bouquet_string,
+                    name=name,
+                    added=str(channel.get("added", "0"))
+                )
+                self.vod_stream_data.append(rendered[row])
 
             if self.vod_stream_data:
 
@@ -726,13 +712,12 @@ class BmxBuildBouquets(Screen):
 
                 bouquet_filename = ""
 
-                # Create dictionary for faster category lookups (reduces repeated scans)
+                # category slices come from the store's index, already in stream order
                 cat_map = {}
-                for stream in self.vod_stream_data:
-                    cat_id = stream["category_id"]
-                    if cat_id not in cat_map:
-                        cat_map[cat_id] = []
-                    cat_map[cat_id].append(stream)
+                for category_id in store.categories:
+                    lines = [rendered[row] for row in store.categoryRows(category_id, stream_order) if rendered[row]]
+                    if lines:
+                        cat_map[category_id] = lines
 
                 for category in self.vod_categories:
                     category_id = category.get("category_id")
@@ -751,8 +736,7 @@ class BmxBuildBouquets(Screen):
                     bouquet_tv_string += '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + bouquet + ".bouquetmakerxtream_vod_" + str(self.name) + "_" + bmx.safeName(category["category_name"]) + '.tv" ORDER BY bouquet\n'
 
                 if bouquet_filename:
-                    with open(bouquet_filename, "a+") as f:
-                        f.write(str(bouquet_tv_string))
+                    self.writer.append(bouquet_filename, str(bouquet_tv_string))
 
                     for category in self.vod_categories:
                         category_id = category.get("category_id")
@@ -777,8 +761,7 @@ class BmxBuildBouquets(Screen):
                         else:
                             bouquet_filename = "/etc/enigma2/userbouquet.bouquetmakerxtream_vod_" + str(bouquet_title) + ".tv"
 
-                        with open(bouquet_filename, "w+") as f:
-                            f.write(output_string)
+                        self.writer.write(bouquet_filename, output_string)
 
                 # Free up memory once finished
                 self.vod_categories = []
@@ -787,7 +770,7 @@ class BmxBuildBouquets(Screen):
                 cat_map.clear()
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
 
         if self.playlist_info["playlist_type"] == "xtream":
             if self.settings["show_series"]:
@@ -808,11 +791,10 @@ class BmxBuildBouquets(Screen):
 
         if glob.current_playlist["settings"]["show_series"] and self.series_categories and self.series_streams:
             self.clearCaches()
-            self.series_stream_data = []
             # stream_type = self.settings["vod_type"]
 
             if self.settings["vod_category_order"] == "alphabetical":
-                self.series_categories.sort(key=lambda k: k["category_name"].lower())
+                self.series_categories.sort(key=lambda k: sortkeys.sortKey(k["category_name"]))
 
             # Convert to sets for faster membership testing
 
@@ -826,7 +808,7 @@ class BmxBuildBouquets(Screen):
                     continue
 
             self.progress_value += 1
-            self["progress"].setValue(self.progress_value)
+            self.runner.post(self["progress"].setValue, self.progress_value)
 
             if self.playlist_info["playlist_type"] == "xtream":
                 geturl = str(self.host) + "/get.php?username=" + str(self.username) + "&password=" + str(self.password) + "&type=m3u_plus&output=" + str(self.output)
@@ -841,13 +823,23 @@ class BmxBuildBouquets(Screen):
                 if method == "curl":
                     print("*** streaming parse started (curl) ***")
                     self.nextJob(_("Parsing series data..."), lambda: self.parseXtreamSeries_streaming(result))
+                elif method == "file":
+                    try:
+                        with open(result, "rb") as f:
+                            self.spoolSeries(f)
+                    finally:
+                        bmx.releaseSpoolFile(result)
+
+                    result = None
+
+                    self.nextJob(_("Processing series data..."), self.createSeriesBouquets)
                 elif method in ("wget", "requests"):
                     print("*** parsing non-streaming result ***")
-                    self.series_streams = seriesparsem3u.parseM3u8Playlist(result)
+                    self.spoolSeries(parsem3u.asLines(result))
 
                     result = None
 
-                    self.nextJob(_("Processing series data..."), self.processSeries)
+                    self.nextJob(_("Processing series data..."), self.createSeriesBouquets)
                 else:
                     print("*** all methods failed ***")
                     self.finished()
@@ -859,92 +851,75 @@ class BmxBuildBouquets(Screen):
             print("*** parseXtreamSeries_streaming ***")
 
         try:
-            self.series_streams = seriesparsem3u.parseM3u8Playlist_streaming(pipe_process)
+            self.spoolSeries(iter(pipe_process.stdout.readline, b""))
         finally:
             pipe_process.stdout.close()
             pipe_process.wait()  # Ensure curl finishes
 
-        if not self.series_streams:
+        if not self.series_spool:
             self.finished()
             return
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
-        self.nextJob(_("Processing series data..."), self.processSeries)
+        self.runner.post(self["progress"].setValue, self.progress_value)
+        self.nextJob(_("Processing series data..."), self.createSeriesBouquets)
 
     def processSeries(self):
         if debugs:
             print("*** processSeries ***")
 
-        if self.settings["vod_stream_order"] == "alphabetical":
-            self.series_streams.sort(key=lambda x: x["name"].lower())
-
-        elif self.settings["vod_stream_order"] == "added":
-            self.series_streams.sort(key=lambda x: x["added"], reverse=True)
+        # m3u playlists: the episodes are already in memory, they go through the spool in stream order
+        store = streamstore.StreamStore(self.series_streams, "series_id")
+        encoder = servicerefs.ServiceRefEncoder(self.settings["vod_type"], self.unique_ref)
+        self.series_spool = seriesspool.SeriesSpool(dir_tmp())
 
-        BATCH_SIZE = 20000
-        stream_type = self.settings["vod_type"]
-
-        def process_stream_batch(streams_batch):
-            batch_data = []
-            for channel in streams_batch:
-
-                category_id = channel.get("category_id")
-                name = channel.get("name") or ""
-                name = name.replace(":", "").replace('"', "").replace('•', "-").strip("- ").strip()
-                stream_id = channel.get("series_id")
-
-                if not category_id or not name:
-                    continue
-
-                try:
-                    stream_id = int(stream_id)
-                except:
-                    continue
+        for row in store.sortedRows(self.settings["vod_stream_order"]):
+            bouquet_string = self.seriesServiceLine(store.streams[row], encoder)
+            if bouquet_string:
+                self.series_spool.add(store.categoryId(row), bouquet_string)
 
-                try:
-                    bouquet_id1 = int(stream_id) // 65535
-                    bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
-                except:
-                    continue
+        self.series_streams = []
+        self.createSeriesBouquets()
 
-                custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:"
-                bouquet_string = ""
+    def spoolSeries(self, lines):
+        # xtream get.php: episodes go from the parser straight to the spool, none are kept
+        encoder = servicerefs.ServiceRefEncoder(self.settings["vod_type"], self.unique_ref)
+        sort_key = seriesspool.nameKey() if self.settings["vod_stream_order"] == "alphabetical" else None
+        self.series_spool = seriesspool.SeriesSpool(dir_tmp(), sort_key)
 
-                source = quote(channel.get("source", ""))
-                bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(source) + ":" + str(name) + "\n"
+        for channel in seriesparsem3u.iterSeriesStreams(lines):
+            bouquet_string = self.seriesServiceLine(channel, encoder)
+            if bouquet_string:
+                self.series_spool.add(str(channel.get("category_id")), bouquet_string)
 
-                batch_data.append({
-                    "category_id": str(category_id),
-                    "bouquet_string": bouquet_string,
-                    "name": str(name),
-                    "added": str(channel.get("added", "0"))
-                })
-            return batch_data
+        self.series_streams = []
 
-        # Process all streams in manageable batches
-        total_streams = len(self.series_streams)
-        all_series_data = []
+    def seriesServiceLine(self, channel, encoder):
+        category_id = channel.get("category_id")
+        name = channel.get("name") or ""
+        name = name.replace(":", "").replace('"', "").replace('•', "-").strip("- ").strip()
+        stream_id = channel.get("series_id")
 
-        for batch_start in range(0, total_streams, BATCH_SIZE):
-            batch_end = min(batch_start + BATCH_SIZE, total_streams)
-            batch = self.series_streams[batch_start:batch_end]
-            batch_data = process_stream_batch(batch)
-            all_series_data.extend(batch_data)
+        if not category_id or not name:
+            return None
 
-            # Clear memory between batches
-            if batch_start % 200 == 0:  # Clear memory every 2 batches
-                self.clearCaches()
+        try:
+            stream_id = int(stream_id)
+        except:
+            return None
 
-        self.series_stream_data = all_series_data
+        return encoder.line(stream_id, str(name), source=channel.get("source", ""))
 
-        self.createSeriesBouquets()
+    def closeSeriesSpool(self):
+        if self.series_spool is not None:
+            self.series_spool.close()
+            self.series_spool = None
 
     def createSeriesBouquets(self):
         if debugs:
             print("*** createSeriesBouquets ***")
 
-        if not self.series_stream_data:
+        if not self.series_spool:
             self.finished()
             return
 
@@ -958,13 +933,8 @@ class BmxBuildBouquets(Screen):
 
         bouquet_filename = ""
 
-        # Build dictionary for fast category lookups
-        cat_map = {}
-        for stream in self.series_stream_data:
-            cat_id = str(stream["category_id"])
-            if cat_id not in cat_map:
-                cat_map[cat_id] = []
-            cat_map[cat_id].append(stream)
+        # the rendered episodes of each category are in the spool
+        cat_map = self.series_spool
 
         # Write top-level bouquet entries
         for category in self.series_categories:
@@ -988,8 +958,7 @@ class BmxBuildBouquets(Screen):
             bouquet_tv_string += '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + bouquet + ".bouquetmakerxtream_series_" + str(self.name) + "_" + bmx.safeName(category["category_name"]) + '.tv" ORDER BY bouquet\n'
 
         if bouquet_filename:
-            with open(bouquet_filename, "a+") as f:
-                f.write(str(bouquet_tv_string))
+            self.writer.append(bouquet_filename, str(bouquet_tv_string))
 
             category_batches = [self.series_categories[i:i + 10] for i in range(0, len(self.series_categories), 10)]
 
@@ -1017,143 +986,113 @@ class BmxBuildBouquets(Screen):
                     else:
                         output_string += "#NAME " + "Series - " + category["category_name"] + "\n"
 
-                    for stream in cat_map[str(category_id)]:
-                        output_string += stream["bouquet_string"]
+                    output_string += cat_map.text(str(category_id))
 
                     if cfg.groups.value:
                         filename = "/etc/enigma2/subbouquet.bouquetmakerxtream_series_" + str(bouquet_title) + ".tv"
                     else:
                         filename = "/etc/enigma2/userbouquet.bouquetmakerxtream_series_" + str(bouquet_title) + ".tv"
 
-                    with open(filename, "w+") as f:
-                        f.write(output_string)
+                    self.writer.write(filename, output_string)
 
+        self.closeSeriesSpool()
         self.clearCaches()
         self.finished()
 
     def buildBouquetTvGroupedFile(self):
         if debugs:
             print("*** buildBouquetTvGroupedFile ***")
-        exists = False
         groupname = "userbouquet.bouquetmakerxtream_" + str(self.name) + ".tv"
-        with open("/etc/enigma2/bouquets.tv", "r") as f:
-            for ln, line in enumerate(f):
-                if str(groupname) in line:
-                    exists = True
-                    break
 
-        if not exists:
-            with open("/etc/enigma2/bouquets.tv", "a+") as f:
-                bouquet_tv_string = '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + str(groupname) + '" ORDER BY bouquet\n'
-                f.write(str(bouquet_tv_string))
+        if not self.bouquets_tv.contains(groupname):
+            bouquet_tv_string = '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + str(groupname) + '" ORDER BY bouquet\n'
+            self.bouquets_tv.append(bouquet_tv_string)
 
         self.bouquet_tv = True
 
     def buildXmltvSource(self):
         if debugs:
             print("*** buildXmltvSource ***")
-        import xml.etree.ElementTree as ET
-
-        file_path = "/etc/epgimport/"
-        epg_filename = "bouquetmakerxtream." + str(self.name) + ".channels.xml"
-        channel_path = os.path.join(file_path, epg_filename)
-        source_file = "/etc/epgimport/bouquetmakerxtream.sources.xml"
-
-        if not os.path.isfile(source_file) or os.stat(source_file).st_size == 0:
-            with open(source_file, "w") as f:
-                xml_str = '<?xml version="1.0" encoding="utf-8"?>\n'
-                xml_str += "<sources>\n"
-                xml_str += '<sourcecat sourcecatname="BouquetMakerXtream EPG">\n'
-                xml_str += "</sourcecat>\n"
-                xml_str += "</sources>\n"
-                f.write(xml_str)
 
+        epg_offset = 0
         try:
-            tree = ET.parse(source_file, parser=ET.XMLParser(encoding="utf-8"))
-            root = tree.getroot()
-            sourcecat = root.find("sourcecat")
-
-            for elem in root.iter():
-                for child in list(elem):
-                    description = ""
-                    if child.tag == "source":
-                        try:
-                            description = child.find("description").text
-
-                            if str(self.name) == str(description):
-                                elem.remove(child)
-                        except:
-                            pass
-
-            epg_offset = 0
-            try:
-                epg_offset = int(self.settings.get("epg_offset", 0))
-            except:
-                pass
+            epg_offset = int(self.settings.get("epg_offset", 0))
+        except:
+            pass
 
-            if epg_offset > 0:
-                offset_str = "-{0:02d}00".format(epg_offset)
-            elif epg_offset < 0:
-                offset_str = "{0:02d}00".format(abs(epg_offset))
-            else:
-                offset_str = "0000"
-
-            source = ET.SubElement(
-                sourcecat,
-                "source",
-                type="gen_xmltv",
-                nocheck="1",
-                offset=offset_str,
-                channels=channel_path
-            )
+        if epg_offset > 0:
+            offset_str = "-{0:02d}00".format(epg_offset)
+        elif epg_offset < 0:
+            offset_str = "{0:02d}00".format(abs(epg_offset))
+        else:
+            offset_str = "0000"
+
+        # the sources file is read once per run and written by saveXmltvSources()
+        if self.epg_sources is None:
+            self.epg_sources = epgsources.EpgSources()
+
+        self.epg_sources.setSource(self.name, xmltvchannels.channelsPath(self.name), self.xmltv_api, offset_str)
 
-            description = ET.SubElement(source, "description")
-            description.text = str(self.name)
+        self.buildXmltvChannels()
+
+    def saveBouquetsTv(self):
+        if self.bouquets_tv is not None:
+            self.bouquets_tv.save()
+            self.bouquets_tv = None
 
-            url = ET.SubElement(source, "url")
-            url.text = str(self.xmltv_api)
+    def saveXmltvSources(self):
+        if self.epg_sources is not None:
+            self.epg_sources.save()
+            self.epg_sources = None
 
-            tree.write(source_file)
+    def buildXmltvGuide(self):
+        if debugs:
+            print("*** buildXmltvGuide ***")
 
+        self.runner.post(self["action"].setText, _("Updating XMLTV guide..."))
+
+        try:
+            xmltvguide.updateGuide(self.xmltv_api, self.host, self.username, self.guide_streams, self.runner.checkCancelled)
+        except worker.Cancelled:
+            raise
         except Exception as e:
             print(e)
 
+    def matchEpgChannels(self, store, rows):
+        """Epg channel ids, matched by name in the provider's XMLTV, of the rows it sent without one. row -> id."""
+        unmatched = [row for row in rows if not store.epg_ids[row]]
+        if not unmatched:
+            return {}
+
+        if debugs:
+            print("*** matchEpgChannels ***", len(unmatched))
+
+        self.runner.post(self["action"].setText, _("Matching EPG channels..."))
+
         try:
-            with open(source_file, "r+") as f:
-                xml_str = f.read()
-                f.seek(0)
-                doc = minidom.parseString(xml_str)
-                xml_output = doc.toprettyxml(encoding="utf-8", indent="\t")
-                try:
-                    xml_output = os.linesep.join([s for s in xml_output.splitlines() if s.strip()])
-                except:
-                    xml_output = os.linesep.join([s for s in xml_output.decode().splitlines() if s.strip()])
-                f.write(xml_output)
+            matches = epgmatch.matchChannels(self.name, self.xmltv_api, [store.names[row] for row in unmatched])
         except Exception as e:
             print(e)
+            return {}
 
-        self.buildXmltvChannels()
+        return dict((row, matches[store.names[row]]) for row in unmatched if store.names[row] in matches)
 
     def buildXmltvChannels(self):
         if debugs:
             print("*** buildXmltvChannels ***")
-        file_path = "/etc/epgimport/"
-        epg_filename = "bouquetmakerxtream." + str(self.name) + ".channels.xml"
-        channel_path = os.path.join(file_path, epg_filename)
 
-        if not os.path.isfile(channel_path):
-            open(channel_path, "a").close()
+        if self.channels_writer is None:
+            # no live channels were rendered, the channels file is left empty
+            self.channels_writer = xmltvchannels.ChannelsWriter(xmltvchannels.channelsPath(self.name))
 
-        with open(channel_path, "w") as f:
-            xml_str = '<?xml version="1.0" encoding="utf-8"?>\n'
-            xml_str += "<channels>\n"
+        self.channels_writer.commit()
+        self.channels_writer = None
+        self.channels_committed = True
 
-            if self.live_stream_data:
-                for stream in self.live_stream_data:
-                    if stream["xml_str"] and stream["xml_str"] is not None:
-                        xml_str += stream["xml_str"]
-            xml_str += "</channels>\n"
-            f.write(xml_str)
+    def abortXmltvChannels(self):
+        if self.channels_writer is not None:
+            self.channels_writer.abort()
+            self.channels_writer = None
 
     def clearCaches(self):
         if debugs:
@@ -1169,8 +1108,23 @@ class BmxBuildBouquets(Screen):
         if debugs:
             print("*** finished ***")
 
+        self.writer.finish()
+        self.purgeOldFiles()
+        self.closeSeriesSpool()
+        self.abortXmltvChannels()
+        self.saveXmltvSources()
+        self.saveBouquetsTv()
         self.updateJson()
+        # every download of the run has been read, the cache is trimmed once
+        responsecache.prune()
+        catalogcache.clear()
         self.clearCaches()
+
+        # last stage, the worker is done
+        self.runner.shutdown()
+        self.runner.post(self.showFinished)
+
+    def showFinished(self):
         bmx.refreshBouquets()
 
         message = ""
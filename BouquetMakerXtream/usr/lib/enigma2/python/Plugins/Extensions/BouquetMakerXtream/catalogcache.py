@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .plugin import debugs, dir_tmp
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+# Decoded player_api.php responses shared between the category chooser and the bouquet
+# builder it opens, so the builder does not download the same endpoints again.
+# Entries are keyed by api url (host, credentials and action), so by playlist and endpoint.
+TTL = 300
+
+# streams and categories kept in memory in total, larger responses are pickled to dir_tmp
+MEMORY_ITEMS = 250000
+
+_entries = {}
+_lock = threading.Lock()
+
+
+def spillPath(url):
+    return os.path.join(dir_tmp(), "bmx_catalog_" + hashlib.sha1(url.encode("utf-8")).hexdigest() + ".pickle")
+
+
+def memoryItems():
+    return sum(len(entry[1]) for entry in _entries.values() if entry[1] is not None)
+
+
+def removeEntry(url):
+    entry = _entries.pop(url, None)
+    if entry and entry[1] is None:
+        try:
+            os.remove(spillPath(url))
+        except:
+            pass
+
+
+def get(url):
+    """A copy of the list stored for url, or None if there is none younger than TTL."""
+    with _lock:
+        entry = _entries.get(url)
+        if not entry:
+            return None
+
+        if time.time() - entry[0] > TTL:
+            removeEntry(url)
+            return None
+
+        data = entry[1]
+        if data is None:
+            try:
+                with open(spillPath(url), "rb") as f:
+                    data = pickle.load(f)
+            except Exception as e:
+                print(e)
+                removeEntry(url)
+                return None
+
+    if debugs:
+        print("*** catalogcache hit ***", url)
+
+    # the screens sort and replace their lists, the stored one stays as downloaded
+    return list(data)
+
+
+def put(url, data):
+    if not data or not isinstance(data, list):
+        return
+
+    with _lock:
+        removeEntry(url)
+
+        if memoryItems() + len(data) <= MEMORY_ITEMS:
+            _entries[url] = (time.time(), list(data))
+            return
+
+        try:
+            with open(spillPath(url), "wb") as f:
+                pickle.dump(data, f, 2)
+            _entries[url] = (time.time(), None)
+        except Exception as e:
+            print(e)
+
+
+def clear():
+    with _lock:
+        for url in list(_entries):
+            removeEntry(url)
@@ -3,6 +3,8 @@
 
 from . import _
 from . import bouquet_globals as glob
+from . import httpclient
+from . import xmltvguide
 from .bmxStaticText import StaticText
 from .plugin import cfg, screenwidth
 
@@ -10,7 +12,6 @@ from Components.ActionMap import ActionMap
 from Components.Sources.List import List
 from datetime import datetime, timedelta
 from enigma import eServiceReference
-from requests.adapters import HTTPAdapter, Retry
 from Screens.InfoBar import MoviePlayer
 from Screens.MessageBox import MessageBox
 from Screens.Screen import Screen
@@ -196,26 +197,20 @@ class BmxCatchup(Screen):
         self.downloadPlayerApi()
 
     def downloadPlayerApi(self):
-        retries = Retry(total=1, backoff_factor=1)
-        adapter = HTTPAdapter(max_retries=retries)
         response = ""
 
-        with requests.Session() as http:
-            http.mount("http://", adapter)
-            http.mount("https://", adapter)
+        try:
+            r = httpclient.get(self.player_api, retries=1, backoff=1, headers=hdr, timeout=10)
+            r.raise_for_status()
 
-            try:
-                r = http.get(self.player_api, headers=hdr, timeout=10, verify=False)
-                r.raise_for_status()
+            if r.status_code == requests.codes.ok:
+                try:
+                    response = r.json()
+                except Exception as e:
+                    print(e)
 
-                if r.status_code == requests.codes.ok:
-                    try:
-                        response = r.json()
-                    except Exception as e:
-                        print(e)
-
-            except Exception as e:
-                print(e)
+        except Exception as e:
+            print(e)
 
         self.server_offset = 0
 
@@ -242,15 +237,19 @@ class BmxCatchup(Screen):
         self.downloadSimpleData()
 
     def downloadSimpleData(self):
-        retries = Retry(total=3, backoff_factor=1)
-        adapter = HTTPAdapter(max_retries=retries)
+        short_epg_json = None
+        encoded = True
 
-        with requests.Session() as http:
-            http.mount("http://", adapter)
-            http.mount("https://", adapter)
+        # answered from the local xmltv guide when it has the channel
+        if cfg.xmltv_guide.value:
+            listings = xmltvguide.catchupListings(self.domain, self.username, self.ref_stream_num, self.server_offset)
+            if listings:
+                short_epg_json = {"epg_listings": listings}
+                encoded = False
 
+        if short_epg_json is None:
             try:
-                response = http.get(self.simple_url, headers=hdr, timeout=(10, 20), verify=False)
+                response = httpclient.get(self.simple_url, retries=3, backoff=1, headers=hdr, timeout=(10, 20))
                 response.raise_for_status()
 
                 if response.status_code == requests.codes.ok:
@@ -275,8 +274,12 @@ class BmxCatchup(Screen):
             for listing in short_epg_json["epg_listings"]:
                 if "has_archive" in listing and listing["has_archive"] == 1 or "now_playing" in listing and listing["now_playing"] == 1:
 
-                    title = base64.b64decode(listing.get("title", "")).decode("utf-8")
-                    description = base64.b64decode(listing.get("description", "")).decode("utf-8")
+                    title = listing.get("title", "")
+                    description = listing.get("description", "")
+
+                    if encoded:
+                        title = base64.b64decode(title).decode("utf-8")
+                        description = base64.b64decode(description).decode("utf-8")
                     start = listing.get("start", "")
                     end = listing.get("end", "")
                     stop = listing.get("stop", "")
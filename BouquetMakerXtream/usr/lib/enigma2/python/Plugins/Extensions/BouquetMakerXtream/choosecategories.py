@@ -3,10 +3,15 @@
 
 from . import _
 from . import parsem3u
+from . import sortkeys
+from . import streamrecords
+from . import streamstore
+from . import windowedlist
 from . import bouquet_globals as glob
+from . import catalogcache
 from . import globalfunctions as bmx
 from .bmxStaticText import StaticText
-from .plugin import cfg, common_path, playlists_json, skin_directory, debugs, dir_etc
+from .plugin import cfg, common_path, playlists_json, skin_directory, debugs, dir_tmp
 
 from Components.ActionMap import ActionMap
 from Components.Pixmap import Pixmap
@@ -15,9 +20,14 @@ from enigma import eTimer
 from Screens.Screen import Screen
 from Tools.LoadPixmap import LoadPixmap
 
+from collections import OrderedDict
+
 import json
 import os
 
+# built channel lists kept for the categories browsed last
+ENTRY_CACHE_SIZE = 20
+
 
 class BmxChooseCategories(Screen):
     def __init__(self, session):
@@ -35,6 +45,15 @@ class BmxChooseCategories(Screen):
         self.channel_list = []
 
         self.level = 1
+        self.stores = {}
+        self.entry_cache = OrderedDict()
+        self.channel_window = None
+        self.prefetched = {}
+
+        # loaded once and shared by every row
+        self.lock_hidden = LoadPixmap(cached=True, path=os.path.join(common_path, "lock_hidden.png"))
+        self.lock_on = LoadPixmap(cached=True, path=os.path.join(common_path, "lock_on.png"))
+        self.lock_disabled = LoadPixmap(cached=True, path=os.path.join(common_path, "lock_disabled.png"))
 
         self["list1"] = List(self.category_list, enableWrapAround=True)
         self["list2"] = List(self.channel_list, enableWrapAround=True)
@@ -90,6 +109,7 @@ class BmxChooseCategories(Screen):
             self.local_file = glob.current_playlist["playlist_info"]["full_url"]
 
         self.onFirstExecBegin.append(self.start)
+        self.onClose.append(catalogcache.clear)
 
     def enableList(self):
         self["list2"].master.master.instance.setSelectionEnable(0)
@@ -128,6 +148,8 @@ class BmxChooseCategories(Screen):
 
             if self.selected_list == self["list1"]:
                 self.selectionChanged()
+            else:
+                self.channelWindowChanged()
 
     def pageDown(self):
         if self.selected_list.getCurrent():
@@ -136,6 +158,8 @@ class BmxChooseCategories(Screen):
 
             if self.selected_list == self["list1"]:
                 self.selectionChanged()
+            else:
+                self.channelWindowChanged()
 
     def goUp(self):
         if self.selected_list.getCurrent():
@@ -144,6 +168,8 @@ class BmxChooseCategories(Screen):
 
             if self.selected_list == self["list1"]:
                 self.selectionChanged()
+            else:
+                self.channelWindowChanged()
 
     def goDown(self):
         if self.selected_list.getCurrent():
@@ -152,6 +178,8 @@ class BmxChooseCategories(Screen):
 
             if self.selected_list == self["list1"]:
                 self.selectionChanged()
+            else:
+                self.channelWindowChanged()
 
     def start(self):
         if debugs:
@@ -178,6 +206,8 @@ class BmxChooseCategories(Screen):
             pass
 
         if glob.current_playlist["playlist_info"]["playlist_type"] == "xtream":
+            self.prefetchXtream()
+
             if glob.current_playlist["settings"]["show_live"]:
                 self.downloadXtreamLive()
             elif glob.current_playlist["settings"]["show_vod"]:
@@ -189,6 +219,23 @@ class BmxChooseCategories(Screen):
         elif glob.current_playlist["playlist_info"]["playlist_type"] == "local":
             self.parseLocal()
 
+    def prefetchXtream(self):
+        # every enabled endpoint downloads at once, each stage then only waits for its own
+        url_list = []
+        if glob.current_playlist["settings"]["show_live"]:
+            url_list += [[self.live_categories_api, 0], [self.live_streams_api, 3]]
+        if glob.current_playlist["settings"]["show_vod"]:
+            url_list += [[self.vod_categories_api, 1], [self.vod_streams_api, 4]]
+        if glob.current_playlist["settings"]["show_series"]:
+            url_list += [[self.series_categories_api, 2], [self.series_streams_api, 5]]
+        self.prefetched = bmx.prefetchXtreamApiCategories(url_list)
+
+    def downloadXtreamApiCategory(self, url):
+        future = self.prefetched.pop(url[0], None)
+        if future:
+            return future.result()
+        return bmx.downloadXtreamApiCategory(url)
+
     def downloadXtreamLive(self):
         if debugs:
             print("*** downloadXtreamLive ***")
@@ -205,7 +252,7 @@ class BmxChooseCategories(Screen):
         self.url_list = [[self.live_categories_api, 0], [self.live_streams_api, 3]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.downloadXtreamApiCategory(url)
 
             category = result[0]
             response = result[1]
@@ -215,23 +262,7 @@ class BmxChooseCategories(Screen):
                     self.live_categories = response
 
                 elif category == 3:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "stream_id": item.get("stream_id"),
-                            "stream_icon": item.get("stream_icon"),
-                            "epg_channnel_id": item.get("epg_channel_id"),
-                            "added": item.get("added"),
-                            "category_id": item.get("category_id"),
-                            "custom_sid": item.get("custom_sid"),
-                            "tv_archive": item.get("tv_archive"),
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "stream_id", "stream_icon", "epg_channel_id",
-                            "added", "category_id", "custom_sid", "tv_archive"
-                        ])
-                    )
-                    self.live_streams = list(response)
+                    self.live_streams = response
                 response = None
 
         try:
@@ -257,7 +288,7 @@ class BmxChooseCategories(Screen):
         self.url_list = [[self.vod_categories_api, 1], [self.vod_streams_api, 4]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.downloadXtreamApiCategory(url)
 
             category = result[0]
             response = result[1]
@@ -266,19 +297,7 @@ class BmxChooseCategories(Screen):
                 if category == 1:
                     self.vod_categories = response
                 elif category == 4:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "stream_id": item.get("stream_id"),
-                            "added": item.get("added"),
-                            "category_id": item.get("category_id"),
-                            "container_extension": item.get("container_extension")
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "stream_id", "added", "category_id", "container_extension"
-                        ])
-                    )
-                    self.vod_streams = list(response)
+                    self.vod_streams = response
 
                 response = None
 
@@ -305,7 +324,7 @@ class BmxChooseCategories(Screen):
         self.url_list = [[self.series_categories_api, 2], [self.series_streams_api, 5]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.downloadXtreamApiCategory(url)
 
             category = result[0]
             response = result[1]
@@ -315,18 +334,7 @@ class BmxChooseCategories(Screen):
                     self.series_categories = response
 
                 elif category == 5:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "series_id": item.get("series_id"),
-                            "last_modified": item.get("last_modified"),
-                            "category_id": item.get("category_id")
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "series_id", "last_modified", "category_id"
-                        ])
-                    )
-                    self.series_streams = list(response)
+                    self.series_streams = response
                 response = None
 
         try:
@@ -347,11 +355,11 @@ class BmxChooseCategories(Screen):
         except:
             pass
 
-        response = bmx.downloadM3U8File(self.external_url)
+        path = bmx.spoolFile(self.external_url, dir_tmp(), timeout=(20, 300))[0]
 
-        if response:
-            self.parseFullM3u8Data(response)
-            response = None
+        if path:
+            self.parseFullM3u8Data(path)
+            bmx.releaseSpoolFile(path)
 
         try:
             self["splash"].hide()
@@ -372,16 +380,13 @@ class BmxChooseCategories(Screen):
             pass
 
         # Build the full local file path
-        local_path = os.path.join(dir_etc, self.local_file)
+        local_path = os.path.join(cfg.local_location.value, self.local_file)
 
         # Check if the file exists before reading
         if os.path.exists(local_path):
             try:
-                with open(local_path, "r") as f:
-                    response = f.read()
-                if response:
-                    self.parseFullM3u8Data(response)
-                    response = None
+                # parsed line by line, the file is never read into one string
+                self.parseFullM3u8Data(local_path)
             except Exception as e:
                 if debugs:
                     print("Error reading local file:", e)
@@ -423,7 +428,7 @@ class BmxChooseCategories(Screen):
                     self.categorySelectedList.append([str(category["category_id"]), str(category["category_name"]), False])
 
             if glob.current_playlist["settings"]["live_category_order"] == "alphabetical":
-                self.categorySelectedList.sort(key=lambda x: x[1].lower())
+                self.categorySelectedList.sort(key=lambda x: sortkeys.sortKey(x[1]))
 
             self.category_list = [self.buildListEntry(x[0], x[1], x[2]) for x in self.categorySelectedList]
 
@@ -472,7 +477,7 @@ class BmxChooseCategories(Screen):
                     self.categorySelectedList.append([str(category["category_id"]), str(category["category_name"]), False])
 
             if glob.current_playlist["settings"]["vod_category_order"] == "alphabetical":
-                self.categorySelectedList.sort(key=lambda x: x[1].lower())
+                self.categorySelectedList.sort(key=lambda x: sortkeys.sortKey(x[1]))
 
             self.category_list = [self.buildListEntry(x[0], x[1], x[2]) for x in self.categorySelectedList]
             self["list1"].setList(self.category_list)
@@ -518,7 +523,7 @@ class BmxChooseCategories(Screen):
                     self.categorySelectedList.append([str(category["category_id"]), str(category["category_name"]), False])
 
             if glob.current_playlist["settings"]["vod_category_order"] == "alphabetical":
-                self.categorySelectedList.sort(key=lambda x: x[1].lower())
+                self.categorySelectedList.sort(key=lambda x: sortkeys.sortKey(x[1]))
 
             self.category_list = [self.buildListEntry(x[0], x[1], x[2]) for x in self.categorySelectedList]
             self["list1"].setList(self.category_list)
@@ -543,110 +548,97 @@ class BmxChooseCategories(Screen):
 
         if self["list1"].getCurrent()[3]:
             self["list2"].setList([])
+            self.channel_window = None
             return
 
         category = self["list1"].getCurrent()[2]
+        store = self.streamStore()
+        key = (self.level, category)
 
-        if self.level == 1:
-            for channel in self.live_streams:
+        # categories browsed recently are served as they were built
+        entries = self.entry_cache.pop(key, None)
+        if entries is None:
+            entries = self.buildChannelEntries(store, category)
+        self.entry_cache[key] = entries
+
+        while len(self.entry_cache) > ENTRY_CACHE_SIZE:
+            self.entry_cache.popitem(last=False)
 
-                name = str(channel.get("name", ""))
-                stream_id = str(channel.get("stream_id", ""))
-                added = str(channel.get("added", "0"))
+        self.channel_selected_list, self.channel_window = entries
+        self.channel_window.show(0)
+        self.channel_list = self.channel_window.entries
+        self["list2"].setList(self.channel_list)
+
+    def channelWindowChanged(self):
+        # build the rows that scrolled into view
+        if self.channel_window:
+            for index in self.channel_window.show(self["list2"].getIndex()):
+                self["list2"].modifyEntry(index, self.channel_window.entries[index])
+
+    def refreshChannelWindow(self):
+        if self.channel_window:
+            self.channel_window.invalidate()
+            self.channel_window.show(self["list2"].getIndex())
+            self.channel_list = self.channel_window.entries
+        else:
+            self.channel_list = []
+        self["list2"].updateList(self.channel_list)
 
-                if not name or not stream_id:
-                    continue
+    def buildChannelEntries(self, store, category):
+        if self.level == 1:
+            hidden = glob.current_playlist["data"]["live_streams_hidden"]
+            stream_order = glob.current_playlist["settings"]["live_stream_order"]
+        elif self.level == 2:
+            hidden = glob.current_playlist["data"]["vod_streams_hidden"]
+            stream_order = glob.current_playlist["settings"]["vod_stream_order"]
+        else:
+            hidden = glob.current_playlist["data"]["series_streams_hidden"]
+            stream_order = glob.current_playlist["settings"]["vod_stream_order"]
 
-                if channel["category_id"] == category:
-                    if glob.current_playlist["playlist_info"]["playlist_type"] == "xtream":
-                        if stream_id in glob.current_playlist["data"]["live_streams_hidden"] or name in glob.current_playlist["data"]["live_streams_hidden"]:
-                            self.channel_selected_list.append([stream_id, name, True, added])
-                        else:
-                            self.channel_selected_list.append([stream_id, name, False, added])
-                    else:
-                        if stream_id in glob.current_playlist["data"]["live_streams_hidden"] or name in glob.current_playlist["data"]["live_streams_hidden"]:
-                            self.channel_selected_list.append([stream_id, name, True, "0"])
-                        else:
-                            self.channel_selected_list.append([stream_id, name, False, "0"])
+        hidden = set(hidden)
+        xtream = glob.current_playlist["playlist_info"]["playlist_type"] == "xtream"
+        channel_selected_list = []
 
-            if glob.current_playlist["settings"]["live_stream_order"] == "alphabetical":
-                self.channel_selected_list.sort(key=lambda x: x[1].lower())
+        # only the rows of the selected category are visited, in the order of the settings
+        for row in store.categoryRows(category, stream_order):
+            name = store.names[row]
+            stream_id = store.ids[row]
 
-            if glob.current_playlist["settings"]["live_stream_order"] == "added":
-                self.channel_selected_list.sort(key=lambda x: x[3].lower(), reverse=True)
+            if not name or not stream_id:
+                continue
 
-        elif self.level == 2:
-            for channel in self.vod_streams:
-
-                name = str(channel.get("name", ""))
-                stream_id = str(channel.get("stream_id", ""))
-                added = str(channel.get("added", "0"))
-
-                if not name or not stream_id:
-                    continue
-
-                if channel["category_id"] == category:
-                    if glob.current_playlist["playlist_info"]["playlist_type"] == "xtream":
-                        if stream_id in glob.current_playlist["data"]["vod_streams_hidden"] or name in glob.current_playlist["data"]["vod_streams_hidden"]:
-                            self.channel_selected_list.append([stream_id, name, True, added])
-                        else:
-                            self.channel_selected_list.append([stream_id, name, False, added])
-                    else:
-                        if stream_id in glob.current_playlist["data"]["vod_streams_hidden"] or name in glob.current_playlist["data"]["vod_streams_hidden"]:
-                            self.channel_selected_list.append([stream_id, name, True, "0"])
-                        else:
-                            self.channel_selected_list.append([stream_id, name, False, "0"])
-
-            if glob.current_playlist["settings"]["vod_stream_order"] == "alphabetical":
-                self.channel_selected_list.sort(key=lambda x: x[1].lower())
-
-            if glob.current_playlist["settings"]["vod_stream_order"] == "added":
-                self.channel_selected_list.sort(key=lambda x: x[3].lower(), reverse=True)
-
-        elif self.level == 3:
-            for channel in self.series_streams:
-
-                name = str(channel.get("name", ""))
-                series_id = str(channel.get("series_id", ""))
-                last_modified = str(channel.get("last_modified", "0"))
-
-                if not name or not series_id:
-                    continue
-
-                if channel["category_id"] == category:
-                    if glob.current_playlist["playlist_info"]["playlist_type"] == "xtream":
-                        if series_id in glob.current_playlist["data"]["series_streams_hidden"] or name in glob.current_playlist["data"]["series_streams_hidden"]:
-                            self.channel_selected_list.append([series_id, name, True, last_modified])
-                        else:
-                            self.channel_selected_list.append([series_id, name, False, last_modified])
-                    else:
-                        if series_id in glob.current_playlist["data"]["series_streams_hidden"] or name in glob.current_playlist["data"]["series_streams_hidden"]:
-                            self.channel_selected_list.append([series_id, name, True, "0"])
-                        else:
-                            self.channel_selected_list.append([series_id, name, False, "0"])
-
-            if glob.current_playlist["settings"]["vod_stream_order"] == "alphabetical":
-                self.channel_selected_list.sort(key=lambda x: x[1].lower())
-
-            if glob.current_playlist["settings"]["vod_stream_order"] == "added":
-                self.channel_selected_list.sort(key=lambda x: x[3].lower(), reverse=True)
+            added = str(store.added[row]) if xtream else "0"
+            channel_selected_list.append([stream_id, name, stream_id in hidden or name in hidden, added])
 
         if self.setup_title != _("Choose Series Categories"):
-            self.channel_list = [self.buildListEntry(x[0], x[1], x[2]) for x in self.channel_selected_list]
+            build = self.buildListEntry
         else:
-            self.channel_list = [self.buildListEntry2(x[0], x[1], x[2]) for x in self.channel_selected_list]
-        self["list2"].setList(self.channel_list)
+            build = self.buildListEntry2
 
-    def buildListEntry(self, id, name, hidden):
-        if hidden:
-            pixmap = LoadPixmap(cached=True, path=os.path.join(common_path, "lock_hidden.png"))
+        window = windowedlist.WindowedList(channel_selected_list, lambda x: build(x[0], x[1], x[2]), (self.lock_on, "", "", False))
+        return channel_selected_list, window
+
+    def streamStore(self):
+        # built once for each downloaded stream list and reused on every cursor move
+        if self.level == 1:
+            streams, id_key, added_key = self.live_streams, "stream_id", "added"
+        elif self.level == 2:
+            streams, id_key, added_key = self.vod_streams, "stream_id", "added"
         else:
-            pixmap = LoadPixmap(cached=True, path=os.path.join(common_path, "lock_on.png"))
+            streams, id_key, added_key = self.series_streams, "series_id", "last_modified"
+
+        store = self.stores.get(self.level)
+        if store is None or store.streams is not streams:
+            store = self.stores[self.level] = streamstore.StreamStore(streams, id_key, added_key)
+            self.entry_cache.clear()
+        return store
+
+    def buildListEntry(self, id, name, hidden):
+        pixmap = self.lock_hidden if hidden else self.lock_on
         return (pixmap, str(name), str(id), hidden)
 
     def buildListEntry2(self, id, name, hidden):
-        pixmap = LoadPixmap(cached=True, path=os.path.join(common_path, "lock_disabled.png"))
-        return (pixmap, str(name), str(id), hidden)
+        return (self.lock_disabled, str(name), str(id), hidden)
 
     def refresh(self):
         if debugs:
@@ -686,15 +678,17 @@ class BmxChooseCategories(Screen):
                 if self["list1"].getCurrent()[3]:
                     self["list2"].setList([])
                 else:
-                    self.channel_list = [self.buildListEntry(x[0], x[1], x[2]) for x in self.channel_selected_list]
-                    self["list2"].updateList(self.channel_list)
+                    self.refreshChannelWindow()
 
                 self.selectionChanged()
 
         if self.selected_list == self["list2"]:
             if self["list1"].getCurrent():
-                self.channel_list = [self.buildListEntry(x[0], x[1], x[2]) for x in self.channel_selected_list]
-                self["list2"].updateList(self.channel_list)
+                self.refreshChannelWindow()
+
+                # hidden names can repeat in other categories, only the current one stays cached
+                self.entry_cache.clear()
+                self.entry_cache[(self.level, self["list1"].getCurrent()[2])] = (self.channel_selected_list, self.channel_window)
 
                 if self.setup_title == _("Choose Live Categories"):
                     update_hidden_list(self.channel_selected_list, glob.current_playlist["data"]["live_streams_hidden"], "live")
@@ -870,12 +864,12 @@ class BmxChooseCategories(Screen):
         except:
             pass
 
-    def parseFullM3u8Data(self, response=None):
+    def parseFullM3u8Data(self, path):
         if debugs:
             print("*** parseFullM3u8Data ***")
 
         # --- Step 1: Parse the playlist streams ---
-        self.live_streams, self.vod_streams, self.series_streams = parsem3u.parseM3u8Playlist(response)
+        self.live_streams, self.vod_streams, self.series_streams = parsem3u.parseM3u8File(path)
 
         # --- Step 2: Build categories ---
         if debugs:
@@ -911,42 +905,9 @@ class BmxChooseCategories(Screen):
         if debugs:
             print("*** Building M3U8 stream JSON data ***")
 
-        self.live_streams = [
-            {
-                "epg_channel_id": str(x[0]),
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "stream_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.live_streams
-        ]
-
-        self.vod_streams = [
-            {
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "stream_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.vod_streams
-        ]
-
-        self.series_streams = [
-            {
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "series_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.series_streams
-        ]
+        self.live_streams = streamrecords.fromM3u(self.live_streams, streamrecords.LiveStream)
+        self.vod_streams = streamrecords.fromM3u(self.vod_streams, streamrecords.VodStream)
+        self.series_streams = streamrecords.fromM3u(self.series_streams, streamrecords.SeriesStream)
 
         if debugs:
             print("*** M3U8 parsing complete ***")
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 from . import _
+from . import bouquetstv
+from . import epgsources
 from . import bouquet_globals as glob
 from . import globalfunctions as bmx
 from .bmxStaticText import StaticText
@@ -102,26 +104,15 @@ class BmxDeleteBouquets(Screen):
 
     def deleteBouquets(self):
         selected_bouquet_list = self.getSelectionsList()
+        epg_sources = None
+
+        # bouquets.tv is read and written once for all the deleted bouquets
+        bouquets_tv = bouquetstv.BouquetsTv()
+        bouquets_tv.removeProviders([bmx.safeName(bouquet_name) for bouquet_name in selected_bouquet_list])
 
         for bouquet_name in selected_bouquet_list:
             safe_name = bmx.safeName(bouquet_name)
 
-            with open("/etc/enigma2/bouquets.tv", "r+") as f:
-                lines = f.readlines()
-                f.seek(0)
-                f.truncate()
-
-                for line in lines:
-                    if "bouquetmakerxtream_live_" + str(safe_name) + "_" in line:
-                        continue
-                    if "bouquetmakerxtream_vod_" + str(safe_name) + "_" in line:
-                        continue
-                    if "bouquetmakerxtream_series_" + str(safe_name) + "_" in line:
-                        continue
-                    if "bouquetmakerxtream_" + str(safe_name) + ".tv" in line:
-                        continue
-                    f.write(line)
-
             bmx.purge("/etc/enigma2", "bouquetmakerxtream_live_" + str(safe_name) + "_")
             bmx.purge("/etc/enigma2", "bouquetmakerxtream_vod_" + str(safe_name) + "_")
             bmx.purge("/etc/enigma2", "bouquetmakerxtream_series_" + str(safe_name) + "_")
@@ -130,32 +121,20 @@ class BmxDeleteBouquets(Screen):
             if epgimporter:
                 bmx.purge("/etc/epgimport", "bouquetmakerxtream." + str(safe_name) + ".channels.xml")
 
-                # remove sources from source file
-                source_file = "/etc/epgimport/bouquetmakerxtream.sources.xml"
-
-                if os.path.isfile(source_file):
-                    try:
-                        import xml.etree.ElementTree as ET
-
-                        tree = ET.parse(source_file, parser=ET.XMLParser(encoding="utf-8"))
-                        root = tree.getroot()
-
-                        for elem in root.iter():
-                            for child in list(elem):
-                                if child.tag == "source":
-
-                                    description = child.find("description").text if child.find("description") is not None else ""
-                                    if safe_name in description:
-                                        elem.remove(child)
-
-                        tree.write(source_file)
-                    except Exception as e:
-                        print(e)
+                # remove sources from source file, written once for all the deleted bouquets
+                if os.path.isfile(epgsources.SOURCES_FILE):
+                    if epg_sources is None:
+                        epg_sources = epgsources.EpgSources()
+                    epg_sources.removeSources(lambda description: safe_name in description)
 
             self.deleteBouquetFile(bouquet_name)
             glob.current_selection = 0
             glob.current_playlist = []
-            bmx.refreshBouquets()
+
+        bouquets_tv.save()
+        if epg_sources is not None:
+            epg_sources.save()
+        bmx.refreshBouquets()
         self.close()
 
     def deleteBouquetFile(self, bouquet_name):
@@ -2,20 +2,19 @@
 # -*- coding: utf-8 -*-
 
 from . import _
+from . import httpclient
 from .plugin import skin_directory, cfg, hasConcurrent, hasMultiprocessing, pythonVer, dir_custom, dir_tmp
 from Components.ActionMap import ActionMap
 from Components.Label import Label
 from Components.ProgressBar import ProgressBar
 from enigma import eTimer
 from PIL import Image, ImageFile, PngImagePlugin, ImageChops
-from requests.adapters import HTTPAdapter, Retry
 from Screens.MessageBox import MessageBox
 from Screens.Screen import Screen
 
 import io
 import os
 import re
-import requests
 import string
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
@@ -238,15 +237,9 @@ class BmxDownloadPicons(Screen):
         url[i][1] = url[i][1].replace("2000px", "400px")
 
         image_formats = ("image/png", "image/jpeg")
-        retries = Retry(total=0, backoff_factor=0)
-        adapter = HTTPAdapter(max_retries=retries)
 
-        with requests.Session() as http:
-            http.mount("http://", adapter)
-            http.mount("https://", adapter)
-
-            try:
-                response = http.get(url[i][1], headers=hdr, stream=True, timeout=5, verify=False, allow_redirects=False)
+        try:
+            with httpclient.get(url[i][1], retries=0, backoff=0, headers=hdr, stream=True, timeout=5, allow_redirects=False) as response:
                 if response:
                     if "content-length" in response.headers and int(cfg.picon_max_size.value) != 0:
                         if int(response.headers["content-length"]) > int(cfg.picon_max_size.value):
@@ -289,13 +282,13 @@ class BmxDownloadPicons(Screen):
                         self.blockinglist.append(url[i][1])
                         return
 
-            except Exception as e:
-                print("**** exception ***", url[i][1], e)
-                self.badurlcount += 1
-                self.badurllist.append(url[i])
-                if url[i][1] not in self.blockinglist:
-                    self.blockinglist.append(url[i][1])
-                    return
+        except Exception as e:
+            print("**** exception ***", url[i][1], e)
+            self.badurlcount += 1
+            self.badurllist.append(url[i])
+            if url[i][1] not in self.blockinglist:
+                self.blockinglist.append(url[i][1])
+                return
 
     def log_result(self, result=None):
         # self.progresscurrent += 1
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from . import httpclient
+from . import sortkeys
+from .bouquetwriter import writeIfChanged
+from .globalfunctions import hdr
+from .plugin import debugs, dir_etc
+
+from difflib import SequenceMatcher
+
+import gzip
+import json
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+# Epg channel ids for live streams the provider sent without one, matched by name against the
+# <channel> display-names of its XMLTV. Matches, and misses, are cached per provider for MAX_AGE.
+MAX_AGE = 24 * 3600
+
+# fuzzy matches below this SequenceMatcher ratio are rejected
+MIN_RATIO = 0.85
+
+# fuzzy candidates scored per name, taken from the channels sharing its rarest words
+MAX_CANDIDATES = 50
+
+# "uk: ", "uk| ", "|uk| ", "[uk] " and " (uk)", not "bbc-1"
+_country = re.compile(r"^\s*[a-z]{2,3}\s*[:|]\s*|^\|[a-z]{2,3}\|\s*|^\[[a-z]{2,3}\]\s*|\s*\([a-z]{2,3}\)$")
+_quality = re.compile(r"\b(?:uhd|fhd|qhd|hd|sd|hq|4k|8k|hevc|h\.?26[45]|1080[pi]?|720p|[56]0 ?fps|raw|backup|vip)\b")
+_symbols = re.compile(r"[^a-z0-9]+")
+_digits = re.compile(r"\d+")
+
+
+def normalise(name):
+    """Casefolded name without accents, country prefix, quality tags and punctuation: "UK: BBC One FHD" -> "bbc one"."""
+    key = sortkeys.foldKey(name)
+    key = _country.sub("", key)
+    key = key.replace("&", " and ").replace("+", " plus ")
+    key = _quality.sub(" ", key)
+    return " ".join(_symbols.sub(" ", key).split())
+
+
+class EpgMatcher(object):
+    """
+    Index of XMLTV channels by normalised display-name and id.
+
+    Names are looked up exactly, then with their spaces removed, then fuzzily against the few
+    channels sharing the name's rarest words. Each lookup touches a bounded number of channels,
+    so matching a whole playlist is linear in its size rather than playlist x guide.
+    """
+
+    def __init__(self, channels):
+        self.exact = {}
+        self.compact = {}
+        self.words = {}
+
+        for channel_id, names in channels:
+            # ids like "bbcone.uk" are names too
+            for name in list(names) + [channel_id.rsplit(".", 1)[0]]:
+                key = normalise(name)
+                if not key:
+                    continue
+
+                self.exact.setdefault(key, channel_id)
+
+                compact = key.replace(" ", "")
+                if compact not in self.compact:
+                    self.compact[compact] = channel_id
+                    for word in set(key.split()):
+                        self.words.setdefault(word, []).append(compact)
+
+    def __len__(self):
+        return len(self.compact)
+
+    def match(self, name):
+        key = normalise(name)
+        if not key:
+            return None
+
+        if key in self.exact:
+            return self.exact[key]
+
+        compact = key.replace(" ", "")
+        if compact in self.compact:
+            return self.compact[compact]
+
+        words = sorted((word for word in set(key.split()) if word in self.words), key=lambda word: len(self.words[word]))
+        candidates = []
+        for word in words[:2]:
+            candidates.extend(self.words[word][:MAX_CANDIDATES])
+
+        # "sky sports 1" must not take "sky sports 2"
+        numbers = _digits.findall(compact)
+        best, best_ratio = None, MIN_RATIO
+
+        # the name is seq2, which SequenceMatcher indexes once for all candidates
+        matcher = SequenceMatcher(None, "", compact)
+
+        for candidate in set(candidates):
+            if _digits.findall(candidate) != numbers:
+                continue
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = candidate, ratio
+
+        return self.compact[best] if best else None
+
+
+class PrefixedReader(object):
+    # a response body with its first bytes, already read to sniff gzip, put back in front
+    def __init__(self, prefix, raw):
+        self.prefix = prefix
+        self.raw = raw
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.raw.read(size)
+        data, self.prefix = self.prefix, b""
+        if size is None or size < 0:
+            return data + self.raw.read()
+        return data + self.raw.read(max(0, size - len(data)))
+
+
+def iterChannels(source):
+    """(id, display-names) of the <channel> elements, stopping at the first <programme>."""
+    context = ET.iterparse(source, events=("start", "end"))
+    for event, elem in context:
+        if elem.tag == "programme":
+            break
+        if event == "end" and elem.tag == "channel":
+            channel_id = elem.get("id")
+            if channel_id:
+                yield channel_id, [e.text for e in elem.findall("display-name") if e.text]
+            elem.clear()
+
+
+def loadChannels(url):
+    with httpclient.get(url, headers=hdr, timeout=(20, 300), stream=True) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        prefix = r.raw.read(2)
+        source = PrefixedReader(prefix, r.raw)
+        if prefix == b"\x1f\x8b":
+            source = gzip.GzipFile(fileobj=source)
+        return list(iterChannels(source))
+
+
+def cachePath(name):
+    return os.path.join(dir_etc, "bmx_epgmatch_" + str(name) + ".json")
+
+
+def matchChannels(name, url, channel_names):
+    """
+    Epg channel id for each of channel_names that can be matched, as a dict.
+
+    Results are cached for provider name. The XMLTV channel list is only loaded when a name
+    is not in the cache.
+    """
+    path = cachePath(name)
+    cache = {}
+
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        if time.time() - data.get("built", 0) < MAX_AGE:
+            cache = data
+    except Exception:
+        pass
+
+    matches = cache.get("matches", {})
+    missing = [channel_name for channel_name in set(channel_names) if channel_name not in matches]
+
+    if missing:
+        matcher = EpgMatcher(loadChannels(url))
+        for channel_name in missing:
+            matches[channel_name] = matcher.match(channel_name)
+
+        if debugs:
+            print("*** matchChannels ***", name, len(matcher), "guide channels", len(missing), "names", sum(1 for n in missing if matches[n]), "matched")
+
+        try:
+            writeIfChanged(path, json.dumps({"built": cache.get("built") or time.time(), "matches": matches}))
+        except Exception as e:
+            print(e)
+
+    return dict((channel_name, matches[channel_name]) for channel_name in channel_names if matches.get(channel_name))
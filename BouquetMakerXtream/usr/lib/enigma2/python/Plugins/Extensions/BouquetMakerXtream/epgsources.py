@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .bouquetwriter import writeIfChanged
+from .plugin import debugs
+
+from xml.sax.saxutils import escape, quoteattr
+
+import copy
+import os
+import xml.etree.ElementTree as ET
+
+SOURCES_FILE = "/etc/epgimport/bouquetmakerxtream.sources.xml"
+SOURCECAT_NAME = "BouquetMakerXtream EPG"
+
+
+def writeElement(out, elem, level):
+    pad = "\t" * level
+    attributes = "".join(" " + key + "=" + quoteattr(value) for key, value in elem.attrib.items())
+    children = list(elem)
+    text = (elem.text or "").strip()
+
+    if children:
+        out.append(pad + "<" + elem.tag + attributes + ">\n")
+        for child in children:
+            writeElement(out, child, level + 1)
+        out.append(pad + "</" + elem.tag + ">\n")
+    elif text:
+        out.append(pad + "<" + elem.tag + attributes + ">" + escape(text) + "</" + elem.tag + ">\n")
+    else:
+        out.append(pad + "<" + elem.tag + attributes + "/>\n")
+
+
+class EpgSources(object):
+    """
+    The epgimport sources file of all providers, held in memory for a run.
+
+    Loaded once, changed per provider with setSource() and removeSources(), and written once
+    by save(), already indented, only if its content changed.
+    """
+
+    def __init__(self, path=SOURCES_FILE):
+        self.path = path
+        self.root = None
+        self.saved = None
+
+        if os.path.isfile(path) and os.stat(path).st_size:
+            try:
+                self.root = ET.parse(path, parser=ET.XMLParser(encoding="utf-8")).getroot()
+            except Exception as e:
+                print(e)
+
+        if self.root is None:
+            self.root = ET.Element("sources")
+
+        self.sourcecat = self.root.find("sourcecat")
+        if self.sourcecat is None:
+            self.sourcecat = ET.SubElement(self.root, "sourcecat", sourcecatname=SOURCECAT_NAME)
+
+    def removeSources(self, match):
+        """Drop the sources whose description match(description) accepts."""
+        for elem in self.root.iter():
+            for child in list(elem):
+                if child.tag == "source":
+                    description = child.find("description")
+                    description = description.text or "" if description is not None else ""
+                    if match(description):
+                        elem.remove(child)
+
+    def setSource(self, name, channels, url, offset="0000"):
+        """Add the source of provider name, replacing the one it had."""
+        name = str(name)
+        self.removeSources(lambda description: description == name)
+
+        source = ET.SubElement(self.sourcecat, "source", type="gen_xmltv", nocheck="1", offset=offset, channels=channels)
+        ET.SubElement(source, "description").text = name
+        ET.SubElement(source, "url").text = str(url)
+
+    def checkpoint(self):
+        self.saved = copy.deepcopy(self.root)
+
+    def rollback(self):
+        """Undo the changes since checkpoint(). False if there was none, the model is then to be dropped."""
+        if self.saved is None:
+            return False
+        self.root = copy.deepcopy(self.saved)
+        self.sourcecat = self.root.find("sourcecat")
+        return True
+
+    def save(self):
+        out = ['<?xml version="1.0" encoding="utf-8"?>\n']
+        writeElement(out, self.root, 0)
+
+        try:
+            if writeIfChanged(self.path, "".join(out)) and debugs:
+                print("*** EpgSources saved ***", self.path)
+        except Exception as e:
+            print(e)
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .plugin import cfg, debugs, dir_tmp
+
+import heapq
+import os
+import tempfile
+
+# entries sorted in memory at a time, each run is spilled to its own file
+RUN_SIZE = 50000
+
+
+def threshold():
+    """Row count above which orderings are sorted on disk (cfg.external_sort_rows)."""
+    return int(cfg.external_sort_rows.value)
+
+
+def encode(text):
+    return text if isinstance(text, bytes) else text.encode("utf-8")
+
+
+def decode(data):
+    return data if isinstance(data, str) else data.decode("utf-8")
+
+
+def writeRun(lines, directory):
+    fd, path = tempfile.mkstemp(prefix="bmx_sort_", suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        for line in lines:
+            f.write(encode(line))
+    return path
+
+
+def readRun(path):
+    with open(path, "rb") as f:
+        for line in f:
+            yield decode(line)
+
+
+def sortKeyed(items, directory=None, run_size=RUN_SIZE):
+    """
+    Sort (key, payload) string pairs holding at most run_size of them in memory.
+
+    Sorted runs are written to directory (dir_tmp() by default) and k-way merged with heapq.merge.
+    Yields the payloads in key order, pairs with equal keys in payload order.
+    Payloads must not contain newlines.
+    """
+    directory = directory or dir_tmp()
+    runs = []
+    chunk = []
+
+    try:
+        for key, payload in items:
+            chunk.append(key.replace("\t", " ").replace("\n", " ") + "\t" + payload + "\n")
+            if len(chunk) >= run_size:
+                chunk.sort()
+                runs.append(writeRun(chunk, directory))
+                chunk = []
+
+        chunk.sort()
+
+        if not runs:
+            merged = chunk
+        else:
+            if chunk:
+                runs.append(writeRun(chunk, directory))
+                chunk = []
+            if debugs:
+                print("*** extsort merging ***", len(runs), "runs")
+            merged = heapq.merge(*[readRun(path) for path in runs])
+
+        for line in merged:
+            yield line[line.index("\t") + 1:-1]
+
+    finally:
+        for path in runs:
+            try:
+                os.remove(path)
+            except:
+                pass
+
+
+def sortedRows(count, key, reverse=False, directory=None):
+    """
+    sorted(range(count), key=key, reverse=reverse) done through sortKeyed, key returns strings.
+    Equal keys keep their row order, as with sorted().
+    """
+    if reverse:
+        # rows are numbered backwards so that equal keys are still in row order once reversed
+        rows = [count - 1 - int(payload) for payload in sortKeyed(((key(row), "%010d" % (count - 1 - row)) for row in range(count)), directory)]
+        rows.reverse()
+        return rows
+    return [int(payload) for payload in sortKeyed(((key(row), "%010d" % row) for row in range(count)), directory)]
@@ -1,12 +1,17 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from .plugin import playlists_json, cfg, pythonVer, debugs
+from .plugin import playlists_json, cfg, pythonVer, debugs, hasConcurrent
 from . import bouquet_globals as glob
+from . import catalogcache
+from . import httpclient
+from . import jsonstream
+from . import responsecache
+from . import streamrecords
 
 from enigma import eDVBDB
-from requests.adapters import HTTPAdapter
 
+import hashlib
 import json
 import os
 import re
@@ -33,6 +38,22 @@ if pythonVer == 3:
     )
 
 
+# player_api.php calls of one playlist downloading at the same time
+API_WORKERS = 4
+
+# player_api stream endpoints are decoded item by item and reduced to these keys
+stream_keys = {
+    3: ("name", "stream_id", "stream_icon", "epg_channel_id", "added", "category_id", "custom_sid", "tv_archive"),
+    4: ("name", "stream_id", "added", "category_id", "container_extension"),
+    5: ("name", "series_id", "last_modified", "category_id"),
+}
+
+# kept when the provider sends them, streams without them are not dropped
+stream_optional_keys = {
+    3: ("tv_archive_duration",),
+}
+
+
 def normalize_superscripts(text):
     return text.translate(superscript_map)
 
@@ -63,6 +84,32 @@ def clean_names(streams, category=None):
     return streams
 
 
+def clean_names_iter(streams, category=None):
+    # generator version of clean_names for streamed responses
+    if category in (0, 1, 2):
+        field = "category_name"
+    elif category == 3:
+        field = "name"
+    else:
+        field = None
+
+    superscript_found = False
+
+    for i, item in enumerate(streams):
+        if field:
+            value = item.get(field)
+            if isinstance(value, str):
+                if any(ch in superscript_chars for ch in value):
+                    item[field] = normalize_superscripts(value)
+                    superscript_found = True
+                    glob.superscripts_found = True
+
+            if i >= 99 and not (superscript_found or glob.superscripts_found):
+                field = None
+
+        yield item
+
+
 def getPlaylistJson():
     if debugs:
         print("*** getPlaylistJson ***")
@@ -86,74 +133,259 @@ def refreshBouquets():
 def downloadXtreamApi(url):
     if debugs:
         print("*** downloadXtreamApi ***", url)
-    retries = 0
-    adapter = HTTPAdapter(max_retries=retries)
-
-    with requests.Session() as http:
-        http.mount("http://", adapter)
-        http.mount("https://", adapter)
 
-        try:
-            r = http.get(url, headers=hdr, timeout=5, verify=False)
-            r.raise_for_status()
+    try:
+        r = httpclient.get(url, headers=hdr, timeout=5)
+        r.raise_for_status()
 
-            if r.status_code == requests.codes.ok:
-                try:
-                    response = r.json()
-                    return response
-                except Exception as e:
-                    print("Error processing JSON response:", e)
-                    return ""
-        except Exception as e:
-            print("Request failed:", e)
+        if r.status_code == requests.codes.ok:
+            try:
+                response = r.json()
+                return response
+            except Exception as e:
+                print("Error processing JSON response:", e)
+                return ""
+    except Exception as e:
+        print("Request failed:", e)
 
     return []
 
 
-def downloadXtreamApiCategory(url):
+def downloadXtreamApiCategory(url, path=None):
+    """
+    url is [api url, category code]. path is an already downloaded copy of the response
+    (see spoolFile), in which case nothing is fetched.
+
+    Without a path, a response decoded in the last few minutes (catalogcache) is reused.
+    """
+    if path:
+        return fetchXtreamApiCategory(url, path)
+
+    data = catalogcache.get(url[0])
+    if data is not None:
+        return url[1], data
+
+    category, data = fetchXtreamApiCategory(url)
+    catalogcache.put(url[0], data)
+    return category, data
+
+
+def prefetchXtreamApiCategories(url_list):
+    """
+    Start downloadXtreamApiCategory for every [api url, category code] of url_list at once,
+    on at most API_WORKERS threads. Returns {api url: future}.
+
+    Without concurrent.futures the result is empty and callers download each url themselves.
+    """
+    executor = downloadPool(len(url_list))
+    if not executor:
+        return {}
+
+    futures = dict((url[0], executor.submit(downloadXtreamApiCategory, url)) for url in url_list)
+
+    # the threads exit by themselves once the queued downloads are done
+    executor.shutdown(wait=False)
+    return futures
+
+
+def downloadPool(jobs):
+    if not hasConcurrent or jobs < 2:
+        return None
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=min(jobs, API_WORKERS))
+    except Exception as e:
+        print("Concurrent execution error:", e)
+        return None
+
+
+def fetchXtreamApiCategory(url, path=None):
     if debugs:
         print("*** downloadXtreamApiCategory ***", url)
 
     category = url[1]
-    retries = 0
-    adapter = HTTPAdapter(max_retries=retries)
 
-    with requests.Session() as http:
-        http.mount("http://", adapter)
-        http.mount("https://", adapter)
+    if path:
+        return category, readXtreamApiFile(path, category)
 
-        try:
-            r = http.get(url[0], headers=hdr, timeout=20, verify=False)
+    # a failed fetch falls back to the stale cached body, then to a plain download
+    if cfg.response_cache.value:
+        path = responsecache.fetch(url[0], headers=hdr, timeout=20) or responsecache.stale(url[0])
+        if path:
+            try:
+                return category, readXtreamApiFile(path, category)
+            finally:
+                responsecache.release(path)
+
+    if category in stream_keys:
+        return downloadXtreamApiStreams(url)
+
+    try:
+        r = httpclient.get(url[0], headers=hdr, timeout=20)
+        r.raise_for_status()
+
+        if r.status_code == requests.codes.ok:
+            data = r.json()
+
+            if pythonVer == 3:
+                data = clean_names(data, category)
+
+            return category, data
+
+    except Exception as e:
+        print("Request failed:", e)
+        return category, ""
+
+    return category, ""
+
+
+def decodeXtreamApiStreams(chunks, category):
+    data = streamrecords.fromItems(jsonstream.iterJsonArray(chunks), category, stream_keys[category], stream_optional_keys.get(category, ()))
+
+    if pythonVer == 3:
+        data = clean_names_iter(data, category)
+
+    return list(data)
+
+
+def readXtreamApiFile(path, category):
+    try:
+        with open(path, "rb") as f:
+            if category in stream_keys:
+                return decodeXtreamApiStreams(jsonstream.readChunks(f), category)
+
+            data = json.loads(f.read().decode("utf-8", "ignore"))
+
+        if pythonVer == 3:
+            data = clean_names(data, category)
+
+        return data
+
+    except Exception as e:
+        print("Error processing JSON response:", e)
+        return ""
+
+
+def downloadXtreamApiStreams(url):
+    """
+    Stream endpoints can be tens of MB. Decode the array item by item from the socket
+    and keep only the keys the bouquet builders use, instead of r.json() on the whole body.
+    """
+    if debugs:
+        print("*** downloadXtreamApiStreams ***", url)
+
+    category = url[1]
+
+    try:
+        with httpclient.get(url[0], headers=hdr, timeout=20, stream=True) as r:
             r.raise_for_status()
 
             if r.status_code == requests.codes.ok:
-                data = r.json()
+                return category, decodeXtreamApiStreams(r.iter_content(chunk_size=65536), category)
 
-                if pythonVer == 3:
-                    data = clean_names(data, category)
+    except Exception as e:
+        print("Request failed:", e)
+        return category, ""
 
-                return category, data
+    return category, ""
 
-        except Exception as e:
-            print("Request failed:", e)
-            return category, ""
 
-    return category, ""
+def spoolFile(url, directory, timeout=20):
+    """
+    Download url to disk without decoding it and return (path, sha1 of the body), or (None, None).
+
+    The response cache is used when enabled (a 304 costs nothing and keeps the stored digest),
+    otherwise the body is written to a file in directory. Either way the caller hands the path
+    to releaseSpoolFile when done.
+    """
+    if debugs:
+        print("*** spoolFile ***", url)
 
+    if cfg.response_cache.value:
+        path = responsecache.fetch(url, headers=hdr, timeout=timeout, chunk_size=1024 * 1024)
+        if path:
+            return path, responsecache.digest(url)
+        return None, None
 
-def downloadM3U8File(url):
+    path = os.path.join(directory, "bmx_spool_" + hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    try:
+        with httpclient.get(url, headers=hdr, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            size, sha1 = responsecache.spool(r, path, chunk_size=1024 * 1024)
+            return path, sha1
+    except Exception as e:
+        print("Request failed:", e)
+
+    return None, None
+
+
+def spoolFiles(urls, directory):
+    """
+    spoolFile for each url, safe to run in a worker thread.
+    Returns ({url: path}, [url + sha1, ...]). The list is None if any download failed.
+    """
+    spooled = {}
+    digests = []
+
+    def spool(url):
+        timeout = 20 if "player_api.php" in url else (20, 300)
+        return spoolFile(url, directory, timeout=timeout)
+
+    # the urls are independent, they download together
+    executor = downloadPool(len(urls))
+    if executor:
+        futures = [executor.submit(spool, url) for url in urls]
+        executor.shutdown(wait=True)
+        results = [future.result() for future in futures]
+    else:
+        results = [spool(url) for url in urls]
+
+    failed = False
+    for url, (path, digest) in zip(urls, results):
+        if path and digest:
+            spooled[url] = path
+            digests.append(url + digest)
+        else:
+            failed = True
+
+    return spooled, None if failed else digests
+
+
+def releaseSpoolFile(path):
+    # cached bodies stay for the next conditional request and are only unpinned, temp spool files are removed
+    if not path:
+        return
+    if path.startswith(responsecache.cache_dir):
+        responsecache.release(path)
+    else:
+        try:
+            os.remove(path)
+        except:
+            pass
+
+
+def downloadM3U8File(url, path=None):
     if debugs:
         print("*** downloadM3U8File ***", url)
     # category = url[1]
-    retries = 0
-    adapter = HTTPAdapter(max_retries=retries)
 
-    with requests.Session() as http:
-        http.mount("http://", adapter)
-        http.mount("https://", adapter)
+    if path:
+        with open(path, "rb") as f:
+            return f.read().decode("utf-8", errors="ignore")
 
-        try:
-            r = http.get(url, headers=hdr, timeout=(20, 300), verify=False, stream=True)
+    # a failed fetch falls back to the stale cached body, then to a plain download
+    if cfg.response_cache.value:
+        path = responsecache.fetch(url, headers=hdr, timeout=(20, 300), chunk_size=1024 * 1024) or responsecache.stale(url)
+        if path:
+            try:
+                with open(path, "rb") as f:
+                    return f.read().decode("utf-8", errors="ignore")
+            finally:
+                responsecache.release(path)
+
+    try:
+        with httpclient.get(url, headers=hdr, timeout=(20, 300), stream=True) as r:
             r.raise_for_status()
 
             if r.status_code == requests.codes.ok:
@@ -167,12 +399,12 @@ def downloadM3U8File(url):
 
                 return content
 
-        except requests.Timeout as e:
-            print("Error message: {}".format(str(e)))
-            return ""
-        except requests.RequestException as e:
-            print("Error message: {}".format(str(e)))
-            return ""
+    except requests.Timeout as e:
+        print("Error message: {}".format(str(e)))
+        return ""
+    except requests.RequestException as e:
+        print("Error message: {}".format(str(e)))
+        return ""
 
 
 def downloadM3U8File_wget(url):
@@ -238,6 +470,14 @@ def downloadM3U8File_with_fallback(url):
     if debugs:
         print("*** downloadM3U8File_with_fallback ***", url)
 
+    # A cached copy is parsed straight from disk, the caller releaseSpoolFile()s it
+    if cfg.response_cache.value:
+        path = responsecache.fetch(url, headers=hdr, timeout=(20, 300), chunk_size=1024 * 1024)
+        if path:
+            if debugs:
+                print("*** using response cache ***")
+            return ("file", path)
+
     # Try curl pipe first (streaming)
     try:
         process = downloadM3U8File_curl_pipe(url)
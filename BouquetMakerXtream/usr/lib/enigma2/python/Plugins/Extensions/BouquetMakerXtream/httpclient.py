@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .plugin import cfg, debugs
+
+from requests.adapters import HTTPAdapter, Retry
+
+import requests
+import threading
+
+# One requests.Session per retry policy, shared by every module.
+# Each session keeps a keep-alive connection pool per host, so repeated
+# player_api / get.php calls to the same provider reuse the TCP/TLS connection.
+_sessions = {}
+_lock = threading.Lock()
+
+
+def retryPolicy(retries=None, backoff=None):
+    if retries is None:
+        retries = int(cfg.http_retries.value)
+    if backoff is None:
+        backoff = float(cfg.http_backoff.value)
+    return int(retries), float(backoff)
+
+
+def getSession(retries=None, backoff=None):
+    """
+    Return the shared session for a retry policy.
+
+    retries / backoff default to the values configured in the plugin settings.
+    Callers that need a specific policy (catchup, picons, playlist checks) pass it explicitly.
+    """
+    key = retryPolicy(retries, backoff)
+
+    with _lock:
+        http = _sessions.get(key)
+        if http is None:
+            if debugs:
+                print("*** httpclient new session ***", key)
+
+            pool_connections = int(cfg.http_pool_connections.value)
+            # picon downloads run cfg.max_threads workers against the same host
+            pool_maxsize = max(int(cfg.http_pool_maxsize.value), int(cfg.max_threads.value))
+
+            adapter = HTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                max_retries=Retry(total=key[0], backoff_factor=key[1])
+            )
+
+            http = requests.Session()
+            http.mount("http://", adapter)
+            http.mount("https://", adapter)
+            _sessions[key] = http
+
+    return http
+
+
+def get(url, retries=None, backoff=None, **kwargs):
+    kwargs.setdefault("verify", False)
+    return getSession(retries, backoff).get(url, **kwargs)
+
+
+def closeSessions():
+    with _lock:
+        for http in _sessions.values():
+            try:
+                http.close()
+            except Exception as e:
+                print(e)
+        _sessions.clear()
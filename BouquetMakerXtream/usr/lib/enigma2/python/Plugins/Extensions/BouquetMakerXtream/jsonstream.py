@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+
+WHITESPACE = " \t\n\r"
+COMPACT_AT = 256 * 1024
+
+
+def iterJsonArray(chunks):
+    """
+    Incrementally decode a top level JSON array from an iterable of byte chunks
+    (requests iter_content, an open file, a curl pipe) and yield one item at a time.
+
+    Only the current item and the undecoded tail of the last chunk are held in memory.
+    A top level object is treated as {key: item} and its values are yielded, which is
+    what some panels return instead of a list.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")("ignore")
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    eof = False
+
+    def read(buf, pos):
+        for chunk in chunks:
+            if chunk:
+                text = utf8.decode(chunk)
+                if text:
+                    return buf[pos:] + text, 0, False
+        return buf[pos:] + utf8.decode(b"", True), 0, True
+
+    # find the opening bracket
+    while True:
+        while pos < len(buf) and buf[pos] in WHITESPACE:
+            pos += 1
+        if pos < len(buf) or eof:
+            break
+        buf, pos, eof = read(buf, pos)
+
+    if pos >= len(buf):
+        return
+
+    if buf[pos] != "[":
+        # not an array - decode the remainder in one go
+        while not eof:
+            buf, pos, eof = read(buf, pos)
+        try:
+            data = json.loads(buf[pos:])
+        except ValueError:
+            return
+        if isinstance(data, dict):
+            for item in data.values():
+                yield item
+        return
+
+    pos += 1
+
+    while True:
+        while pos < len(buf) and buf[pos] in WHITESPACE:
+            pos += 1
+
+        if pos >= len(buf):
+            if eof:
+                return
+            buf, pos, eof = read(buf, pos)
+            continue
+
+        char = buf[pos]
+
+        if char == "]":
+            return
+
+        if char == ",":
+            pos += 1
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            buf, pos, eof = read(buf, pos)
+            continue
+
+        # a bare number at the end of the buffer may continue in the next chunk
+        if end >= len(buf) and not eof and not isinstance(item, (dict, list)):
+            buf, pos, eof = read(buf, pos)
+            continue
+
+        yield item
+        pos = end
+
+        if pos > COMPACT_AT:
+            buf = buf[pos:]
+            pos = 0
+
+
+def readChunks(f, chunk_size=65536):
+    """Iterate a binary file in fixed size chunks (player_api bodies are usually a single line)."""
+    return iter(lambda: f.read(chunk_size), b"")
@@ -1,165 +1,336 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import re
+import io
+import mmap
 import os
-import codecs
+import re
 from . import _
 from . import bouquet_globals as glob
-from .plugin import cfg
+from .plugin import debugs
 
 # Pre-compile only the complex regex patterns we need
 SERIES_PATTERN = re.compile(r'(S\d+|E\d+)', re.IGNORECASE)
 DOUBLE_SPACES_PATTERN = re.compile(r'\s{2,}')
+URL_SCHEMES = ("http://", "https://", "rtsp://")
+URL_SCHEMES_BYTES = (b"http://", b"https://", b"rtsp://")
 
 
-def parseM3u8Playlist(response):
-    # Handle response depending on whether it's local or downloaded
-    playlist_type = glob.current_playlist["playlist_info"]["playlist_type"]
-
-    if playlist_type == "local":
-        local_file = os.path.join(cfg.local_location.value, glob.current_playlist["playlist_info"]["full_url"])
-        with codecs.open(local_file, "r", encoding="utf-8") as f:
-            response_lines = f.readlines()
-    else:
-        response_lines = response.splitlines()
-
-    length = len(response_lines)
-    live_streams = []
-    vod_streams = []
-    series_streams = []
-    skip_next = False
-    streamid = 0
-    channel_num = 0
+class M3uEntry(object):
+    """One playlist entry: the #EXTINF attributes and the url that follows them."""
+
+    def __init__(self, epg_id, logo, group_title, name, source):
+        self.epg_id = epg_id
+        self.logo = logo
+        self.group_title = group_title
+        self.name = name
+        self.source = source
+        self.stream_type = None
+
+
+def iterLines(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "ignore")
+        line = line.strip()
+        if line:
+            yield line
+
+
+def tokenize(lines, schemes=URL_SCHEMES):
+    """
+    Yield (extinf, extgrp, source) for every entry of a playlist.
+
+    lines is any iterable of str or bytes lines: an open file, a curl pipe, a requests iter_lines().
+    An entry is an #EXTINF line, optionally followed by #EXTGRP or other directives, then its url.
+    Only the current entry is held in memory.
+    """
+    extinf = None
+    extgrp = ""
 
-    index = 0
-    while index < length:
-        if skip_next:
-            skip_next = False
-            index += 1
+    for line in iterLines(lines):
+        if line.startswith("#EXTINF"):
+            extinf = line if line != "#EXTINF:0,#EXTM3U" else None
+            extgrp = ""
+
+        elif extinf is None:
             continue
 
-        line = response_lines[index].strip()
-
-        # If a new #EXTINF line is encountered, restart the process of looking for a URL
-        if line.startswith("#EXTINF") and line != "#EXTINF:0,#EXTM3U":
-            group_title = ""
-            name = ""
-            logo = ""
-            epg_id = ""
-
-            # Extract logo using string methods (faster than regex)
-            logo_pos = line.find('tvg-logo="')
-            if logo_pos > -1:
-                end_pos = line.find('"', logo_pos + 10)
-                if end_pos > -1:
-                    logo = line[logo_pos + 10:end_pos].strip()
-                    if logo.startswith("data:image"):
-                        logo = ""
-                        # Remove the logo attribute from line
-                        line = line[:logo_pos] + line[end_pos + 1:]
-
-            # Extract group-title using string methods
-            gt_pos = line.find('group-title="')
-            if gt_pos > -1:
-                end_pos = line.find('"', gt_pos + 13)
-                if end_pos > -1:
-                    group_title = line[gt_pos + 13:end_pos].strip()
-
-            # Extract tvg-name using string methods
-            name_pos = line.find('tvg-name="')
-            if name_pos > -1:
-                end_pos = line.find('"', name_pos + 10)
-                if end_pos > -1:
-                    name = line[name_pos + 10:end_pos].strip()
-
-            # Extract tvg-id using string methods
-            epg_pos = line.find('tvg-id="')
-            if epg_pos > -1:
-                end_pos = line.find('"', epg_pos + 8)
-                if end_pos > -1:
-                    epg_id = line[epg_pos + 8:end_pos].strip()
-
-            # Fallback: name after last comma
-            if not name and ',' in line:
-                name = line.strip().split(",")[-1].strip()
-
-            name = remove_duplicate_phrases(name)
-
-            if not name:
-                channel_num += 1
-                name = _("Stream") + " " + str(channel_num)
-
-            # Check for URL in the next line or two lines after
-            source = None
-            if index + 1 < length:
-                next_line = response_lines[index + 1].strip()
-
-                # Fast URL check without regex
-                if next_line.startswith(('http://', 'https://', 'rtsp://')):
-                    source = next_line.split()[0]  # Take first token
-                    skip_next = True
-                elif next_line.startswith("#EXTGRP") and not group_title:
-                    group_title = next_line.split(":", 1)[-1].strip()
-                    # Check next line for URL
-                    if index + 2 < length:
-                        next_next_line = response_lines[index + 2].strip()
-                        if next_next_line.startswith(('http://', 'https://', 'rtsp://')):
-                            source = next_next_line.split()[0]
-                            skip_next = True
-
-            # If a URL wasn't found after expected lines, skip this entry and continue
-            if not source:
-                index += 1
-                continue
+        elif line.startswith("#EXTGRP"):
+            extgrp = line.split(":", 1)[-1].strip()
+
+        elif line.startswith(schemes):
+            yield extinf, extgrp, line.split()[0]
+            extinf = None
+
+        elif not line.startswith("#"):
+            # not a supported url, the entry is dropped
+            extinf = None
+
+
+def attribute(line, key):
+    pos = line.find(key)
+    if pos > -1:
+        start = pos + len(key)
+        end = line.find('"', start)
+        if end > -1:
+            return line[start:end].strip()
+    return ""
+
+
+def readEntry(extinf, extgrp, source):
+    logo = ""
+    logo_pos = extinf.find('tvg-logo="')
+    if logo_pos > -1:
+        end_pos = extinf.find('"', logo_pos + 10)
+        if end_pos > -1:
+            logo = extinf[logo_pos + 10:end_pos].strip()
+            if logo.startswith("data:image"):
+                logo = ""
+                # drop the inline image before searching the other attributes
+                extinf = extinf[:logo_pos] + extinf[end_pos + 1:]
+
+    group_title = attribute(extinf, 'group-title="') or extgrp
+    name = attribute(extinf, 'tvg-name="')
+    epg_id = attribute(extinf, 'tvg-id="')
 
-            # Determine the stream type based on the URL and name
-            stream_type = ""
-            lower_source = source.lower()
-
-            # Early stream type detection with optimized checks
-            if "/series/" in lower_source and "/live/" not in lower_source and "/movie/" not in lower_source:
-                stream_type = "series"
-            elif "/movie/" in lower_source or lower_source.endswith((".mp4", ".mkv", ".avi")):
-                stream_type = "vod"
-            elif (
-                lower_source.endswith((".ts", ".m3u8", ".mpd", "mpegts", ":")) or
-                "/live" in lower_source or
-                "/m3u8" in lower_source or
-                "deviceuser" in lower_source or
-                "devicemac" in lower_source or
-                "/play/" in lower_source or
-                "pluto.tv" in lower_source or
-                (source[-1].isdigit())
-            ):
-                stream_type = "live"
+    # Fallback: name after last comma
+    if not name:
+        comma = extinf.rfind(",")
+        if comma > -1:
+            name = extinf[comma + 1:].strip()
+
+    return M3uEntry(epg_id, logo, group_title, name, source)
+
+
+def readEntries(lines):
+    for extinf, extgrp, source in tokenize(lines):
+        yield readEntry(extinf, extgrp, source)
+
+
+def decode(data):
+    return data.decode("utf-8", "ignore").strip()
+
+
+def tokenizeMapped(mm, start=0, end=None, schemes=URL_SCHEMES_BYTES):
+    """
+    tokenize() for a memory mapped playlist, working on the bytes of the map.
+
+    Yields (extinf, extgrp, source) with extinf left as bytes. Lines are read from the map one
+    at a time and nothing is decoded here except the #EXTGRP value and the url.
+    """
+    if end is None:
+        end = mm.size()
+
+    extinf = None
+    extgrp = ""
+    mm.seek(start)
+
+    while mm.tell() < end:
+        line = mm.readline().strip()
+        if not line:
+            continue
+
+        if line.startswith(b"#EXTINF"):
+            extinf = line if line != b"#EXTINF:0,#EXTM3U" else None
+            extgrp = ""
+
+        elif extinf is None:
+            continue
+
+        elif line.startswith(b"#EXTGRP"):
+            extgrp = decode(line.split(b":", 1)[-1])
+
+        elif line.startswith(schemes):
+            yield extinf, extgrp, decode(line.split()[0])
+            extinf = None
+
+        elif not line.startswith(b"#"):
+            # not a supported url, the entry is dropped
+            extinf = None
+
+
+def rawAttribute(line, key, skip=None):
+    pos = line.find(key)
+    if skip and skip[0] <= pos < skip[1]:
+        pos = line.find(key, skip[1])
+    if pos > -1:
+        start = pos + len(key)
+        end = line.find(b'"', start)
+        if end > -1:
+            return decode(line[start:end])
+    return ""
+
+
+def readMappedEntry(extinf, extgrp, source):
+    """readEntry() for an #EXTINF line still in bytes, only the attribute values that are kept get decoded."""
+    logo = ""
+    skip = None
+    logo_pos = extinf.find(b'tvg-logo="')
+    if logo_pos > -1:
+        end_pos = extinf.find(b'"', logo_pos + 10)
+        if end_pos > -1:
+            if extinf[logo_pos + 10:logo_pos + 40].strip().startswith(b"data:image"):
+                # inline images are neither decoded nor searched
+                skip = (logo_pos, end_pos + 1)
             else:
-                # Fallback: check for series pattern in name
-                if SERIES_PATTERN.search(name):
-                    stream_type = "series"
-                else:
-                    stream_type = "live"  # Default to live
-
-            # Append the stream to the appropriate list based on stream type
-            if name and source:
-                if stream_type == "live" and glob.current_playlist["settings"]["show_live"]:
-                    group_title = group_title if group_title else "Uncategorised Live"
-                    streamid += 1
-                    live_streams.append([epg_id, logo, group_title, name, source, streamid])
-
-                elif stream_type == "vod" and glob.current_playlist["settings"]["show_vod"]:
-                    group_title = group_title if group_title else "Uncategorised VOD"
-                    streamid += 1
-                    vod_streams.append([epg_id, logo, group_title, name, source, streamid])
-
-                elif stream_type == "series" and glob.current_playlist["settings"]["show_series"]:
-                    group_title = group_title if group_title else "Uncategorised Series"
-                    streamid += 1
-                    series_streams.append([epg_id, logo, group_title, name, source, streamid])
-
-        index += 1
-
-    return live_streams, vod_streams, series_streams
+                logo = decode(extinf[logo_pos + 10:end_pos])
+
+    group_title = rawAttribute(extinf, b'group-title="', skip) or extgrp
+    name = rawAttribute(extinf, b'tvg-name="', skip)
+    epg_id = rawAttribute(extinf, b'tvg-id="', skip)
+
+    # Fallback: name after last comma
+    if not name:
+        comma = extinf.rfind(b",")
+        if skip and skip[0] <= comma < skip[1]:
+            comma = extinf.rfind(b",", 0, skip[0])
+        if comma > -1:
+            name = decode(extinf[comma + 1:])
+
+    return M3uEntry(epg_id, logo, group_title, name, source)
+
+
+def readMappedEntries(mm, start=0, end=None):
+    for extinf, extgrp, source in tokenizeMapped(mm, start, end):
+        yield readMappedEntry(extinf, extgrp, source)
+
+
+def parseEntries(lines, classify=None, accept=None):
+    """
+    Typed entries of a playlist, one at a time.
+
+    classify(entry) returns the stream type ("live", "vod", "series") and may tidy the entry,
+    returning None drops it. accept(entry) filters the classified entries.
+    """
+    return typedEntries(readEntries(lines), classify, accept)
+
+
+def typedEntries(entries, classify=None, accept=None):
+    for entry in entries:
+        if classify:
+            entry.stream_type = classify(entry)
+            if entry.stream_type is None:
+                continue
+
+        if accept is None or accept(entry):
+            yield entry
+
+
+def streamType(name, source):
+    lower_source = source.lower()
+
+    # Early stream type detection with optimized checks
+    if "/series/" in lower_source and "/live/" not in lower_source and "/movie/" not in lower_source:
+        return "series"
+    elif "/movie/" in lower_source or lower_source.endswith((".mp4", ".mkv", ".avi")):
+        return "vod"
+    elif (
+        lower_source.endswith((".ts", ".m3u8", ".mpd", "mpegts", ":")) or
+        "/live" in lower_source or
+        "/m3u8" in lower_source or
+        "deviceuser" in lower_source or
+        "devicemac" in lower_source or
+        "/play/" in lower_source or
+        "pluto.tv" in lower_source or
+        (source[-1].isdigit())
+    ):
+        return "live"
+
+    # Fallback: check for series pattern in name
+    if SERIES_PATTERN.search(name):
+        return "series"
+
+    return "live"  # Default to live
+
+
+def asLines(response):
+    # playlist text is read through a buffer rather than split into a list of lines
+    if isinstance(response, bytes):
+        return io.BytesIO(response)
+    if isinstance(response, str):
+        return io.StringIO(response)
+    return response
+
+
+def parseM3u8Playlist(response):
+    """
+    Split a playlist into live, vod and series lists of [epg_id, logo, group_title, name, source, streamid].
+    response is any iterable of lines (open file, curl pipe) or the playlist text.
+    """
+    return mergeChunks([parseChunk(readEntries(asLines(response)), shownTypes())])
+
+
+def parseM3u8File(path, shown=None):
+    """
+    parseM3u8Playlist for a playlist on disk. The file is memory mapped and parsed in one pass,
+    no copy of its text is made. shown defaults to the stream types of the current playlist.
+    """
+    size = os.path.getsize(path)
+
+    if not size:
+        return [], [], []
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return mergeChunks([parseChunk(readMappedEntries(mm, 0, size), shown or shownTypes())])
+        finally:
+            mm.close()
+
+
+def shownTypes():
+    settings = glob.current_playlist["settings"]
+    return {"live": settings["show_live"], "vod": settings["show_vod"], "series": settings["show_series"]}
+
+
+def parseChunk(entries, shown):
+    """
+    Classify the entries of (part of) a playlist. Returns (parsed, unnamed).
+
+    parsed are (stream_type, epg_id, logo, group_title, name, source, number) for the shown types.
+    Entries without a name keep name None and their number among the unnamed entries of the part,
+    unnamed is how many there were in total, shown or not, so the parts can be numbered in order.
+    """
+    parsed = []
+    unnamed = [0]
+
+    def classify(entry):
+        entry.name = remove_duplicate_phrases(entry.name)
+
+        if not entry.name:
+            unnamed[0] += 1
+            entry.name = None
+            return streamType("", entry.source)
+
+        return streamType(entry.name, entry.source)
+
+    def accept(entry):
+        return shown[entry.stream_type]
+
+    for entry in typedEntries(entries, classify, accept):
+        parsed.append((entry.stream_type, entry.epg_id, entry.logo, entry.group_title, entry.name, entry.source, unnamed[0]))
+
+    return parsed, unnamed[0]
+
+
+def mergeChunks(chunks):
+    """Join parsed parts in playlist order, numbering streamid and the unnamed streams across them."""
+    uncategorised = {"live": "Uncategorised Live", "vod": "Uncategorised VOD", "series": "Uncategorised Series"}
+    streams = {"live": [], "vod": [], "series": []}
+    stream_label = _("Stream")
+    streamid = 0
+    offset = 0
+
+    for entries, unnamed in chunks:
+        for stream_type, epg_id, logo, group_title, name, source, number in entries:
+            streamid += 1
+            if name is None:
+                name = stream_label + " " + str(offset + number)
+            streams[stream_type].append([epg_id, logo, group_title or uncategorised[stream_type], name, source, streamid])
+        offset += unnamed
+
+    return streams["live"], streams["vod"], streams["series"]
 
 
 def remove_duplicate_phrases(input_string):
@@ -4,6 +4,7 @@
 from . import _
 from . import bouquet_globals as glob
 from . import globalfunctions as bmx
+from . import servicerefs
 from .bmxStaticText import StaticText
 from .plugin import cfg, common_path, skin_directory, version, pythonVer, dir_tmp
 
@@ -126,6 +127,7 @@ class BmxDownloadPicons(Screen):
                 self.unique_ref += value
 
             self.deletePiconSet(str(self.unique_ref))
+            encoder = servicerefs.ServiceRefEncoder(stream_type, self.unique_ref)
 
             response = bmx.downloadXtreamApi(url)
 
@@ -177,17 +179,11 @@ class BmxDownloadPicons(Screen):
                             continue
 
                         try:
-                            bouquet_id1 = int(stream_id) // 65535
-                            bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
+                            custom_sid = encoder.sid(int(stream_id))
                         except:
                             continue
 
-                        custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:"
-
-                        if "custom_sid" in channel and channel["custom_sid"] and str(channel["custom_sid"]) not in ("null", "None", "0", ":0:0:0:0:0:0:0:0:0:") and len(channel["custom_sid"]) > 16:
-                            custom_sid = str(channel["custom_sid"])
-                            if custom_sid[0].isdigit():
-                                custom_sid = custom_sid[1:]
+                        custom_sid = servicerefs.customSid(channel.get("custom_sid")) or custom_sid
 
                         custom_sid = str(stream_type) + str(custom_sid).rstrip(":")
                         custom_sid = custom_sid.replace(":", "_")
@@ -19,7 +19,6 @@ except ImportError:
 
 # Third-party imports
 import requests
-from requests.adapters import HTTPAdapter, Retry
 
 # Enigma2 components
 from Components.ActionMap import ActionMap
@@ -36,6 +35,7 @@ from . import bouquet_globals as glob
 from .plugin import cfg, common_path, hasConcurrent, hasMultiprocessing, playlist_file, playlists_json, skin_directory, version, epgimporter
 from .bmxStaticText import StaticText
 from . import checkinternet
+from . import httpclient
 
 hdr = {
     'User-Agent': str(cfg.useragent.value),
@@ -157,34 +157,28 @@ class BmxPlaylists(Screen):
     def download_url(self, url):
         index = url[1]
         response = None
-        retries = Retry(total=2, backoff_factor=1)
-        adapter = HTTPAdapter(max_retries=retries)
 
-        with requests.Session() as http:
-            http.mount("http://", adapter)
-            http.mount("https://", adapter)
-
-            try:
-                # Perform the initial request
-                r = http.get(url[0], headers=hdr, timeout=6, verify=False)
-                r.raise_for_status()
-
-                if r.status_code == requests.codes.ok:
-                    if "player_api.php" in url[0]:
-                        try:
-                            response = r.json()
-                        except Exception as e:
-                            print("JSON parsing error:", e)
-                    else:
-                        try:
-                            response = r.text
-                            if "EXTM3U" not in response:
-                                response = None
-                        except Exception as e:
-                            print("Text response error:", e)
-
-            except Exception as e:
-                print("Request error:", e)
+        try:
+            # Perform the initial request
+            r = httpclient.get(url[0], retries=2, backoff=1, headers=hdr, timeout=6)
+            r.raise_for_status()
+
+            if r.status_code == requests.codes.ok:
+                if "player_api.php" in url[0]:
+                    try:
+                        response = r.json()
+                    except Exception as e:
+                        print("JSON parsing error:", e)
+                else:
+                    try:
+                        response = r.text
+                        if "EXTM3U" not in response:
+                            response = None
+                    except Exception as e:
+                        print("Text response error:", e)
+
+        except Exception as e:
+            print("Request error:", e)
 
         return index, response
 
@@ -10,7 +10,6 @@ import sys
 import time
 import twisted.python.runtime
 from datetime import datetime, timedelta
-from requests.adapters import HTTPAdapter, Retry
 
 try:
     from urlparse import urljoin
@@ -200,6 +199,33 @@ cfg.picon_location = ConfigSelection(default="/media/hdd/picon/", choices=[
 
 cfg.useragent = ConfigSelection(default="Enigma2 - BouquetMakerXtream Plugin", choices=useragents)
 
+# shared http client (httpclient.py)
+cfg.http_pool_connections = ConfigSelectionNumber(2, 20, 2, default=10, wraparound=True)
+cfg.http_pool_maxsize = ConfigSelectionNumber(2, 20, 2, default=10, wraparound=True)
+cfg.http_retries = ConfigSelectionNumber(0, 5, 1, default=0, wraparound=True)
+cfg.http_backoff = ConfigSelection(default="0", choices=[("0", _("None")), ("0.5", "0.5s"), ("1", "1s"), ("2", "2s")])
+
+# conditional request cache (responsecache.py)
+cfg.response_cache = ConfigYesNo(default=False)
+cfg.response_cache_size = ConfigSelectionNumber(50, 500, 50, default=50, wraparound=True)
+cfg.response_cache_days = ConfigSelectionNumber(1, 30, 1, default=7, wraparound=True)
+
+# providers downloaded ahead of the one being built (update2.py)
+cfg.update_concurrency = ConfigSelectionNumber(1, 4, 1, default=2, wraparound=True)
+
+# sorting on disk for very large catalogues (extsort.py)
+cfg.external_sort_rows = ConfigSelectionNumber(50000, 1000000, 50000, default=250000, wraparound=True)
+
+# collation of names, numbers by value when set (sortkeys.py)
+cfg.natural_sort = ConfigYesNo(default=False)
+
+# local xmltv guide for catchup (xmltvguide.py)
+cfg.xmltv_guide = ConfigYesNo(default=False)
+cfg.xmltv_guide_location = ConfigDirectory(default="/media/hdd/")
+
+# epg ids by channel name for streams without one (epgmatch.py)
+cfg.epg_match = ConfigYesNo(default=False)
+
 cfg.deepstandby = ConfigSelection(default="skip", choices=[
     ("wakeup", _("import after wake up")),
     ("skip", _("skip the import"))
@@ -211,6 +237,7 @@ cfg.deepstandby = ConfigSelection(default="skip", choices=[
 # Set default file paths
 playlist_file = os.path.join(dir_etc, "playlists.txt")
 playlists_json = os.path.join(dir_etc, "bmx_playlists.json")
+digests_json = os.path.join(dir_etc, "bmx_digests.json")
 
 # Set skin and font paths
 skin_path = os.path.join(skin_directory, cfg.skin.value)
@@ -492,26 +519,21 @@ def showBmxCatchup(self):
 
     get_live_streams = "%s/player_api.php?username=%s&password=%s&action=get_live_streams" % (domain, username, password)
 
-    retries = Retry(total=1, backoff_factor=1)
-    adapter = HTTPAdapter(max_retries=retries)
+    from . import httpclient
 
-    with requests.Session() as http:
-        http.mount("http://", adapter)
-        http.mount("https://", adapter)
-        response = ""
+    response = ""
 
-        try:
-            # Use context manager for the response
-            r = http.get(get_live_streams, headers=hdr, timeout=10, verify=False)
-            r.raise_for_status()
-            if r.status_code == requests.codes.ok:
-                try:
-                    response = r.json()
-                except Exception as ex:
-                    print("JSON parsing error:", ex)
-
-        except Exception as exc:
-            print("Request error:", exc)
+    try:
+        r = httpclient.get(get_live_streams, retries=1, backoff=1, headers=hdr, timeout=10)
+        r.raise_for_status()
+        if r.status_code == requests.codes.ok:
+            try:
+                response = r.json()
+            except Exception as ex:
+                print("JSON parsing error:", ex)
+
+    except Exception as exc:
+        print("Request error:", exc)
 
     if response:
         live_streams = response
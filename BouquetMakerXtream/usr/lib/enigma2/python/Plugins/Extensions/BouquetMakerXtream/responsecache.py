@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .plugin import cfg, debugs, dir_etc
+from . import httpclient
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Each url is stored as <sha1>.body (raw response) and <sha1>.json (validators).
+# Later requests for the same url are sent as conditional GETs and a 304 serves the body from disk.
+# Bodies handed out by fetch() and stale() are pinned until release(), prune() leaves them alone.
+cache_dir = os.path.join(dir_etc, "cache")
+_lock = threading.Lock()
+_pins = {}
+
+# a body without its .json this young may still be between spool() and writeMeta()
+ORPHAN_AGE = 3600
+
+
+def cachePaths(url):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    base = os.path.join(cache_dir, key)
+    return base + ".body", base + ".json"
+
+
+def maxAge():
+    return int(cfg.response_cache_days.value) * 86400
+
+
+def maxSize():
+    return int(cfg.response_cache_size.value) * 1024 * 1024
+
+
+def pin(path):
+    with _lock:
+        _pins[path] = _pins.get(path, 0) + 1
+
+
+def release(path):
+    """Unpin a body returned by fetch() or stale() once it has been read."""
+    with _lock:
+        count = _pins.get(path, 0) - 1
+        if count > 0:
+            _pins[path] = count
+        else:
+            _pins.pop(path, None)
+
+
+def readMeta(meta_path):
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def writeMeta(meta_path, meta):
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.rename(tmp_path, meta_path)
+
+
+def removeEntry(body_path, meta_path):
+    for path in (body_path, meta_path):
+        try:
+            os.remove(path)
+        except:
+            pass
+
+
+def fetch(url, headers=None, timeout=20, chunk_size=65536):
+    """
+    Return the path of a local file holding the response body of url, or None if the download failed.
+    The path is pinned, the caller release()s it when done reading.
+
+    A cached copy younger than cfg.response_cache_days is revalidated with If-None-Match / If-Modified-Since.
+    On 304 Not Modified the cached file is returned and nothing is downloaded.
+    """
+    if debugs:
+        print("*** responsecache fetch ***", url)
+
+    body_path, meta_path = cachePaths(url)
+    request_headers = dict(headers or {})
+
+    # pinned before the cache is looked at, a prune() running now cannot drop it under us
+    pin(body_path)
+
+    meta = readMeta(meta_path)
+    if meta and os.path.isfile(body_path) and time.time() - meta.get("time", 0) < maxAge():
+        if meta.get("etag"):
+            request_headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            request_headers["If-Modified-Since"] = meta["last_modified"]
+    else:
+        meta = {}
+
+    try:
+        with httpclient.get(url, headers=request_headers, timeout=timeout, stream=True) as r:
+            if r.status_code == 304 and meta:
+                if debugs:
+                    print("*** responsecache not modified ***", url)
+                meta["time"] = time.time()
+                writeMeta(meta_path, meta)
+                return body_path
+
+            r.raise_for_status()
+
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            size, sha1 = spool(r, body_path, chunk_size)
+
+            writeMeta(meta_path, {
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "time": time.time(),
+                "size": size,
+                "sha1": sha1
+            })
+
+    except Exception as e:
+        print("Request failed:", e)
+        release(body_path)
+        return None
+
+    return body_path
+
+
+def spool(r, path, chunk_size=65536):
+    """Write a streamed response to path atomically. Returns (size, sha1 hexdigest) of the body."""
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    sha1 = hashlib.sha1()
+    size = 0
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    sha1.update(chunk)
+                    size += len(chunk)
+        os.rename(tmp_path, path)
+    except:
+        try:
+            os.remove(tmp_path)
+        except:
+            pass
+        raise
+
+    return size, sha1.hexdigest()
+
+
+def digest(url):
+    """sha1 of the cached body of url, or None if it is not cached."""
+    return readMeta(cachePaths(url)[1]).get("sha1")
+
+
+def stale(url):
+    """Path of the cached body of url whatever its age, pinned like fetch(), or None. For when fetch() failed."""
+    body_path, meta_path = cachePaths(url)
+    pin(body_path)
+    if readMeta(meta_path) and os.path.isfile(body_path):
+        return body_path
+    release(body_path)
+    return None
+
+
+def prune():
+    """
+    Drop entries older than cfg.response_cache_days, then the oldest entries until under
+    cfg.response_cache_size. Pinned bodies are kept. Run once a build or update has finished
+    reading its downloads, not per fetch.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    with _lock:
+        now = time.time()
+        entries = []
+        pinned = 0
+
+        for filename in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, filename)
+
+            if filename.endswith(".json"):
+                body_path = path[:-5] + ".body"
+                meta = readMeta(path)
+                if body_path in _pins:
+                    # still being read, it counts towards the size but is not dropped
+                    pinned += meta.get("size", 0)
+                    continue
+                if not meta or not os.path.isfile(body_path) or now - meta.get("time", 0) > maxAge():
+                    removeEntry(body_path, path)
+                    continue
+                entries.append((meta.get("time", 0), meta.get("size", 0), body_path, path))
+
+            elif filename.endswith(".body"):
+                if path in _pins or os.path.isfile(path[:-5] + ".json"):
+                    continue
+                try:
+                    if now - os.path.getmtime(path) > ORPHAN_AGE:
+                        removeEntry(path, path[:-5] + ".json")
+                except:
+                    pass
+
+            elif filename.endswith(".tmp"):
+                # left behind by an interrupted download
+                try:
+                    if now - os.path.getmtime(path) > ORPHAN_AGE:
+                        os.remove(path)
+                except:
+                    pass
+
+        total = pinned + sum(entry[1] for entry in entries)
+        limit = maxSize()
+
+        for entry in sorted(entries):
+            if total <= limit:
+                break
+            removeEntry(entry[2], entry[3])
+            total -= entry[1]
+
+
+def clear():
+    if not os.path.isdir(cache_dir):
+        return
+    with _lock:
+        for filename in os.listdir(cache_dir):
+            try:
+                os.remove(os.path.join(cache_dir, filename))
+            except:
+                pass
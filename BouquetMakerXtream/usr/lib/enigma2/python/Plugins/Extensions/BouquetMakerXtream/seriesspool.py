@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from . import extsort
+from . import sortkeys
+from .plugin import debugs
+
+import os
+import shutil
+import tempfile
+
+# rendered lines held in memory before they are appended to the category files
+MAX_BUFFERED = 20000
+
+
+def nameKey():
+    """sort_key ordering #SERVICE lines by name, in the collation of sortkeys.keyFunction()."""
+    key = sortkeys.keyFunction()
+
+    def lineKey(line):
+        # names are stored without ":", the last field of a #SERVICE line is the name
+        return key(line.rstrip("\n").rsplit(":", 1)[-1])
+
+    return lineKey
+
+
+class SeriesSpool(object):
+    """
+    Rendered series bouquet lines, appended to one temp file per category while the playlist is parsed.
+
+    Only MAX_BUFFERED lines are held at a time, so the series bouquets of a provider with a
+    million episodes are built without the episode list ever being in memory.
+    text() returns the lines of one category in the order they were added, or ordered by
+    sort_key within the category. sort_key returns strings; categories with more lines than
+    extsort.threshold() are sorted on disk.
+    """
+
+    def __init__(self, directory, sort_key=None):
+        self.directory = tempfile.mkdtemp(prefix="bmx_series_", dir=directory)
+        self.sort_key = sort_key
+        self.paths = {}
+        self.counts = {}
+        self.buffers = {}
+        self.buffered = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, category_id):
+        return category_id in self.paths
+
+    def add(self, category_id, line):
+        if category_id not in self.paths:
+            self.paths[category_id] = os.path.join(self.directory, str(len(self.paths)) + ".txt")
+            self.counts[category_id] = 0
+            self.buffers[category_id] = []
+
+        self.buffers[category_id].append(line)
+        self.counts[category_id] += 1
+        self.buffered += 1
+        self.count += 1
+
+        if self.buffered >= MAX_BUFFERED:
+            self.flush()
+
+    def flush(self):
+        for category_id, lines in self.buffers.items():
+            if lines:
+                data = "".join(lines)
+                if not isinstance(data, bytes):
+                    data = data.encode("utf-8")
+                with open(self.paths[category_id], "ab") as f:
+                    f.write(data)
+                del lines[:]
+        self.buffered = 0
+
+    def text(self, category_id):
+        if self.buffered:
+            self.flush()
+
+        if self.sort_key and self.counts[category_id] > extsort.threshold():
+            return self.externalText(category_id)
+
+        with open(self.paths[category_id], "rb") as f:
+            text = f.read()
+
+        if not isinstance(text, str):
+            text = text.decode("utf-8")
+
+        if self.sort_key:
+            lines = text.splitlines(True)
+            lines.sort(key=self.sort_key)
+            text = "".join(lines)
+
+        return text
+
+    def externalText(self, category_id):
+        sort_key = self.sort_key
+
+        # numbered so that lines with equal keys stay in the order they were added
+        def lines():
+            with open(self.paths[category_id], "rb") as f:
+                for number, line in enumerate(f):
+                    line = extsort.decode(line).rstrip("\n")
+                    yield sort_key(line), "%010d" % number + line
+
+        return "".join(line[10:] + "\n" for line in extsort.sortKeyed(lines(), self.directory))
+
+    def close(self):
+        if debugs:
+            print("*** SeriesSpool ***", self.count, "lines in", len(self.paths), "categories")
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -5,7 +5,6 @@
 import os
 import json
 import requests
-from requests.adapters import HTTPAdapter, Retry
 
 try:
     from http.client import HTTPConnection
@@ -24,6 +23,7 @@ from Screens.Screen import Screen
 
 # Local application/library-specific imports
 from . import _
+from . import httpclient
 from .plugin import skin_directory, playlist_file, cfg, playlists_json
 from .bmxStaticText import StaticText
 
@@ -262,15 +262,8 @@ class BmxAddServer(ConfigListScreen, Screen):
     def checkline(self):
         valid = False
 
-        retries = Retry(total=3, backoff_factor=1)
-        adapter = HTTPAdapter(max_retries=retries)
-
-        with requests.Session() as http:
-            http.mount("http://", adapter)
-            http.mount("https://", adapter)
-
-            try:
-                response = http.get(self.apiline, headers=hdr, timeout=15, verify=False, stream=True)
+        try:
+            with httpclient.get(self.apiline, retries=3, backoff=1, headers=hdr, timeout=15, stream=True) as response:
                 response.raise_for_status()
                 if response.status_code == requests.codes.ok:
                     try:
@@ -283,7 +276,7 @@ class BmxAddServer(ConfigListScreen, Screen):
                     except Exception as e:
                         print("JSON parsing error:", e)
 
-            except Exception as e:
-                print("Error connecting:", e)
+        except Exception as e:
+            print("Error connecting:", e)
 
         return valid
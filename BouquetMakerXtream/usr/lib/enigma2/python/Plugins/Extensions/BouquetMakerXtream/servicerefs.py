@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from itertools import repeat
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+# url part of the service refs written to the epg channels file
+EXAMPLE_URL = "http%3a//example.m3u8"
+
+NULL_SIDS = ("null", "None", "0", ":0:0:0:0:0:0:0:0:0:")
+
+
+def customSid(value):
+    """A provider's custom_sid as used after the stream type in a #SERVICE line, or None if it is unusable."""
+    if not value:
+        return None
+
+    value = str(value)
+    if value in NULL_SIDS or len(value) <= 16:
+        return None
+
+    if value[0].isdigit():
+        value = value[1:]
+    return value
+
+
+class ServiceRefEncoder(object):
+    """
+    Renders the #SERVICE lines and service refs of one playlist's streams.
+
+    The parts that are the same for every stream, the stream type, the playlist's unique_ref in
+    hex and for Xtream the encoded host/username/password url prefix, are formatted once.
+    render() and serviceRefs() then take the streams as parallel lists and format each row with
+    one string operation. Stream ids are ints.
+    """
+
+    def __init__(self, stream_type, unique_ref, url_prefix=None):
+        self.head = "#SERVICE " + str(stream_type)
+        self.sid_tail = ":%x:0:0:0:0:" % unique_ref
+        self.url_prefix = url_prefix
+
+    def sid(self, stream_id):
+        return ":0:1:%x:%x%s" % (stream_id // 65535, stream_id % 65535, self.sid_tail)
+
+    def render(self, stream_ids, names, sources=None, extensions=None, custom_sids=None):
+        """
+        #SERVICE lines for parallel lists of stream ids and names, names already cleaned of ":".
+
+        Xtream encoders (url_prefix set) take extensions, a list or one string for every row.
+        M3U encoders take the unquoted sources. custom_sids entries, where set, replace the
+        generated sid.
+        """
+        head = self.head
+        sid_tail = self.sid_tail
+
+        if self.url_prefix is not None:
+            if not isinstance(extensions, (list, tuple)):
+                extensions = repeat(extensions)
+            prefix = self.url_prefix
+            urls = [prefix + str(stream_id) + "." + str(extension) for stream_id, extension in zip(stream_ids, extensions)]
+        else:
+            urls = [quote(source) for source in sources]
+
+        if not custom_sids:
+            return ["%s:0:1:%x:%x%s%s:%s\n" % (head, stream_id // 65535, stream_id % 65535, sid_tail, url, name) for stream_id, url, name in zip(stream_ids, urls, names)]
+
+        return [
+            head + sid + url + ":" + name + "\n" if sid else "%s:0:1:%x:%x%s%s:%s\n" % (head, stream_id // 65535, stream_id % 65535, sid_tail, url, name)
+            for stream_id, url, name, sid in zip(stream_ids, urls, names, custom_sids)
+        ]
+
+    def line(self, stream_id, name, source=None, extension=None, custom_sid=None):
+        """render() for a single stream, for streams that are rendered as they are parsed."""
+        return self.render([stream_id], [name], [source], [extension], [custom_sid])[0]
+
+    def serviceRefs(self, stream_ids, custom_sids=None):
+        """Service refs of the streams, as matched to epg channel ids in the channels file."""
+        tail = self.sid_tail + EXAMPLE_URL
+        refs = ["1:0:1:%x:%x%s" % (stream_id // 65535, stream_id % 65535, tail) for stream_id in stream_ids]
+
+        if custom_sids:
+            for index, sid in enumerate(custom_sids):
+                if sid:
+                    refs[index] = ":".join(sid.split(":")[:7]) + ":0:0:0:" + EXAMPLE_URL
+
+        return refs
@@ -26,7 +26,9 @@ from Tools.BoundFunction import boundFunction
 
 # Local application/library-specific imports
 from . import _
-from .plugin import bmxAutoStartTimer, cfg, skin_directory
+from . import httpclient
+from . import responsecache
+from .plugin import bmxAutoStartTimer, cfg, epgimporter, skin_directory
 from .bmxStaticText import StaticText
 
 
@@ -138,6 +140,12 @@ class BmxSettings(ConfigListScreen, Screen, ProtectedScreen):
             cfg.save()
             configfile.save()
 
+            # shared sessions are built from the pool/retry settings, rebuild them on next use
+            httpclient.closeSessions()
+
+            if not cfg.response_cache.value:
+                responsecache.clear()
+
             if bmxAutoStartTimer is not None:
                 bmxAutoStartTimer.update()
 
@@ -161,6 +169,19 @@ class BmxSettings(ConfigListScreen, Screen, ProtectedScreen):
     def initConfig(self):
         self.cfg_skin = getConfigListEntry(_("Select skin"), cfg.skin)
         self.cfg_useragent = getConfigListEntry(_("Select fake web user-agent"), cfg.useragent)
+        self.cfg_http_pool_connections = getConfigListEntry(_("Connection pools (hosts) kept open"), cfg.http_pool_connections)
+        self.cfg_http_pool_maxsize = getConfigListEntry(_("Connections kept open per host"), cfg.http_pool_maxsize)
+        self.cfg_http_retries = getConfigListEntry(_("Download retries"), cfg.http_retries)
+        self.cfg_http_backoff = getConfigListEntry(_("Delay between download retries"), cfg.http_backoff)
+        self.cfg_response_cache = getConfigListEntry(_("Cache downloads and only fetch changed files"), cfg.response_cache)
+        self.cfg_response_cache_size = getConfigListEntry(_("Download cache size (MB)"), cfg.response_cache_size)
+        self.cfg_response_cache_days = getConfigListEntry(_("Keep cached downloads (days)"), cfg.response_cache_days)
+        self.cfg_update_concurrency = getConfigListEntry(_("Providers downloaded in parallel during update"), cfg.update_concurrency)
+        self.cfg_external_sort_rows = getConfigListEntry(_("Sort on disk above this many streams"), cfg.external_sort_rows)
+        self.cfg_natural_sort = getConfigListEntry(_("Sort numbers in names by value (Episode 9 before Episode 10)"), cfg.natural_sort)
+        self.cfg_xmltv_guide = getConfigListEntry(_("Keep a local XMLTV guide for Catchup"), cfg.xmltv_guide)
+        self.cfg_xmltv_guide_location = getConfigListEntry(_("Local XMLTV guide location"), cfg.xmltv_guide_location)
+        self.cfg_epg_match = getConfigListEntry(_("Match channels without an EPG id by name"), cfg.epg_match)
         self.cfg_location = getConfigListEntry(_("playlists.txt location") + _(" *Restart GUI Required"), cfg.location)
         self.cfg_local_location = getConfigListEntry(_("Local M3U File location") + _(" *Restart GUI Required"), cfg.local_location)
         self.cfg_live_type = getConfigListEntry(_("Default LIVE stream type"), cfg.live_type)
@@ -189,6 +210,17 @@ class BmxSettings(ConfigListScreen, Screen, ProtectedScreen):
         config_entries = [
             self.cfg_skin,
             self.cfg_useragent,
+            self.cfg_http_pool_connections,
+            self.cfg_http_pool_maxsize,
+            self.cfg_http_retries,
+            self.cfg_http_backoff if cfg.http_retries.value else None,
+            self.cfg_response_cache,
+            self.cfg_response_cache_size if cfg.response_cache.value else None,
+            self.cfg_response_cache_days if cfg.response_cache.value else None,
+            self.cfg_update_concurrency,
+            self.cfg_external_sort_rows,
+            self.cfg_natural_sort,
+            self.cfg_epg_match if epgimporter else None,
             self.cfg_location,
             self.cfg_local_location,
             self.cfg_skip_playlists_screen,
@@ -203,6 +235,8 @@ class BmxSettings(ConfigListScreen, Screen, ProtectedScreen):
             self.cfg_catchup_prefix if cfg.catchup_on.value and cfg.catchup.value else None,
             self.cfg_catchup_start if cfg.catchup_on.value else None,
             self.cfg_catchup_end if cfg.catchup_on.value else None,
+            self.cfg_xmltv_guide if cfg.catchup_on.value else None,
+            self.cfg_xmltv_guide_location if cfg.catchup_on.value and cfg.xmltv_guide.value else None,
             self.cfg_adult,
             self.cfg_adultpin if cfg.adult.value else None,
             self.cfg_main,
@@ -273,6 +307,9 @@ class BmxSettings(ConfigListScreen, Screen, ProtectedScreen):
 
         elif sel and sel == cfg.local_location:
             self.openDirectoryBrowser(cfg.local_location.value, "local_location")
+
+        elif sel and sel == cfg.xmltv_guide_location:
+            self.openDirectoryBrowser(cfg.xmltv_guide_location.value, "xmltv_guide_location")
         else:
             pass
 
@@ -280,7 +317,8 @@ class BmxSettings(ConfigListScreen, Screen, ProtectedScreen):
         try:
             callback_map = {
                 "location": self.openDirectoryBrowserCB,
-                "local_location": self.openDirectoryBrowserCB2
+                "local_location": self.openDirectoryBrowserCB2,
+                "xmltv_guide_location": self.openDirectoryBrowserCB3
             }
 
             if cfgitem in callback_map:
@@ -307,3 +345,8 @@ class BmxSettings(ConfigListScreen, Screen, ProtectedScreen):
         if path is not None:
             cfg.local_location.setValue(path)
         return
+
+    def openDirectoryBrowserCB3(self, path):
+        if path is not None:
+            cfg.xmltv_guide_location.setValue(path)
+        return
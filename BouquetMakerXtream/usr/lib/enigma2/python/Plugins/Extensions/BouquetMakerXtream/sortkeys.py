@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .plugin import cfg
+
+import re
+import unicodedata
+
+# keys of names that are sorted again and again, like category names
+CACHE_SIZE = 5000
+
+_cache = {}
+_numbers = re.compile(r"\d+")
+
+
+def isAscii(text):
+    try:
+        return text.isascii()
+    except AttributeError:
+        try:
+            text.encode("ascii")
+            return True
+        except:
+            return False
+
+
+def numberKey(match):
+    # length first, so that 9 sorts before 10 and 007 with 7
+    digits = match.group().lstrip("0") or "0"
+    return "%02d%s" % (len(digits), digits)
+
+
+def foldKey(text):
+    """text casefolded and stripped of accents, so "Émission" sorts with "emission"."""
+    if not text:
+        return ""
+
+    try:
+        key = text.casefold()
+    except AttributeError:
+        key = text.lower()
+
+    if not isAscii(key):
+        try:
+            key = "".join(c for c in unicodedata.normalize("NFKD", key) if not unicodedata.combining(c))
+        except TypeError:
+            pass
+
+    return key
+
+
+def naturalKey(text):
+    """foldKey() with the numbers in text ordered by value, "Episode 9" before "Episode 10"."""
+    return _numbers.sub(numberKey, foldKey(text))
+
+
+def keyFunction():
+    """The name collation picked in settings (cfg.natural_sort). Keys are plain strings."""
+    return naturalKey if cfg.natural_sort.value else foldKey
+
+
+def sortKey(text):
+    """keyFunction()(text), cached for names that are sorted repeatedly."""
+    key_function = keyFunction()
+    cache_key = (key_function is naturalKey, text)
+
+    key = _cache.get(cache_key)
+    if key is None:
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        key = _cache[cache_key] = key_function(text)
+
+    return key
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+try:
+    from sys import intern
+except ImportError:
+    pass
+
+
+def internId(value):
+    # category ids repeat for every stream of a category, keep one copy of each
+    try:
+        return intern(value)
+    except TypeError:
+        return value
+
+
+class StreamRecord(object):
+    """
+    Compact stand-in for the per stream dicts of the builders and the chooser.
+
+    Fields are __slots__, so a record carries no per instance dict. get(), [] and "in" behave
+    like they did on the dicts: a field that was never set counts as a missing key.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values, **fields):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def fromItem(cls, item, keys, optional=()):
+        record = cls()
+        for key in keys:
+            setattr(record, key, item[key])
+        for key in optional:
+            if key in item:
+                setattr(record, key, item[key])
+        record.category_id = internId(record.category_id)
+        return record
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+
+class LiveStream(StreamRecord):
+    __slots__ = ("epg_channel_id", "stream_icon", "category_id", "name", "source", "stream_id", "added", "custom_sid", "tv_archive", "tv_archive_duration")
+
+
+class VodStream(StreamRecord):
+    __slots__ = ("stream_icon", "category_id", "name", "source", "stream_id", "added", "container_extension")
+
+
+class SeriesStream(StreamRecord):
+    __slots__ = ("stream_icon", "category_id", "name", "source", "series_id", "added", "last_modified")
+
+
+class BouquetLine(StreamRecord):
+    """A stream rendered for its category bouquet."""
+    __slots__ = ("category_id", "bouquet_string", "name", "added")
+
+
+# player_api.php stream lists by category code
+record_types = {
+    3: LiveStream,
+    4: VodStream,
+    5: SeriesStream,
+}
+
+
+def fromItems(items, category, keys, optional=()):
+    """Records for the decoded items that have every key in keys, holding only those keys and the optional ones they have."""
+    cls = record_types[category]
+    for item in items:
+        if isinstance(item, dict) and all(k in item for k in keys):
+            yield cls.fromItem(item, keys, optional)
+
+
+def fromM3u(streams, cls):
+    """Records for parsem3u lists of [epg_id, logo, group_title, name, source, streamid]."""
+    if cls is LiveStream:
+        return [cls(str(x[0]), str(x[1]), internId(str(x[2])), str(x[3]), str(x[4]), str(x[5]), 0) for x in streams]
+    return [cls(str(x[1]), internId(str(x[2])), str(x[3]), str(x[4]), str(x[5]), 0) for x in streams]
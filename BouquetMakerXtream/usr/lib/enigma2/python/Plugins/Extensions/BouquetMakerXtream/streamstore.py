@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from . import extsort
+from . import sortkeys
+
+
+class StreamStore(object):
+    """
+    The streams of one download kept as parallel columns, with an index of the rows of each category.
+
+    Built once after a download, it serves the category slices, filters and sort orders
+    the builders and the chooser used to get by scanning or regrouping the whole stream list.
+    Rows are positions in the list the store was built from, streams[row] is the record itself.
+    """
+
+    def __init__(self, streams, id_key="stream_id", added_key="added"):
+        self.streams = streams
+        self.names = []
+        self.ids = []
+        self.category = []
+        self.icons = []
+        self.epg_ids = []
+        self.added = []
+
+        # category index -> category id, category id -> rows
+        self.categories = []
+        self.index = {}
+        category_numbers = {}
+
+        for row, stream in enumerate(streams):
+            category_id = str(stream.get("category_id"))
+            number = category_numbers.get(category_id)
+
+            if number is None:
+                number = category_numbers[category_id] = len(self.categories)
+                self.categories.append(category_id)
+                self.index[category_id] = []
+
+            self.index[category_id].append(row)
+            self.category.append(number)
+            self.names.append(stream.get("name") or "")
+            self.ids.append(str(stream.get(id_key, "")))
+            self.icons.append(stream.get("stream_icon"))
+            self.epg_ids.append(stream.get("epg_channel_id"))
+            self.added.append(stream.get(added_key, "0"))
+
+        self.sort_keys = None
+        self.orders = {}
+        self.ordered_index = {}
+
+    def __len__(self):
+        return len(self.streams)
+
+    def categoryId(self, row):
+        return self.categories[self.category[row]]
+
+    def sortKeys(self):
+        """Collation key of every name (sortkeys.keyFunction()), computed once."""
+        if self.sort_keys is None:
+            key = sortkeys.keyFunction()
+            self.sort_keys = [key(name) for name in self.names]
+        return self.sort_keys
+
+    def sortedRows(self, order=None):
+        """
+        Permutation of all rows for a stream order setting: "alphabetical", "added" (newest first)
+        or anything else for playlist order. Each permutation is computed once.
+        Stores with more rows than extsort.threshold() are sorted on disk.
+        """
+        if order not in ("alphabetical", "added"):
+            return range(len(self.streams))
+
+        if order not in self.orders:
+            added = self.added
+            if len(self.streams) > extsort.threshold():
+                if order == "alphabetical":
+                    if self.sort_keys is None:
+                        # keys are made as the rows are fed to the runs, not held for every row
+                        key, names = sortkeys.keyFunction(), self.names
+                        self.orders[order] = extsort.sortedRows(len(names), lambda row: key(names[row]))
+                    else:
+                        self.orders[order] = extsort.sortedRows(len(self.sort_keys), self.sort_keys.__getitem__)
+                else:
+                    self.orders[order] = extsort.sortedRows(len(added), lambda row: str(added[row]), reverse=True)
+            elif order == "alphabetical":
+                keys = self.sortKeys()
+                self.orders[order] = sorted(range(len(keys)), key=keys.__getitem__)
+            else:
+                self.orders[order] = sorted(range(len(added)), key=added.__getitem__, reverse=True)
+
+        return self.orders[order]
+
+    def categoryRows(self, category_id, order=None):
+        """Rows of one category, in the given stream order."""
+        if order not in ("alphabetical", "added"):
+            return self.index.get(str(category_id), [])
+
+        if order not in self.ordered_index:
+            index = {}
+            for row in self.sortedRows(order):
+                index.setdefault(self.categoryId(row), []).append(row)
+            self.ordered_index[order] = index
+
+        return self.ordered_index[order].get(str(category_id), [])
+
+    def filtered(self, rows, hidden=(), names=False):
+        """rows without the ones whose id (or, with names, name) is in hidden."""
+        if not hidden:
+            return list(rows)
+        hidden = set(hidden)
+        if names:
+            return [row for row in rows if self.ids[row] not in hidden and self.names[row] not in hidden]
+        return [row for row in rows if self.ids[row] not in hidden]
@@ -4,9 +4,22 @@
 from . import _
 from . import parsem3u
 from . import seriesparsem3u
+from . import seriesspool
+from . import servicerefs
+from . import sortkeys
+from . import streamrecords
+from . import streamstore
+from . import xmltvchannels
 from . import bouquet_globals as glob
+from . import bouquetstv
+from . import epgmatch
+from . import epgsources
 from . import globalfunctions as bmx
-from .plugin import epgimporter, screenwidth, cfg, playlists_json, skin_directory, dir_etc, debugs
+from . import responsecache
+from . import worker
+from . import xmltvguide
+from .bouquetwriter import BouquetWriter
+from .plugin import epgimporter, screenwidth, cfg, playlists_json, digests_json, skin_directory, dir_tmp, debugs, hasConcurrent
 
 from Components.ActionMap import ActionMap
 from Components.Label import Label
@@ -15,19 +28,16 @@ from enigma import eTimer
 from Screens.MessageBox import MessageBox
 from Screens.Screen import Screen
 
+import hashlib
 import json
 import os
+import re
 
 try:
     from urllib import quote
 except:
     from urllib.parse import quote
 
-try:
-    from xml.dom import minidom
-except:
-    pass
-
 
 class BmxUpdate(Screen):
     def __init__(self, session, runtype):
@@ -66,13 +76,28 @@ class BmxUpdate(Screen):
         self["progress"] = ProgressBar()
 
         self.bouq = 0
+        self.changed = False
+        self.digests = self.loadDigests()
+
+        # providers downloaded and decoded ahead in worker threads: bouquet index -> future
+        self.prefetched = {}
+        # payloads of the current provider decoded ahead: url or local path -> decoded result
+        self.decoded = {}
+        self.series_spool = None
+        self.channels_writer = None
+        self.channels_committed = False
+        self.guide_streams = None
+        self.epg_sources = None
+        self.bouquets_tv = None
+        self.concurrency = int(cfg.update_concurrency.value)
+        self.executor = None
 
         if self.runtype == "manual":
             self["action"] = Label(_("Building Bouquets..."))
 
         self["actions"] = ActionMap(["BMXActions"], {
-            "red": self.void,
-            "cancel": self.void,
+            "red": self.cancel,
+            "cancel": self.cancel,
         }, -2)
 
         self.playlists_all = bmx.getPlaylistJson()
@@ -85,31 +110,105 @@ class BmxUpdate(Screen):
             self.bouquets_len = 0
 
         if self.bouquets:
-            self.looptimer = eTimer()
+            if hasConcurrent:
+                try:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+                except Exception as e:
+                    print("Concurrent execution error:", e)
+
+            # stages run on a worker thread, the GUI is updated from the poll timer
+            self.runner = worker.StageRunner(on_stop=self.stopped)
+
+            self.polltimer = eTimer()
             try:
-                self.looptimer_conn = self.looptimer.timeout.connect(self.bouquetLoop)
+                self.polltimer_conn = self.polltimer.timeout.connect(self.runner.poll)
             except:
-                self.looptimer.callback.append(self.bouquetLoop)
-            self.looptimer.start(100, True)
+                self.polltimer.callback.append(self.runner.poll)
+            self.polltimer.start(100, False)
+
+            self.onClose.append(self.__onClose)
+
+            self.runner.start(self.bouquetLoop)
         else:
             self.close()
 
+    def __onClose(self):
+        self.polltimer.stop()
+        self.runner.shutdown()
+
     def void(self):
         pass
 
+    def cancel(self):
+        if debugs:
+            print("*** cancel ***")
+        self["action"].setText(_("Cancelling..."))
+        self.runner.cancel()
+
+    def stopped(self):
+        if debugs:
+            print("*** stopped ***")
+
+        self.closeSeriesSpool()
+        self.abortXmltvChannels()
+
+        # cancelled or failed part way: the provider being built is undone in bouquets.tv and the
+        # sources file, what the finished providers of the run changed is kept
+        self.rollbackModels()
+        self.saveXmltvSources()
+        self.saveBouquetsTv()
+
+        # cancelled or failed part way: drop the downloads that are still queued or running
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+        for future in self.prefetched.values():
+            future.add_done_callback(self.releasePrefetched)
+        self.prefetched = {}
+
+        for path in getattr(self, "spooled", {}).values():
+            bmx.releaseSpoolFile(path)
+        self.spooled = {}
+        self.decoded = {}
+        responsecache.prune()
+
+        if self.changed:
+            bmx.refreshBouquets()
+        self.close()
+
+    def releasePrefetched(self, future):
+        try:
+            spooled = future.result()[0]
+        except:
+            return
+        for path in spooled.values():
+            bmx.releaseSpoolFile(path)
+
     def loopPlaylists(self):
         if self.bouq < self.bouquets_len:
             self.bouquetLoop()
         else:
-            if self.runtype == "manual":
-                self.session.openWithCallback(self.done, MessageBox, str(len(self.bouquets)) + _(" Providers IPTV Updated"), MessageBox.TYPE_INFO, timeout=5)
-            else:
-                self.done()
+            # last provider done, the worker is finished
+            self.saveXmltvSources()
+            self.saveBouquetsTv()
+            # every download of the run has been read, the cache is trimmed once
+            responsecache.prune()
+            self.runner.shutdown()
+            self.runner.post(self.showDone)
+
+    def showDone(self):
+        if self.runtype == "manual":
+            self.session.openWithCallback(self.done, MessageBox, str(len(self.bouquets)) + _(" Providers IPTV Updated"), MessageBox.TYPE_INFO, timeout=5)
+        else:
+            self.done()
 
     def bouquetLoop(self):
         glob.current_playlist = self.bouquets[self.bouq]
         glob.get_series_failed = False
 
+        self.writer = None
         self.bouquet_tv = False
         self.userbouquet = False
         self.total_count = 0
@@ -122,6 +221,7 @@ class BmxUpdate(Screen):
         self.data = glob.current_playlist["data"]
         self.original_name = glob.original_name
         self.name = bmx.safeName(self.playlist_info["name"])
+        self.prefetch()
 
         if self.playlist_info["playlist_type"] == "xtream":
             self.progress_range += (
@@ -136,58 +236,32 @@ class BmxUpdate(Screen):
     def nextJob(self, actiontext, function):
         if debugs:
             print("*** nextJob ***", actiontext)
-        self["action"].setText(actiontext)
-        self.timer = eTimer()
-        try:
-            self.timer_conn = self.timer.timeout.connect(function)
-        except:
-            self.timer.callback.append(function)
-        self.timer.start(50, True)
+        self.runner.post(self["action"].setText, actiontext)
+        self.runner.submit(function)
 
     def start(self):
         if self.runtype == "manual":
-            self["progress"].setRange((0, self.progress_range))
-            self["progress"].setValue(self.progress_value)
+            self.runner.post(self["progress"].setRange, (0, self.progress_range))
+            self.runner.post(self["progress"].setValue, self.progress_value)
 
-        self["status"].setText(_("Updating Playlist %d of %d") % (self.bouq + 1, self.bouquets_len))
-        self.deleteExistingRefs()
+        self.runner.post(self["status"].setText, _("Updating Playlist %d of %d") % (self.bouq + 1, self.bouquets_len))
 
-        self.timer = eTimer()
-
-        try:
-            self.timer_conn = self.timer.timeout.connect(self.makeUrlList)
-        except:
-            try:
-                self.timer.callback.append(self.makeUrlList)
-            except:
-                self.makeUrlList()
-        self.timer.start(10, True)
+        self.runner.submit(self.makeUrlList)
 
     def deleteExistingRefs(self):
-        with open("/etc/enigma2/bouquets.tv", "r+") as f:
-            lines = f.readlines()
-            f.seek(0)
-            f.truncate()
+        # bouquets.tv is shared by all providers of the run and written once by saveBouquetsTv()
+        self.bouquetsTv().removeProviders([self.name])
 
-            for line in lines:
-                if "bouquetmakerxtream_live_" + str(self.name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_vod_" + str(self.name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_series_" + str(self.name) + "_" in line:
-                    continue
-                if "bouquetmakerxtream_" + str(self.name) + ".tv" in line:
-                    continue
-
-                f.write(line)
-
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_live_" + str(self.name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_vod_" + str(self.name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_series_" + str(self.name) + "_")
-        bmx.purge("/etc/enigma2", "bouquetmakerxtream_" + str(self.name))
+        # the provider's bouquet files are left in place, BouquetWriter only rewrites
+        # the ones that change and removes the ones not produced again in finished()
+        self.writer = BouquetWriter(self.name, bouquets_tv=self.bouquets_tv)
+        self.channels_committed = False
 
-        if epgimporter:
-            bmx.purge("/etc/epgimport", "bouquetmakerxtream." + str(self.name))
+    def purgeOldFiles(self):
+        # only once the provider is rebuilt, a cancelled run leaves its channels file to the
+        # sources it rolls back to. One written by this run replaced the old one, any other is stale
+        if epgimporter and not self.channels_committed:
+            bmx.purge("/etc/epgimport", "^bouquetmakerxtream\\." + re.escape(str(self.name)) + "\\.")
 
     def makeUrlList(self):
         if self.playlist_info["playlist_type"] == "xtream":
@@ -211,20 +285,11 @@ class BmxUpdate(Screen):
             self.vod_streams_api = self.player_api + "&action=get_vod_streams"
             self.series_streams_api = self.player_api + "&action=get_series"
 
-            if self.settings["show_live"]:
-                self.nextJob(_("Downloading live data..."), self.downloadXtreamLive)
-            elif self.settings["show_vod"]:
-                self.nextJob(_("Downloading VOD data..."), self.downloadXtreamVod)
-            elif self.settings["show_series"]:
-                self.nextJob(_("Downloading series data..."), self.downloadXtreamSeries)
-
         elif self.playlist_info["playlist_type"] == "external":
             self.external_url = self.playlist_info["full_url"]
-            self.nextJob(_("Downloading external playlist..."), self.downloadExternal)
 
         elif self.playlist_info["playlist_type"] == "local":
             self.local_file = self.playlist_info["full_url"]
-            self.nextJob(_("Loading local playlist..."), self.parseLocal)
 
         if self.playlist_info["playlist_type"] != "local":
             protocol = self.playlist_info["protocol"]
@@ -238,6 +303,199 @@ class BmxUpdate(Screen):
             value = ord(j)
             self.unique_ref += value
 
+        self.nextJob(_("Checking for changes..."), self.checkDigest)
+
+    def startDownloads(self):
+        if self.playlist_info["playlist_type"] == "xtream":
+            if self.settings["show_live"]:
+                self.nextJob(_("Downloading live data..."), self.downloadXtreamLive)
+            elif self.settings["show_vod"]:
+                self.nextJob(_("Downloading VOD data..."), self.downloadXtreamVod)
+            elif self.settings["show_series"]:
+                self.nextJob(_("Downloading series data..."), self.downloadXtreamSeries)
+
+        elif self.playlist_info["playlist_type"] == "external":
+            self.nextJob(_("Downloading external playlist..."), self.downloadExternal)
+
+        elif self.playlist_info["playlist_type"] == "local":
+            self.nextJob(_("Loading local playlist..."), self.parseLocal)
+
+    def prefetch(self):
+        # keep the payloads of the next providers downloading and decoding while the current one is built
+        if not self.executor:
+            return
+
+        for index in range(self.bouq, min(self.bouq + self.concurrency, self.bouquets_len)):
+            if index not in self.prefetched:
+                self.prefetched[index] = self.executor.submit(self.prefetchPlaylist, self.bouquets[index])
+
+    def prefetchPlaylist(self, playlist):
+        """
+        Runs on the prefetch executor. Spools a playlist's payloads and, unless its digest says
+        the provider is unchanged, decodes them too. Returns (spooled, digests, decoded).
+
+        Only the playlist passed in is read, the provider being built meanwhile is not touched.
+        """
+        spooled, digests = bmx.spoolFiles(self.payloadUrls(playlist), dir_tmp())
+        decoded = {}
+
+        digest = self.payloadDigest(playlist, digests)
+        if digest is None or self.digests.get(playlist["playlist_info"]["full_url"]) == digest:
+            return spooled, digests, decoded
+
+        playlist_info = playlist["playlist_info"]
+        settings = playlist["settings"]
+        shown = {"live": settings["show_live"], "vod": settings["show_vod"], "series": settings["show_series"]}
+
+        try:
+            if playlist_info["playlist_type"] == "xtream":
+                player_api = playlist_info["player_api"]
+                for action, category in (("get_live_categories", 0), ("get_live_streams", 3), ("get_vod_categories", 1), ("get_vod_streams", 4), ("get_series_categories", 2), ("get_series", 5)):
+                    url = player_api + "&action=" + action
+                    if url in spooled:
+                        decoded[url] = bmx.downloadXtreamApiCategory([url, category], spooled[url])
+
+            elif playlist_info["playlist_type"] == "external":
+                url = playlist_info["full_url"]
+                if url in spooled:
+                    decoded[url] = parsem3u.parseM3u8File(spooled[url], shown)
+
+            elif playlist_info["playlist_type"] == "local":
+                local_path = os.path.join(cfg.local_location.value, playlist_info["full_url"])
+                if os.path.exists(local_path):
+                    decoded[local_path] = parsem3u.parseM3u8File(local_path, shown)
+        except Exception as e:
+            # the stages decode whatever is missing themselves
+            print(e)
+
+        return spooled, digests, decoded
+
+    def checkDigest(self):
+        if debugs:
+            print("*** checkDigest ***")
+
+        future = self.prefetched.pop(self.bouq, None)
+
+        if future is not None:
+            self.runner.post(self["action"].setText, _("Downloading playlist data..."))
+
+            try:
+                # on the worker thread, so waiting does not block the main loop
+                self.spooled, digests, self.decoded = self.runner.waitFor(future)
+            except worker.Cancelled:
+                future.add_done_callback(self.releasePrefetched)
+                raise
+            except Exception as e:
+                print(e)
+                self.spooled, digests, self.decoded = {}, None, {}
+        else:
+            self.spooled, digests = bmx.spoolFiles(self.payloadUrls(glob.current_playlist), dir_tmp())
+            self.decoded = {}
+
+        self.digest = self.payloadDigest(glob.current_playlist, digests)
+
+        if self.digest and self.digests.get(self.playlist_info["full_url"]) == self.digest and self.bouquetsExist():
+            if debugs:
+                print("*** provider unchanged, skipping rebuild ***", self.name)
+            # the bouquets are unchanged, the local guide still ages
+            if self.playlist_info["playlist_type"] == "xtream" and self.settings["show_live"] and cfg.catchup_on.value and cfg.xmltv_guide.value:
+                self.buildXmltvGuide()
+            self.finished()
+            return
+
+        self.changed = True
+        self.deleteExistingRefs()
+        self.startDownloads()
+
+    def payloadUrls(self, playlist):
+        """Urls a playlist's bouquets are built from. The download stages read them from the spooled files."""
+        playlist_info = playlist["playlist_info"]
+        settings = playlist["settings"]
+        urls = []
+
+        if playlist_info["playlist_type"] == "xtream":
+            player_api = playlist_info["player_api"]
+            if settings["show_live"]:
+                urls += [player_api + "&action=get_live_categories", player_api + "&action=get_live_streams"]
+            if settings["show_vod"]:
+                urls += [player_api + "&action=get_vod_categories", player_api + "&action=get_vod_streams"]
+            if settings["show_series"]:
+                urls += [player_api + "&action=get_series_categories", player_api + "&action=get_series", self.getSeriesUrl(playlist_info)]
+
+        elif playlist_info["playlist_type"] == "external":
+            urls.append(playlist_info["full_url"])
+
+        return urls
+
+    def payloadDigest(self, playlist, digests):
+        """
+        sha1 over every payload the bouquets are built from plus the options that shape the output.
+        Returns None if anything could not be downloaded, so the provider is always rebuilt.
+        """
+        if digests is None:
+            return None
+
+        playlist_info = playlist["playlist_info"]
+        sha1 = hashlib.sha1()
+
+        for digest in digests:
+            sha1.update(digest.encode("utf-8"))
+
+        if playlist_info["playlist_type"] == "local":
+            local_path = os.path.join(cfg.local_location.value, playlist_info["full_url"])
+            try:
+                with open(local_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        sha1.update(chunk)
+            except Exception as e:
+                print(e)
+                return None
+
+        options = {
+            "name": playlist_info["name"],
+            "xmltv_api": playlist_info.get("xmltv_api"),
+            "settings": playlist["settings"],
+            "hidden": dict((k, v) for k, v in playlist["data"].items() if k.endswith("_hidden")),
+            "cfg": [
+                cfg.groups.value, cfg.catchup_on.value, cfg.catchup.value, cfg.catchup_prefix.value, bool(epgimporter),
+                cfg.natural_sort.value, cfg.external_sort_rows.value, cfg.epg_match.value, cfg.xmltv_guide.value
+            ],
+        }
+
+        sha1.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+        return sha1.hexdigest()
+
+    def getSeriesUrl(self, playlist_info):
+        port = playlist_info["port"]
+        host = playlist_info["protocol"] + playlist_info["domain"] + (":" + str(port) if port else "")
+        return str(host) + "/get.php?username=" + str(playlist_info["username"]) + "&password=" + str(playlist_info["password"]) + "&type=m3u_plus&output=" + str(playlist_info["output"])
+
+    def bouquetsTv(self):
+        if self.bouquets_tv is None:
+            self.bouquets_tv = bouquetstv.BouquetsTv()
+        return self.bouquets_tv
+
+    def bouquetsExist(self):
+        # the bouquets may have been deleted since the last run
+        return self.bouquetsTv().hasProvider(self.name)
+
+    def loadDigests(self):
+        digests = {}
+        if os.path.isfile(digests_json) and os.stat(digests_json).st_size > 0:
+            with open(digests_json) as f:
+                try:
+                    digests = json.load(f)
+                except:
+                    os.remove(digests_json)
+        return digests
+
+    def saveDigest(self):
+        if not self.digest or glob.get_series_failed:
+            return
+        self.digests[self.playlist_info["full_url"]] = self.digest
+        with open(digests_json, "w") as f:
+            json.dump(self.digests, f, indent=4)
+
     def downloadXtreamLive(self):
         if debugs:
             print("*** downloadXtreamLive ***")
@@ -249,7 +507,7 @@ class BmxUpdate(Screen):
         self.url_list = [[self.live_categories_api, 0], [self.live_streams_api, 3]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.decoded.pop(url[0], None) or bmx.downloadXtreamApiCategory(url, self.spooled.get(url[0]))
 
             category = result[0]
             response = result[1]
@@ -259,27 +517,11 @@ class BmxUpdate(Screen):
                     self.live_categories = response
 
                 elif category == 3:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "stream_id": item.get("stream_id"),
-                            "stream_icon": item.get("stream_icon"),
-                            "epg_channel_id": item.get("epg_channel_id"),
-                            "added": item.get("added"),
-                            "category_id": item.get("category_id"),
-                            "custom_sid": item.get("custom_sid"),
-                            "tv_archive": item.get("tv_archive"),
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "stream_id", "stream_icon", "epg_channel_id",
-                            "added", "category_id", "custom_sid", "tv_archive"
-                        ])
-                    )
-                    self.live_streams = list(response)
+                    self.live_streams = response
                 response = None
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.nextJob(_("Processing live data..."), self.loadLive)
 
     def downloadXtreamVod(self):
@@ -293,7 +535,7 @@ class BmxUpdate(Screen):
         self.url_list = [[self.vod_categories_api, 1], [self.vod_streams_api, 4]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.decoded.pop(url[0], None) or bmx.downloadXtreamApiCategory(url, self.spooled.get(url[0]))
 
             category = result[0]
             response = result[1]
@@ -302,24 +544,12 @@ class BmxUpdate(Screen):
                 if category == 1:
                     self.vod_categories = response
                 elif category == 4:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "stream_id": item.get("stream_id"),
-                            "added": item.get("added"),
-                            "category_id": item.get("category_id"),
-                            "container_extension": item.get("container_extension")
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "stream_id", "added", "category_id", "container_extension"
-                        ])
-                    )
-                    self.vod_streams = list(response)
+                    self.vod_streams = response
 
                 response = None
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.nextJob(_("Processing VOD data..."), self.loadVod)
 
     def downloadXtreamSeries(self):
@@ -332,7 +562,7 @@ class BmxUpdate(Screen):
         self.url_list = [[self.series_categories_api, 2], [self.series_streams_api, 5]]
 
         for url in self.url_list:
-            result = bmx.downloadXtreamApiCategory(url)
+            result = self.decoded.pop(url[0], None) or bmx.downloadXtreamApiCategory(url, self.spooled.get(url[0]))
 
             category = result[0]
             response = result[1]
@@ -342,36 +572,35 @@ class BmxUpdate(Screen):
                     self.series_categories = response
 
                 elif category == 5:
-                    response = (
-                        {
-                            "name": item.get("name"),
-                            "series_id": item.get("series_id"),
-                            "last_modified": item.get("last_modified"),
-                            "category_id": item.get("category_id")
-                        }
-                        for item in response if all(k in item for k in [
-                            "name", "series_id", "last_modified", "category_id"
-                        ])
-                    )
-                    self.series_streams = list(response)
+                    self.series_streams = response
                 response = None
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.nextJob(_("Download series get.php file..."), self.loadSeries)
 
     def downloadExternal(self):
         if debugs:
             print("*** downloadExternal ***")
 
-        response = bmx.downloadM3U8File(self.external_url)
+        parsed = self.decoded.pop(self.external_url, None)
+
+        if parsed is not None:
+            self.parseFullM3u8Data(None, parsed)
+        else:
+            path = self.spooled.get(self.external_url)
+
+            if not path:
+                path = bmx.spoolFile(self.external_url, dir_tmp(), timeout=(20, 300))[0]
+                if path:
+                    # released with the other spooled files in finished()
+                    self.spooled[self.external_url] = path
 
-        if response:
-            self.parseFullM3u8Data(response)
-            response = None
+            if path:
+                self.parseFullM3u8Data(path)
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
         self.nextJob(_("Processing external data..."), self.loadLive)
 
     def parseLocal(self):
@@ -379,16 +608,17 @@ class BmxUpdate(Screen):
             print("*** parseLocal (load local file) ***")
 
         # Build the full local file path
-        local_path = os.path.join(dir_etc, self.local_file)
+        local_path = os.path.join(cfg.local_location.value, self.local_file)
+
+        parsed = self.decoded.pop(local_path, None)
 
         # Check if the file exists before reading
-        if os.path.exists(local_path):
+        if parsed is not None:
+            self.parseFullM3u8Data(None, parsed)
+        elif os.path.exists(local_path):
             try:
-                with open(local_path, "r") as f:
-                    response = f.read()
-                if response:
-                    self.parseFullM3u8Data(response)
-                    response = None
+                # parsed line by line, the file is never read into one string
+                self.parseFullM3u8Data(local_path)
             except Exception as e:
                 if debugs:
                     print("Error reading local file:", e)
@@ -398,12 +628,12 @@ class BmxUpdate(Screen):
 
         self.nextJob(_("Processing local data..."), self.loadLive)
 
-    def parseFullM3u8Data(self, response=None):
+    def parseFullM3u8Data(self, path, parsed=None):
         if debugs:
             print("*** parseFullM3u8Data ***")
 
-        # --- Step 1: Parse the playlist streams ---
-        self.live_streams, self.vod_streams, self.series_streams = parsem3u.parseM3u8Playlist(response)
+        # --- Step 1: Parse the playlist streams, unless prefetchPlaylist already did ---
+        self.live_streams, self.vod_streams, self.series_streams = parsed if parsed is not None else parsem3u.parseM3u8File(path)
 
         # --- Step 2: Build categories ---
         if debugs:
@@ -439,42 +669,9 @@ class BmxUpdate(Screen):
         if debugs:
             print("*** Building M3U8 stream JSON data ***")
 
-        self.live_streams = [
-            {
-                "epg_channel_id": str(x[0]),
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "stream_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.live_streams
-        ]
-
-        self.vod_streams = [
-            {
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "stream_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.vod_streams
-        ]
-
-        self.series_streams = [
-            {
-                "stream_icon": str(x[1]),
-                "category_id": str(x[2]),
-                "name": str(x[3]),
-                "source": str(x[4]),
-                "series_id": str(x[5]),
-                "added": 0
-            }
-            for x in self.series_streams
-        ]
+        self.live_streams = streamrecords.fromM3u(self.live_streams, streamrecords.LiveStream)
+        self.vod_streams = streamrecords.fromM3u(self.vod_streams, streamrecords.VodStream)
+        self.series_streams = streamrecords.fromM3u(self.series_streams, streamrecords.SeriesStream)
 
         if debugs:
             print("*** M3U8 parsing complete ***")
@@ -489,20 +686,28 @@ class BmxUpdate(Screen):
             self.live_stream_data = []
             stream_type = self.settings["live_type"]
 
-            if self.settings["live_category_order"] == "alphabetical":
-                self.live_categories.sort(key=lambda k: k["category_name"].lower())
+            # catchup streams and their epg channel, for the local xmltv guide
+            if self.playlist_info["playlist_type"] == "xtream" and cfg.catchup_on.value and cfg.xmltv_guide.value:
+                self.guide_streams = {}
 
-            if self.settings["live_stream_order"] == "alphabetical":
-                self.live_streams.sort(key=lambda x: x["name"].lower())
+            if self.settings["live_category_order"] == "alphabetical":
+                self.live_categories.sort(key=lambda k: sortkeys.sortKey(k["category_name"]))
 
-            elif self.settings["live_stream_order"] == "added":
-                self.live_streams.sort(key=lambda x: x["added"], reverse=True)
+            store = streamstore.StreamStore(self.live_streams)
+            stream_order = self.settings["live_stream_order"]
+            rendered = [None] * len(store)
 
             # Convert to sets for faster membership testing
             live_categories_hidden = set(self.data["live_categories_hidden"])
             live_streams_hidden = set(self.data["live_streams_hidden"])
 
-            for channel in self.live_streams:
+            rows = []
+            stream_ids = []
+            names = []
+            custom_sids = []
+
+            for row in store.sortedRows(stream_order):
+                channel = store.streams[row]
                 category_id = channel.get("category_id")
                 name = channel.get("name") or ""
                 name = name.replace(":", "").replace('"', "").replace('•', "-").strip("- ").strip()
@@ -521,44 +726,46 @@ class BmxUpdate(Screen):
                 if cfg.catchup.value and catchup == 1:
                     name = str(cfg.catchup_prefix.value) + str(name)
 
-                try:
-                    bouquet_id1 = int(stream_id) // 65535
-                    bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
-                except:
-                    continue
+                if self.guide_streams is not None and catchup == 1 and channel.get("epg_channel_id"):
+                    self.guide_streams[str(stream_id)] = [str(channel.get("epg_channel_id")), channel.get("tv_archive_duration") or 0]
 
-                service_ref = "1:0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:http%3a//example.m3u8"
-                custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:"
+                rows.append(row)
+                stream_ids.append(stream_id)
+                names.append(str(name))
+                custom_sids.append(servicerefs.customSid(channel.get("custom_sid")))
 
-                if "custom_sid" in channel and channel["custom_sid"] and str(channel["custom_sid"]) not in ("null", "None", "0", ":0:0:0:0:0:0:0:0:0:") and len(channel["custom_sid"]) > 16:
-                    custom_sid = str(channel["custom_sid"])
-                    if custom_sid[0].isdigit():
-                        custom_sid = custom_sid[1:]
+            # #SERVICE lines and epg service refs of the shown channels, rendered as one batch
+            encoder = self.serviceRefEncoder(stream_type, "live")
 
-                    service_ref = str(":".join(custom_sid.split(":")[:7])) + ":0:0:0:http%3a//example.m3u8"
+            if self.playlist_info["playlist_type"] == "xtream":
+                bouquet_strings = encoder.render(stream_ids, names, extensions=self.output, custom_sids=custom_sids)
+            else:
+                bouquet_strings = encoder.render(stream_ids, names, sources=[store.streams[row].get("source", "") for row in rows], custom_sids=custom_sids)
 
-                xml_str = ""
-                channel_id = channel.get("epg_channel_id")
+            # xtream epg channels go straight to the channels file, which buildXmltvChannels commits
+            self.abortXmltvChannels()
+            if self.playlist_info["playlist_type"] == "xtream" and epgimporter:
+                self.channels_writer = xmltvchannels.ChannelsWriter(xmltvchannels.channelsPath(self.name))
+                service_refs = encoder.serviceRefs(stream_ids, custom_sids)
+            else:
+                service_refs = [None] * len(rows)
 
-                if channel_id:
-                    channel_id = channel_id.replace("&", "&amp;")
-                    xml_str = '\t<channel id="' + str(channel_id) + '">' + str(service_ref) + "</channel><!-- " + str(name) + " -->\n"
+            matched = self.matchEpgChannels(store, rows) if self.channels_writer and cfg.epg_match.value else {}
 
-                bouquet_string = ""
+            for row, name, bouquet_string, service_ref in zip(rows, names, bouquet_strings, service_refs):
+                channel = store.streams[row]
+                channel_id = channel.get("epg_channel_id") or matched.get(row)
 
-                if self.playlist_info["playlist_type"] == "xtream":
-                    bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(self.host_encoded) + "/live/" + str(self.username) + "/" + str(self.password) + "/" + str(stream_id) + "." + str(self.output) + ":" + str(name) + "\n"
-                else:
-                    source = quote(channel.get("source", ""))
-                    bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(source) + ":" + str(name) + "\n"
+                if channel_id and self.channels_writer:
+                    self.channels_writer.add(channel_id, service_ref, name)
 
-                self.live_stream_data.append({
-                    "category_id": str(category_id),
-                    "xml_str": str(xml_str),
-                    "bouquet_string": bouquet_string,
-                    "name": str(name),
-                    "added": str(channel.get("added", "0"))
-                })
+                rendered[row] = streamrecords.BouquetLine(
+                    category_id=str(channel.get("category_id")),
+                    bouquet_string=bouquet_string,
+                    name=name,
+                    added=str(channel.get("added", "0"))
+                )
+                self.live_stream_data.append(rendered[row])
 
             if self.live_stream_data:
 
@@ -572,13 +779,12 @@ class BmxUpdate(Screen):
 
                 bouquet_filename = ""
 
-                # Create dictionary for faster category lookups (reduces repeated scans)
+                # category slices come from the store's index, already in stream order
                 cat_map = {}
-                for stream in self.live_stream_data:
-                    cat_id = stream["category_id"]
-                    if cat_id not in cat_map:
-                        cat_map[cat_id] = []
-                    cat_map[cat_id].append(stream)
+                for category_id in store.categories:
+                    lines = [rendered[row] for row in store.categoryRows(category_id, stream_order) if rendered[row]]
+                    if lines:
+                        cat_map[category_id] = lines
 
                 for category in self.live_categories:
                     category_id = category.get("category_id")
@@ -597,8 +803,7 @@ class BmxUpdate(Screen):
                     bouquet_tv_string += '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + bouquet + ".bouquetmakerxtream_live_" + str(self.name) + "_" + bmx.safeName(category["category_name"]) + '.tv" ORDER BY bouquet\n'
 
                 if bouquet_filename:
-                    with open(bouquet_filename, "a+") as f:
-                        f.write(str(bouquet_tv_string))
+                    self.writer.append(bouquet_filename, str(bouquet_tv_string))
 
                     for category in self.live_categories:
                         category_id = category.get("category_id")
@@ -623,20 +828,22 @@ class BmxUpdate(Screen):
                         else:
                             bouquet_filename = "/etc/enigma2/userbouquet.bouquetmakerxtream_live_" + str(bouquet_title) + ".tv"
 
-                        with open(bouquet_filename, "w+") as f:
-                            f.write(output_string)
+                        self.writer.write(bouquet_filename, output_string)
 
                 # Free up memory once finished
 
                 cat_map.clear()
 
             self.progress_value += 1
-            self["progress"].setValue(self.progress_value)
+            self.runner.post(self["progress"].setValue, self.progress_value)
 
             # Continue to next section
             if self.playlist_info["playlist_type"] == "xtream":
                 if self.live_categories and epgimporter:
                     self.buildXmltvSource()
+                if self.guide_streams:
+                    self.buildXmltvGuide()
+                self.guide_streams = None
                 self.live_categories = []
                 self.live_streams = []
                 self.live_stream_data = []
@@ -659,6 +866,13 @@ class BmxUpdate(Screen):
                     self.finished()
                     return
 
+    def serviceRefEncoder(self, stream_type, path):
+        # xtream streams play from <host>/<path>/<username>/<password>/<stream_id>.<extension>
+        url_prefix = None
+        if self.playlist_info["playlist_type"] == "xtream":
+            url_prefix = str(self.host_encoded) + "/" + path + "/" + str(self.username) + "/" + str(self.password) + "/"
+        return servicerefs.ServiceRefEncoder(stream_type, self.unique_ref, url_prefix)
+
     def loadVod(self):
         if debugs:
             print("*** loadVod ***")
@@ -670,19 +884,22 @@ class BmxUpdate(Screen):
             stream_type = self.settings["vod_type"]
 
             if self.settings["vod_category_order"] == "alphabetical":
-                self.vod_categories.sort(key=lambda k: k["category_name"].lower())
+                self.vod_categories.sort(key=lambda k: sortkeys.sortKey(k["category_name"]))
 
-            if self.settings["vod_stream_order"] == "alphabetical":
-                self.vod_streams.sort(key=lambda x: x["name"].lower())
-
-            elif self.settings["vod_stream_order"] == "added":
-                self.vod_streams.sort(key=lambda x: x["added"], reverse=True)
+            store = streamstore.StreamStore(self.vod_streams)
+            stream_order = self.settings["vod_stream_order"]
+            rendered = [None] * len(store)
 
             # Convert to sets for faster membership testing
             vod_categories_hidden = set(self.data["vod_categories_hidden"])
             vod_streams_hidden = set(self.data["vod_streams_hidden"])
 
-            for channel in self.vod_streams:
+            rows = []
+            stream_ids = []
+            names = []
+
+            for row in store.sortedRows(stream_order):
+                channel = store.streams[row]
                 category_id = channel.get("category_id")
                 name = channel.get("name") or ""
                 name = name.replace(":", "").replace('"', "").replace('•', "-").strip("- ").strip()
@@ -696,28 +913,27 @@ class BmxUpdate(Screen):
                 except:
                     continue
 
-                try:
-                    bouquet_id1 = int(stream_id) // 65535
-                    bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
-                except:
-                    continue
+                rows.append(row)
+                stream_ids.append(stream_id)
+                names.append(str(name))
 
-                custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:"
-                bouquet_string = ""
+            # #SERVICE lines of the shown movies, rendered as one batch
+            encoder = self.serviceRefEncoder(stream_type, "movie")
 
-                if self.playlist_info["playlist_type"] == "xtream":
-                    extension = channel["container_extension"]
-                    bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(self.host_encoded) + "/movie/" + str(self.username) + "/" + str(self.password) + "/" + str(stream_id) + "." + str(extension) + ":" + str(name) + "\n"
-                else:
-                    source = quote(channel.get("source", ""))
-                    bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(source) + ":" + str(name) + "\n"
-
-                self.vod_stream_data.append({
-                    "category_id": str(category_id),
-                    "bouquet_string": bouquet_string,
-                    "name": str(name),
-                    "added": str(channel.get("added", "0"))
-                })
+            if self.playlist_info["playlist_type"] == "xtream":
+                bouquet_strings = encoder.render(stream_ids, names, extensions=[store.streams[row]["container_extension"] for row in rows])
+            else:
+                bouquet_strings = encoder.render(stream_ids, names, sources=[store.streams[row].get("source", "") for row in rows])
+
+            for row, name, bouquet_string in zip(rows, names, bouquet_strings):
+                channel = store.streams[row]
+                rendered[row] = streamrecords.BouquetLine(
+                    category_id=str(channel.get("category_id")),
+                    bouquet_string=bouquet_string,
+                    name=name,
+                    added=str(channel.get("added", "0"))
+                )
+                self.vod_stream_data.append(rendered[row])
 
             if self.vod_stream_data:
 
@@ -731,13 +947,12 @@ class BmxUpdate(Screen):
 
                 bouquet_filename = ""
 
-                # Create dictionary for faster category lookups (reduces repeated scans)
+                # category slices come from the store's index, already in stream order
                 cat_map = {}
-                for stream in self.vod_stream_data:
-                    cat_id = stream["category_id"]
-                    if cat_id not in cat_map:
-                        cat_map[cat_id] = []
-                    cat_map[cat_id].append(stream)
+                for category_id in store.categories:
+                    lines = [rendered[row] for row in store.categoryRows(category_id, stream_order) if rendered[row]]
+                    if lines:
+                        cat_map[category_id] = lines
 
                 for category in self.vod_categories:
                     category_id = category.get("category_id")
@@ -756,8 +971,7 @@ class BmxUpdate(Screen):
                     bouquet_tv_string += '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + bouquet + ".bouquetmakerxtream_vod_" + str(self.name) + "_" + bmx.safeName(category["category_name"]) + '.tv" ORDER BY bouquet\n'
 
                 if bouquet_filename:
-                    with open(bouquet_filename, "a+") as f:
-                        f.write(str(bouquet_tv_string))
+                    self.writer.append(bouquet_filename, str(bouquet_tv_string))
 
                     for category in self.vod_categories:
                         category_id = category.get("category_id")
@@ -782,8 +996,7 @@ class BmxUpdate(Screen):
                         else:
                             bouquet_filename = "/etc/enigma2/userbouquet.bouquetmakerxtream_vod_" + str(bouquet_title) + ".tv"
 
-                        with open(bouquet_filename, "w+") as f:
-                            f.write(output_string)
+                        self.writer.write(bouquet_filename, output_string)
 
                 # Free up memory once finished
                 self.vod_categories = []
@@ -792,7 +1005,7 @@ class BmxUpdate(Screen):
                 cat_map.clear()
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
+        self.runner.post(self["progress"].setValue, self.progress_value)
 
         if self.playlist_info["playlist_type"] == "xtream":
             if self.settings["show_series"]:
@@ -813,11 +1026,10 @@ class BmxUpdate(Screen):
 
         if glob.current_playlist["settings"]["show_series"] and self.series_categories and self.series_streams:
             self.clearCaches()
-            self.series_stream_data = []
             # stream_type = self.settings["vod_type"]
 
             if self.settings["vod_category_order"] == "alphabetical":
-                self.series_categories.sort(key=lambda k: k["category_name"].lower())
+                self.series_categories.sort(key=lambda k: sortkeys.sortKey(k["category_name"]))
 
             # Convert to sets for faster membership testing
             series_categories_hidden = set(self.data["series_categories_hidden"])
@@ -830,11 +1042,18 @@ class BmxUpdate(Screen):
                     continue
 
             self.progress_value += 1
-            self["progress"].setValue(self.progress_value)
+            self.runner.post(self["progress"].setValue, self.progress_value)
 
             if self.playlist_info["playlist_type"] == "xtream":
-                geturl = str(self.host) + "/get.php?username=" + str(self.username) + "&password=" + str(self.password) + "&type=m3u_plus&output=" + str(self.output)
-                method, result = bmx.downloadM3U8File_with_fallback(geturl)
+                geturl = self.getSeriesUrl(self.playlist_info)
+
+                if geturl in self.spooled:
+                    # released with the other spooled files in finished()
+                    method, result = "file", self.spooled[geturl]
+                else:
+                    method, result = bmx.downloadM3U8File_with_fallback(geturl)
+                    if method == "file":
+                        self.spooled[geturl] = result
 
                 if not result:
                     glob.get_series_failed = True
@@ -843,12 +1062,19 @@ class BmxUpdate(Screen):
 
                 if method == "curl":
                     self.nextJob(_("Parsing series data..."), lambda: self.parseXtreamSeries_streaming(result))
+                elif method == "file":
+                    with open(result, "rb") as f:
+                        self.spoolSeries(f)
+
+                    result = None
+
+                    self.nextJob(_("Processing series data..."), self.createSeriesBouquets)
                 elif method in ("wget", "requests"):
-                    self.series_streams = seriesparsem3u.parseM3u8Playlist(result)
+                    self.spoolSeries(parsem3u.asLines(result))
 
                     result = None
 
-                    self.nextJob(_("Processing series data..."), self.processSeries)
+                    self.nextJob(_("Processing series data..."), self.createSeriesBouquets)
                 else:
                     print("*** all methods failed ***")
                     self.finished()
@@ -860,93 +1086,75 @@ class BmxUpdate(Screen):
             print("*** parseXtreamSeries_streaming ***")
 
         try:
-            self.series_streams = seriesparsem3u.parseM3u8Playlist_streaming(pipe_process)
+            self.spoolSeries(iter(pipe_process.stdout.readline, b""))
         finally:
             pipe_process.stdout.close()
             pipe_process.wait()  # Ensure curl finishes
 
-        if not self.series_streams:
+        if not self.series_spool:
             self.finished()
             return
 
         self.progress_value += 1
-        self["progress"].setValue(self.progress_value)
-        self.nextJob(_("Processing series data..."), self.processSeries)
+        self.runner.post(self["progress"].setValue, self.progress_value)
+        self.nextJob(_("Processing series data..."), self.createSeriesBouquets)
 
     def processSeries(self):
         if debugs:
             print("*** processSeries ***")
 
-        if self.settings["vod_stream_order"] == "alphabetical":
-            self.series_streams.sort(key=lambda x: x["name"].lower())
-
-        elif self.settings["vod_stream_order"] == "added":
-            self.series_streams.sort(key=lambda x: x["added"], reverse=True)
-
-        BATCH_SIZE = 20000
-        stream_type = self.settings["vod_type"]
+        # m3u playlists: the episodes are already in memory, they go through the spool in stream order
+        store = streamstore.StreamStore(self.series_streams, "series_id")
+        encoder = servicerefs.ServiceRefEncoder(self.settings["vod_type"], self.unique_ref)
+        self.series_spool = seriesspool.SeriesSpool(dir_tmp())
 
-        def process_stream_batch(streams_batch):
-            batch_data = []
-            for channel in streams_batch:
-
-                category_id = channel.get("category_id")
-                name = channel.get("name")
-                stream_id = channel.get("series_id")
+        for row in store.sortedRows(self.settings["vod_stream_order"]):
+            bouquet_string = self.seriesServiceLine(store.streams[row], encoder)
+            if bouquet_string:
+                self.series_spool.add(store.categoryId(row), bouquet_string)
 
-                if not category_id or not name:
-                    continue
+        self.series_streams = []
+        self.createSeriesBouquets()
 
-                try:
-                    stream_id = int(stream_id)
-                except:
-                    continue
+    def spoolSeries(self, lines):
+        # xtream get.php: episodes go from the parser straight to the spool, none are kept
+        encoder = servicerefs.ServiceRefEncoder(self.settings["vod_type"], self.unique_ref)
+        sort_key = seriesspool.nameKey() if self.settings["vod_stream_order"] == "alphabetical" else None
+        self.series_spool = seriesspool.SeriesSpool(dir_tmp(), sort_key)
 
-                name = channel.get("name") or ""
-                name = name.replace(":", "").replace('"', "").replace('•', "-").strip("- ").strip()
+        for channel in seriesparsem3u.iterSeriesStreams(lines):
+            bouquet_string = self.seriesServiceLine(channel, encoder)
+            if bouquet_string:
+                self.series_spool.add(str(channel.get("category_id")), bouquet_string)
 
-                try:
-                    bouquet_id1 = int(stream_id) // 65535
-                    bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
-                except:
-                    continue
-
-                custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(self.unique_ref, "x")) + ":0:0:0:0:"
-                bouquet_string = ""
-
-                source = quote(channel.get("source", ""))
-                bouquet_string += "#SERVICE " + str(stream_type) + str(custom_sid) + str(source) + ":" + str(name) + "\n"
+        self.series_streams = []
 
-                batch_data.append({
-                    "category_id": str(category_id),
-                    "bouquet_string": bouquet_string,
-                    "name": str(name),
-                    "added": str(channel.get("added", "0"))
-                })
-            return batch_data
+    def seriesServiceLine(self, channel, encoder):
+        category_id = channel.get("category_id")
+        name = channel.get("name") or ""
+        name = name.replace(":", "").replace('"', "").replace('•', "-").strip("- ").strip()
+        stream_id = channel.get("series_id")
 
-        # Process all streams in manageable batches
-        total_streams = len(self.series_streams)
-        all_series_data = []
+        if not category_id or not name:
+            return None
 
-        for batch_start in range(0, total_streams, BATCH_SIZE):
-            batch_end = min(batch_start + BATCH_SIZE, total_streams)
-            batch = self.series_streams[batch_start:batch_end]
-            batch_data = process_stream_batch(batch)
-            all_series_data.extend(batch_data)
+        try:
+            stream_id = int(stream_id)
+        except:
+            return None
 
-            # Clear memory between batches
-            if batch_start % 200 == 0:  # Clear memory every 2 batches
-                self.clearCaches()
+        return encoder.line(stream_id, str(name), source=channel.get("source", ""))
 
-        self.series_stream_data = all_series_data
-        self.createSeriesBouquets()
+    def closeSeriesSpool(self):
+        if self.series_spool is not None:
+            self.series_spool.close()
+            self.series_spool = None
 
     def createSeriesBouquets(self):
         if debugs:
             print("*** createSeriesBouquets ***")
 
-        if not self.series_stream_data:
+        if not self.series_spool:
             self.finished()
             return
 
@@ -960,13 +1168,8 @@ class BmxUpdate(Screen):
 
         bouquet_filename = ""
 
-        # Build dictionary for fast category lookups
-        cat_map = {}
-        for stream in self.series_stream_data:
-            cat_id = str(stream["category_id"])
-            if cat_id not in cat_map:
-                cat_map[cat_id] = []
-            cat_map[cat_id].append(stream)
+        # the rendered episodes of each category are in the spool
+        cat_map = self.series_spool
 
         # Write top-level bouquet entries
         for category in self.series_categories:
@@ -990,8 +1193,7 @@ class BmxUpdate(Screen):
             bouquet_tv_string += '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + bouquet + ".bouquetmakerxtream_series_" + str(self.name) + "_" + bmx.safeName(category["category_name"]) + '.tv" ORDER BY bouquet\n'
 
         if bouquet_filename:
-            with open(bouquet_filename, "a+") as f:
-                f.write(str(bouquet_tv_string))
+            self.writer.append(bouquet_filename, str(bouquet_tv_string))
 
             category_batches = [self.series_categories[i:i + 10] for i in range(0, len(self.series_categories), 10)]
 
@@ -1019,143 +1221,125 @@ class BmxUpdate(Screen):
                     else:
                         output_string += "#NAME " + "Series - " + category["category_name"] + "\n"
 
-                    for stream in cat_map[str(category_id)]:
-                        output_string += stream["bouquet_string"]
+                    output_string += cat_map.text(str(category_id))
 
                     if cfg.groups.value:
                         filename = "/etc/enigma2/subbouquet.bouquetmakerxtream_series_" + str(bouquet_title) + ".tv"
                     else:
                         filename = "/etc/enigma2/userbouquet.bouquetmakerxtream_series_" + str(bouquet_title) + ".tv"
 
-                    with open(filename, "w+") as f:
-                        f.write(output_string)
+                    self.writer.write(filename, output_string)
 
+        self.closeSeriesSpool()
         self.clearCaches()
         self.finished()
 
     def buildBouquetTvGroupedFile(self):
         if debugs:
             print("*** buildBouquetTvGroupedFile ***")
-        exists = False
         groupname = "userbouquet.bouquetmakerxtream_" + str(self.name) + ".tv"
-        with open("/etc/enigma2/bouquets.tv", "r") as f:
-            for ln, line in enumerate(f):
-                if str(groupname) in line:
-                    exists = True
-                    break
 
-        if not exists:
-            with open("/etc/enigma2/bouquets.tv", "a+") as f:
-                bouquet_tv_string = '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + str(groupname) + '" ORDER BY bouquet\n'
-                f.write(str(bouquet_tv_string))
+        if not self.bouquets_tv.contains(groupname):
+            bouquet_tv_string = '#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "' + str(groupname) + '" ORDER BY bouquet\n'
+            self.bouquets_tv.append(bouquet_tv_string)
 
         self.bouquet_tv = True
 
     def buildXmltvSource(self):
         if debugs:
             print("*** buildXmltvSource ***")
-        import xml.etree.ElementTree as ET
-
-        file_path = "/etc/epgimport/"
-        epg_filename = "bouquetmakerxtream." + str(self.name) + ".channels.xml"
-        channel_path = os.path.join(file_path, epg_filename)
-        source_file = "/etc/epgimport/bouquetmakerxtream.sources.xml"
-
-        if not os.path.isfile(source_file) or os.stat(source_file).st_size == 0:
-            with open(source_file, "w") as f:
-                xml_str = '<?xml version="1.0" encoding="utf-8"?>\n'
-                xml_str += "<sources>\n"
-                xml_str += '<sourcecat sourcecatname="BouquetMakerXtream EPG">\n'
-                xml_str += "</sourcecat>\n"
-                xml_str += "</sources>\n"
-                f.write(xml_str)
 
+        epg_offset = 0
         try:
-            tree = ET.parse(source_file, parser=ET.XMLParser(encoding="utf-8"))
-            root = tree.getroot()
-            sourcecat = root.find("sourcecat")
-
-            for elem in root.iter():
-                for child in list(elem):
-                    description = ""
-                    if child.tag == "source":
-                        try:
-                            description = child.find("description").text
-
-                            if str(self.name) == str(description):
-                                elem.remove(child)
-                        except:
-                            pass
-
-            epg_offset = 0
-            try:
-                epg_offset = int(self.settings.get("epg_offset", 0))
-            except:
-                pass
+            epg_offset = int(self.settings.get("epg_offset", 0))
+        except:
+            pass
 
-            if epg_offset > 0:
-                offset_str = "-{0:02d}00".format(epg_offset)
-            elif epg_offset < 0:
-                offset_str = "{0:02d}00".format(abs(epg_offset))
-            else:
-                offset_str = "0000"
-
-            source = ET.SubElement(
-                sourcecat,
-                "source",
-                type="gen_xmltv",
-                nocheck="1",
-                offset=offset_str,
-                channels=channel_path
-            )
+        if epg_offset > 0:
+            offset_str = "-{0:02d}00".format(epg_offset)
+        elif epg_offset < 0:
+            offset_str = "{0:02d}00".format(abs(epg_offset))
+        else:
+            offset_str = "0000"
+
+        # the sources file is read once per run and written by saveXmltvSources()
+        if self.epg_sources is None:
+            self.epg_sources = epgsources.EpgSources()
 
-            description = ET.SubElement(source, "description")
-            description.text = str(self.name)
+        self.epg_sources.setSource(self.name, xmltvchannels.channelsPath(self.name), self.xmltv_api, offset_str)
 
-            url = ET.SubElement(source, "url")
-            url.text = str(self.xmltv_api)
+        self.buildXmltvChannels()
+
+    def checkpointModels(self):
+        if self.bouquets_tv is not None:
+            self.bouquets_tv.checkpoint()
+        if self.epg_sources is not None:
+            self.epg_sources.checkpoint()
+
+    def rollbackModels(self):
+        if self.bouquets_tv is not None and not self.bouquets_tv.rollback():
+            self.bouquets_tv = None
+        if self.epg_sources is not None and not self.epg_sources.rollback():
+            self.epg_sources = None
+
+    def saveBouquetsTv(self):
+        if self.bouquets_tv is not None:
+            self.bouquets_tv.save()
+            self.bouquets_tv = None
+
+    def saveXmltvSources(self):
+        if self.epg_sources is not None:
+            self.epg_sources.save()
+            self.epg_sources = None
+
+    def buildXmltvGuide(self):
+        if debugs:
+            print("*** buildXmltvGuide ***")
 
-            tree.write(source_file)
+        self.runner.post(self["action"].setText, _("Updating XMLTV guide..."))
 
+        try:
+            xmltvguide.updateGuide(self.xmltv_api, self.host, self.username, self.guide_streams, self.runner.checkCancelled)
+        except worker.Cancelled:
+            raise
         except Exception as e:
             print(e)
 
+    def matchEpgChannels(self, store, rows):
+        """Epg channel ids, matched by name in the provider's XMLTV, of the rows it sent without one. row -> id."""
+        unmatched = [row for row in rows if not store.epg_ids[row]]
+        if not unmatched:
+            return {}
+
+        if debugs:
+            print("*** matchEpgChannels ***", len(unmatched))
+
+        self.runner.post(self["action"].setText, _("Matching EPG channels..."))
+
         try:
-            with open(source_file, "r+") as f:
-                xml_str = f.read()
-                f.seek(0)
-                doc = minidom.parseString(xml_str)
-                xml_output = doc.toprettyxml(encoding="utf-8", indent="\t")
-                try:
-                    xml_output = os.linesep.join([s for s in xml_output.splitlines() if s.strip()])
-                except:
-                    xml_output = os.linesep.join([s for s in xml_output.decode().splitlines() if s.strip()])
-                f.write(xml_output)
+            matches = epgmatch.matchChannels(self.name, self.xmltv_api, [store.names[row] for row in unmatched])
         except Exception as e:
             print(e)
+            return {}
 
-        self.buildXmltvChannels()
+        return dict((row, matches[store.names[row]]) for row in unmatched if store.names[row] in matches)
 
     def buildXmltvChannels(self):
         if debugs:
             print("*** buildXmltvChannels ***")
-        file_path = "/etc/epgimport/"
-        epg_filename = "bouquetmakerxtream." + str(self.name) + ".channels.xml"
-        channel_path = os.path.join(file_path, epg_filename)
 
-        if not os.path.isfile(channel_path):
-            open(channel_path, "a").close()
+        if self.channels_writer is None:
+            # no live channels were rendered, the channels file is left empty
+            self.channels_writer = xmltvchannels.ChannelsWriter(xmltvchannels.channelsPath(self.name))
 
-        with open(channel_path, "w") as f:
-            xml_str = '<?xml version="1.0" encoding="utf-8"?>\n'
-            xml_str += "<channels>\n"
+        self.channels_writer.commit()
+        self.channels_writer = None
+        self.channels_committed = True
 
-            if self.live_stream_data:
-                for stream in self.live_stream_data:
-                    if stream["xml_str"] and stream["xml_str"] is not None:
-                        xml_str += stream["xml_str"]
-            xml_str += "</channels>\n"
-            f.write(xml_str)
+    def abortXmltvChannels(self):
+        if self.channels_writer is not None:
+            self.channels_writer.abort()
+            self.channels_writer = None
 
     def clearCaches(self):
         if debugs:
@@ -1168,6 +1352,18 @@ class BmxUpdate(Screen):
             pass
 
     def finished(self):
+        if self.writer:
+            self.writer.finish()
+            self.writer = None
+            self.purgeOldFiles()
+        self.closeSeriesSpool()
+        self.abortXmltvChannels()
+        self.checkpointModels()
+        self.saveDigest()
+        for path in self.spooled.values():
+            bmx.releaseSpoolFile(path)
+        self.spooled = {}
+        self.decoded = {}
         self.updateJson()
         self.clearCaches()
         self.bouq += 1
@@ -1192,5 +1388,11 @@ class BmxUpdate(Screen):
             json.dump(self.playlists_all, f, indent=4)
 
     def done(self, answer=None):
-        bmx.refreshBouquets()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+        # nothing to reload if every provider was unchanged
+        if self.changed:
+            bmx.refreshBouquets()
         self.close()
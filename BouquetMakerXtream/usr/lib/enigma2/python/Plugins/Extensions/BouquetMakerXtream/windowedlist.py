@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# rows built either side of the selection, a couple of pages on any skin
+WINDOW = 40
+
+
+class WindowedList(object):
+    """
+    List entries for a long list, built only around the selection.
+
+    entries has a slot for every item and is what gets passed to List.setList(). Slots hold
+    the shared placeholder until show() builds the rows around an index, so a category of
+    20k channels costs one list allocation up front instead of 20k entries.
+    """
+
+    def __init__(self, items, build, placeholder, window=WINDOW):
+        self.items = items
+        self.build = build
+        self.window = window
+        self.entries = [placeholder] * len(items)
+        self.built = bytearray(len(items))
+
+    def show(self, index):
+        """Build the missing rows around index. Returns the indexes that were built."""
+        index = index or 0
+        start = max(0, index - self.window)
+        end = min(len(self.items), index + self.window + 1)
+        changed = []
+
+        for i in range(start, end):
+            if not self.built[i]:
+                self.entries[i] = self.build(self.items[i])
+                self.built[i] = 1
+                changed.append(i)
+
+        return changed
+
+    def invalidate(self):
+        # the items changed, rows are rebuilt as they come into view again
+        self.built = bytearray(len(self.items))
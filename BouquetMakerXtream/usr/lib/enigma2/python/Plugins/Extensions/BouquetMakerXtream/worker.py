@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .plugin import debugs
+
+import threading
+import traceback
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+class Cancelled(Exception):
+    pass
+
+
+class StageRunner(object):
+    """
+    Runs the build stages of a screen on one background thread.
+
+    Stages are queued with submit() and run in order. Each stage queues the next one itself,
+    the same way the screens chained eTimer callbacks. Anything that touches the GUI or enigma
+    is handed back with post() and run by poll(), which the screen calls from a repeating eTimer.
+
+    cancel() stops the chain before the next stage (or at the next checkCancelled() / waitFor()
+    inside a stage) and posts on_stop. on_stop is also posted if a stage raises.
+    """
+
+    def __init__(self, on_stop=None):
+        self.jobs = Queue()
+        self.ui = Queue()
+        self.cancelled = threading.Event()
+        self.on_stop = on_stop
+        self.main_thread = threading.current_thread()
+        self.thread = None
+        self.stopped = False
+
+    def start(self, function):
+        self.jobs.put(function)
+        self.thread = threading.Thread(target=self.run, name="BmxStageRunner")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, function):
+        self.jobs.put(function)
+
+    def run(self):
+        while True:
+            function = self.jobs.get()
+
+            if function is None:
+                return
+
+            if self.cancelled.is_set():
+                self.stop()
+                return
+
+            try:
+                function()
+            except Cancelled:
+                if debugs:
+                    print("*** StageRunner cancelled ***")
+                self.stop()
+                return
+            except Exception:
+                traceback.print_exc()
+                self.stop()
+                return
+
+    def stop(self):
+        if not self.stopped:
+            self.stopped = True
+            if self.on_stop:
+                self.post(self.on_stop)
+
+    def post(self, function, *args):
+        # called from the main loop itself (screen callbacks), run straight away
+        if threading.current_thread() is self.main_thread:
+            function(*args)
+        else:
+            self.ui.put((function, args))
+
+    def poll(self):
+        while True:
+            try:
+                function, args = self.ui.get_nowait()
+            except Empty:
+                return
+            try:
+                function(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def cancel(self):
+        self.cancelled.set()
+        # an idle worker only notices on its next job
+        self.jobs.put(self.checkCancelled)
+
+    def checkCancelled(self):
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+    def waitFor(self, future, interval=0.2):
+        """Block the worker on a concurrent.futures future, staying responsive to cancel()."""
+        while not future.done():
+            if self.cancelled.wait(interval):
+                raise Cancelled()
+        return future.result()
+
+    def shutdown(self):
+        self.jobs.put(None)
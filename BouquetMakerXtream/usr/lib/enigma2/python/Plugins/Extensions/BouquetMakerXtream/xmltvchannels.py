@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from .plugin import debugs
+
+import os
+import tempfile
+
+EPGIMPORT_DIR = "/etc/epgimport"
+
+
+def channelsPath(name):
+    return os.path.join(EPGIMPORT_DIR, "bouquetmakerxtream." + str(name) + ".channels.xml")
+
+
+class ChannelsWriter(object):
+    """
+    Writes an epgimport channels file one <channel> element at a time.
+
+    Elements go straight to a temp file next to the channels file, so memory does not grow
+    with the channel count. commit() closes the document and renames it over the old file,
+    epgimport never reads a half written one. abort() drops the temp file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".bmx_", suffix=".tmp", dir=os.path.dirname(path))
+        self.file = os.fdopen(fd, "wb")
+        self.write('<?xml version="1.0" encoding="utf-8"?>\n<channels>\n')
+
+    def write(self, text):
+        self.file.write(text if isinstance(text, bytes) else text.encode("utf-8"))
+
+    def add(self, channel_id, service_ref, name):
+        channel_id = str(channel_id).replace("&", "&amp;")
+        self.write('\t<channel id="' + channel_id + '">' + str(service_ref) + "</channel><!-- " + str(name) + " -->\n")
+        self.count += 1
+
+    def commit(self):
+        try:
+            self.write("</channels>\n")
+            self.file.close()
+            os.chmod(self.tmp_path, 0o644)
+            os.rename(self.tmp_path, self.path)
+        except:
+            self.abort()
+            raise
+
+        if debugs:
+            print("*** ChannelsWriter ***", self.path, self.count, "channels")
+
+    def abort(self):
+        try:
+            self.file.close()
+        except:
+            pass
+        try:
+            os.remove(self.tmp_path)
+        except:
+            pass
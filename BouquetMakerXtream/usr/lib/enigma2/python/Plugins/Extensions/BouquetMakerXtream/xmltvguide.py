@@ -0,0 +1,257 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from . import extsort
+from . import httpclient
+from .bouquetwriter import writeIfChanged
+from .globalfunctions import hdr
+from .plugin import cfg, debugs, dir_tmp
+
+from datetime import datetime, timedelta
+
+import calendar
+import gzip
+import hashlib
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+# A provider's xmltv.php kept on disk and indexed, so catchup lists a channel's archive without
+# asking the provider. Files live in cfg.xmltv_guide_location, or the tmp dir if it does not exist,
+# boxes sharing that path share the guide:
+#   <name>.xmltv  the download as received (plain or gzip), removed once .data is built
+#   <name>.data   one json line [start, stop, title, desc] per programme, by channel then start
+#   <name>.idx    json: build time, channel id -> [offset, length] in .data, stream id -> [channel id, archive days]
+
+# a guide younger than this is reused instead of downloaded again, an older one is not used by catchup
+MAX_AGE = 12 * 3600
+
+_indexes = {}
+
+
+def guideBase(host, username):
+    netloc = urlparse(str(host)).netloc.lower() or str(host).lower()
+    name = hashlib.sha1((netloc + "/" + str(username)).encode("utf-8")).hexdigest()[:16]
+    location = cfg.xmltv_guide_location.value
+    if not os.path.isdir(location):
+        location = dir_tmp()
+    return os.path.join(location, "bmx_guide_" + name)
+
+
+def parseTime(value):
+    """XMLTV time, "20240101120000 +0100", as a unix timestamp."""
+    value = value.strip()
+    stamp = calendar.timegm(time.strptime(value[:14], "%Y%m%d%H%M%S"))
+    offset = value[14:].strip()
+
+    if len(offset) == 5 and offset[0] in "+-":
+        seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+        stamp = stamp - seconds if offset[0] == "+" else stamp + seconds
+
+    return stamp
+
+
+def openXmltv(path):
+    f = open(path, "rb")
+    if f.read(2) == b"\x1f\x8b":
+        f.close()
+        return gzip.open(path, "rb")
+    f.seek(0)
+    return f
+
+
+def iterProgrammes(source):
+    """(channel, start, stop, title, desc) of every <programme>, parsed incrementally from a file object."""
+    context = ET.iterparse(source, events=("start", "end"))
+    root = None
+
+    for event, elem in context:
+        if root is None:
+            root = elem
+            continue
+
+        if event == "end" and elem.tag == "programme":
+            try:
+                yield (elem.get("channel").strip(), parseTime(elem.get("start")), parseTime(elem.get("stop")), elem.findtext("title") or "", elem.findtext("desc") or "")
+            except Exception:
+                pass
+            # parsed programmes are dropped, memory stays flat however large the guide is
+            root.clear()
+
+
+def download(url, path, check=None):
+    tmp_path = path + ".tmp"
+    try:
+        with httpclient.get(url, headers=hdr, timeout=(20, 300), stream=True) as r:
+            r.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    if check:
+                        check()
+                    f.write(chunk)
+        os.rename(tmp_path, path)
+    except:
+        try:
+            os.remove(tmp_path)
+        except:
+            pass
+        raise
+
+
+def buildData(xmltv_path, data_path, check=None):
+    """Write the .data file of a downloaded guide. Returns channel id -> [offset, length]."""
+    def keyed():
+        with openXmltv(xmltv_path) as f:
+            for number, (channel, start, stop, title, desc) in enumerate(iterProgrammes(f)):
+                if check and not number % 1000:
+                    check()
+                # \x00 sorts first, so the programmes of a channel stay together
+                yield channel + "\x00%011d" % start, channel + "\t" + json.dumps([start, stop, title, desc])
+
+    channels = {}
+    offset = 0
+    tmp_path = data_path + ".tmp"
+
+    try:
+        with open(tmp_path, "wb") as out:
+            for payload in extsort.sortKeyed(keyed(), dir_tmp()):
+                channel, programme = payload.split("\t", 1)
+                line = (programme + "\n").encode("utf-8")
+
+                entry = channels.get(channel)
+                if entry is None:
+                    entry = channels[channel] = [offset, 0]
+                entry[1] += len(line)
+
+                out.write(line)
+                offset += len(line)
+        os.rename(tmp_path, data_path)
+    except:
+        try:
+            os.remove(tmp_path)
+        except:
+            pass
+        raise
+
+    return channels
+
+
+def loadIndex(index_path):
+    try:
+        mtime = os.path.getmtime(index_path)
+    except OSError:
+        return None
+
+    cached = _indexes.get(index_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except Exception as e:
+        print(e)
+        return None
+
+    _indexes[index_path] = (mtime, index)
+    return index
+
+
+def updateGuide(url, host, username, streams, check=None):
+    """
+    Refresh the local guide of a provider for the catchup streams, stream id -> [epg channel id, archive days].
+
+    The XMLTV is downloaded and indexed again once the guide is older than MAX_AGE, the stream
+    map is replaced on every call. streams None keeps the map of the last build, for providers
+    whose bouquets were not rebuilt. check is called while downloading and parsing, to cancel.
+    """
+    base = guideBase(host, username)
+    index = loadIndex(base + ".idx")
+
+    if streams is None:
+        if not index:
+            return
+        streams = index.get("streams", {})
+
+    if index and time.time() - index.get("built", 0) < MAX_AGE and os.path.isfile(base + ".data"):
+        built, channels = index["built"], index["channels"]
+    else:
+        download(url, base + ".xmltv", check)
+        try:
+            channels = buildData(base + ".xmltv", base + ".data", check)
+        finally:
+            # the raw download can be hundreds of MB, only .data is kept
+            try:
+                os.remove(base + ".xmltv")
+            except OSError:
+                pass
+        built = time.time()
+
+    writeIfChanged(base + ".idx", json.dumps({"built": built, "channels": channels, "streams": streams}))
+
+    if debugs:
+        print("*** updateGuide ***", base, len(channels), "channels", len(streams), "streams")
+
+
+def programmes(host, username, stream_id):
+    """[start, stop, title, desc] of a stream's channel ordered by start, and its archive days. None if the guide lacks it or is stale."""
+    base = guideBase(host, username)
+    index = loadIndex(base + ".idx")
+    if not index or time.time() - index.get("built", 0) >= MAX_AGE:
+        return None
+
+    stream = index["streams"].get(str(stream_id))
+    entry = stream and index["channels"].get(stream[0])
+    if not entry:
+        return None
+
+    try:
+        with open(base + ".data", "rb") as f:
+            f.seek(entry[0])
+            block = f.read(entry[1])
+    except Exception as e:
+        print(e)
+        return None
+
+    return [json.loads(line) for line in block.decode("utf-8").splitlines()], stream[1]
+
+
+def catchupListings(host, username, stream_id, server_offset=0):
+    """
+    The archive of a stream in the shape of get_simple_data_table's epg_listings, with title and
+    description not base64 encoded. Times are server time, local time less server_offset hours.
+    None if the local guide does not have the stream or is older than MAX_AGE, catchup then asks
+    the provider.
+    """
+    found = programmes(host, username, stream_id)
+    if found is None:
+        return None
+
+    rows, archive_days = found
+    now = time.time()
+    oldest = now - int(archive_days or 0) * 86400
+    listings = []
+
+    for start, stop, title, desc in rows:
+        has_archive = oldest <= start and stop <= now
+        now_playing = start <= now < stop
+
+        if not has_archive and not now_playing:
+            continue
+
+        listings.append({
+            "title": title,
+            "description": desc,
+            "start": (datetime.fromtimestamp(start) - timedelta(hours=server_offset)).strftime("%Y-%m-%d %H:%M:%S"),
+            "end": (datetime.fromtimestamp(stop) - timedelta(hours=server_offset)).strftime("%Y-%m-%d %H:%M:%S"),
+            "has_archive": int(has_archive),
+            "now_playing": int(now_playing),
+        })
+
+    return listings
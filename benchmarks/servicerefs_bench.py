@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+ServiceRefEncoder against the per-row loop that loadLive()/loadVod() used before it.
+
+Runs outside enigma2, servicerefs.py has no plugin imports and is loaded by path:
+
+    python benchmarks/servicerefs_bench.py [streams]
+
+Both sides build the #SERVICE lines and epg service refs of the same streams, the output is
+compared before anything is timed.
+"""
+
+import os
+import random
+import sys
+import timeit
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "BouquetMakerXtream", "usr", "lib", "enigma2", "python", "Plugins", "Extensions", "BouquetMakerXtream")
+
+
+def loadServiceRefs():
+    path = os.path.join(PLUGIN_DIR, "servicerefs.py")
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("servicerefs", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except ImportError:
+        import imp
+        return imp.load_source("servicerefs", path)
+
+
+servicerefs = loadServiceRefs()
+
+STREAM_TYPE = "4097"
+UNIQUE_REF = 1234
+HOST = "http://example.com:8080"
+USERNAME = "user"
+PASSWORD = "pass"
+OUTPUT = "ts"
+CUSTOM_SID_SHARE = 0.25
+REPEAT = 5
+
+
+def makeStreams(count):
+    rnd = random.Random(0)
+    streams = []
+    for index in range(count):
+        stream_id = rnd.randint(1, 3000000)
+        custom_sid = None
+        if rnd.random() < CUSTOM_SID_SHARE:
+            custom_sid = "1:0:1:%x:%x:1:c00000:0:0:0:" % (rnd.randint(1, 65535), rnd.randint(1, 65535))
+        streams.append({
+            "stream_id": stream_id,
+            "name": "Channel %d" % index,
+            "source": "http://example.com/live/%d.m3u8?token=a b&c=%d" % (stream_id, index),
+            "custom_sid": custom_sid,
+        })
+    return streams
+
+
+def oldXtream(streams):
+    host_encoded = quote(HOST)
+    lines = []
+    refs = []
+    for channel in streams:
+        stream_id = channel["stream_id"]
+        name = channel["name"]
+        bouquet_id1 = int(stream_id) // 65535
+        bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
+
+        service_ref = "1:0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(UNIQUE_REF, "x")) + ":0:0:0:0:http%3a//example.m3u8"
+        custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(UNIQUE_REF, "x")) + ":0:0:0:0:"
+
+        if "custom_sid" in channel and channel["custom_sid"] and str(channel["custom_sid"]) not in ("null", "None", "0", ":0:0:0:0:0:0:0:0:0:") and len(channel["custom_sid"]) > 16:
+            custom_sid = str(channel["custom_sid"])
+            if custom_sid[0].isdigit():
+                custom_sid = custom_sid[1:]
+
+            service_ref = str(":".join(custom_sid.split(":")[:7])) + ":0:0:0:http%3a//example.m3u8"
+
+        lines.append("#SERVICE " + str(STREAM_TYPE) + str(custom_sid) + str(host_encoded) + "/live/" + str(USERNAME) + "/" + str(PASSWORD) + "/" + str(stream_id) + "." + str(OUTPUT) + ":" + str(name) + "\n")
+        refs.append(service_ref)
+    return lines, refs
+
+
+def newXtream(streams):
+    encoder = servicerefs.ServiceRefEncoder(STREAM_TYPE, UNIQUE_REF, quote(HOST) + "/live/" + USERNAME + "/" + PASSWORD + "/")
+    stream_ids = [channel["stream_id"] for channel in streams]
+    names = [channel["name"] for channel in streams]
+    custom_sids = [servicerefs.customSid(channel["custom_sid"]) for channel in streams]
+    return encoder.render(stream_ids, names, extensions=OUTPUT, custom_sids=custom_sids), encoder.serviceRefs(stream_ids, custom_sids)
+
+
+def oldM3u(streams):
+    lines = []
+    for channel in streams:
+        stream_id = channel["stream_id"]
+        bouquet_id1 = int(stream_id) // 65535
+        bouquet_id2 = int(stream_id) - int(bouquet_id1 * 65535)
+        custom_sid = ":0:1:" + str(format(bouquet_id1, "x")) + ":" + str(format(bouquet_id2, "x")) + ":" + str(format(UNIQUE_REF, "x")) + ":0:0:0:0:"
+        source = quote(channel.get("source", ""))
+        lines.append("#SERVICE " + str(STREAM_TYPE) + str(custom_sid) + str(source) + ":" + str(channel["name"]) + "\n")
+    return lines
+
+
+def newM3u(streams):
+    encoder = servicerefs.ServiceRefEncoder(STREAM_TYPE, UNIQUE_REF)
+    stream_ids = [channel["stream_id"] for channel in streams]
+    names = [channel["name"] for channel in streams]
+    sources = [channel.get("source", "") for channel in streams]
+    return encoder.render(stream_ids, names, sources=sources)
+
+
+def best(function, streams):
+    return min(timeit.repeat(lambda: function(streams), number=1, repeat=REPEAT))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    streams = makeStreams(count)
+
+    cases = (
+        ("xtream live loop (lines + epg refs, %d%% custom sids)" % (CUSTOM_SID_SHARE * 100), oldXtream, newXtream),
+        ("m3u loop (quoted sources)", oldM3u, newM3u),
+    )
+
+    print("%d streams, Python %s, best of %d" % (count, sys.version.split()[0], REPEAT))
+    for label, old, new in cases:
+        if old(streams) != new(streams):
+            print("%s: output differs" % label)
+            sys.exit(1)
+        print("%-52s %.3fs -> %.3fs" % (label + ":", best(old, streams), best(new, streams)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Memory held by the builders' per stream dicts against the streamrecords records.
+
+Runs outside enigma2 with Python 3, streamrecords.py has no plugin imports and is loaded by path:
+
+    python3 benchmarks/streamrecords_memory.py [entries]
+
+Each side is built from the same input and measured with tracemalloc as what is still
+allocated once its list is complete, so the decoded input it was built from is not counted.
+"""
+
+import gc
+import importlib.util
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "BouquetMakerXtream", "usr", "lib", "enigma2", "python", "Plugins", "Extensions", "BouquetMakerXtream")
+
+
+def loadStreamRecords():
+    spec = importlib.util.spec_from_file_location("streamrecords", os.path.join(PLUGIN_DIR, "streamrecords.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+streamrecords = loadStreamRecords()
+
+# globalfunctions.stream_keys[3] and stream_optional_keys[3]
+LIVE_KEYS = ("name", "stream_id", "stream_icon", "epg_channel_id", "added", "category_id", "custom_sid", "tv_archive")
+LIVE_OPTIONAL_KEYS = ("tv_archive_duration",)
+CATEGORIES = 400
+
+
+def liveStreamsJson(count):
+    """A player_api.php get_live_streams body, with the fields providers send that are not kept."""
+    rnd = random.Random(0)
+    items = []
+    for index in range(count):
+        stream_id = rnd.randint(1, 3000000)
+        items.append({
+            "num": index + 1,
+            "name": "UK: Channel %d HD" % index,
+            "stream_type": "live",
+            "stream_id": stream_id,
+            "stream_icon": "http://example.com/logos/%d.png" % stream_id,
+            "epg_channel_id": "channel%d.uk" % index if rnd.random() < 0.7 else None,
+            "added": str(1600000000 + index),
+            "is_adult": "0",
+            "category_id": str(rnd.randint(1, CATEGORIES)),
+            "category_ids": [rnd.randint(1, CATEGORIES)],
+            "custom_sid": "",
+            "tv_archive": rnd.randint(0, 1),
+            "direct_source": "",
+            "tv_archive_duration": rnd.randint(0, 7),
+        })
+    return json.dumps(items)
+
+
+def bouquetRows(count):
+    rnd = random.Random(1)
+    return [
+        (str(rnd.randint(1, CATEGORIES)), "#SERVICE 4097:0:1:%x:%x:4d2:0:0:0:0:http%%3a//example.com%%3a8080/live/user/pass/%d.ts:Channel %d\n" % (index // 65535, index % 65535, index, index), "Channel %d" % index, str(1600000000 + index))
+        for index in range(count)
+    ]
+
+
+def project(items, keys):
+    # jsonstream.project(), which the records replaced
+    for item in items:
+        if isinstance(item, dict) and all(k in item for k in keys):
+            yield dict((k, item[k]) for k in keys)
+
+
+def oldLive(text):
+    return list(project(json.loads(text), LIVE_KEYS + LIVE_OPTIONAL_KEYS))
+
+
+def newLive(text):
+    return list(streamrecords.fromItems(json.loads(text), 3, LIVE_KEYS, LIVE_OPTIONAL_KEYS))
+
+
+def oldRows(rows):
+    return [{"category_id": str(category_id), "bouquet_string": bouquet_string, "name": str(name), "added": str(added)} for category_id, bouquet_string, name, added in rows]
+
+
+def newRows(rows):
+    return [streamrecords.BouquetLine(category_id=str(category_id), bouquet_string=bouquet_string, name=str(name), added=str(added)) for category_id, bouquet_string, name, added in rows]
+
+
+def retained(build, source):
+    """Bytes still allocated once build(source) returns, the result kept alive."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build(source)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def copyRows(rows):
+    # fresh strings for each side, so neither measures strings the other allocated
+    return [tuple("".join(list(value)) for value in row) for row in rows]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    text = liveStreamsJson(count)
+    rows = bouquetRows(count)
+
+    if [dict((k, record[k]) for k in LIVE_KEYS + LIVE_OPTIONAL_KEYS if k in record) for record in newLive(text)] != oldLive(text):
+        print("live streams differ")
+        sys.exit(1)
+
+    mb = 1024.0 * 1024.0
+    print("tracemalloc, %d entries, Python %s" % (count, sys.version.split()[0]))
+    print("  parsed live streams   dicts %.1f MB -> records %.1f MB" % (retained(oldLive, text) / mb, retained(newLive, text) / mb))
+    print("  rendered bouquet rows dicts %.1f MB -> records %.1f MB" % (retained(oldRows, copyRows(rows)) / mb, retained(newRows, copyRows(rows)) / mb))
+
+
+if __name__ == "__main__":
+    main()